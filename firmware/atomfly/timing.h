@@ -0,0 +1 @@
+../common/timing.h
\ No newline at end of file
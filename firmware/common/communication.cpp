@@ -1,14 +1,48 @@
 #include "communication.h"
 
+#include <string.h>
+
 #include "registers.h"
 
 const int kTimeoutMillis = 300;
+// Telemetry is not pushed faster than the control loop.
+const int kMinTelemetryIntervalMillis = 5;
 
 long last_receive_time;
 int16_t reg[N_REGISTERS];
 
 namespace {
 
+// Time spent in OnUdpReceived() since the last TakeReceiveMicros().
+unsigned long receive_micros;
+portMUX_TYPE receive_micros_mux = portMUX_INITIALIZER_UNLOCKED;
+
+// Registers pushed to the subscriber by TelemetryTask().
+struct {
+  int interval_millis;  // 0 when there is no subscriber.
+  int addr;
+  int size;
+  long next_millis;
+} subscription;
+// The subscription is changed by OnUdpReceived() on the AsyncUDP task and
+// used by TelemetryTask() on the control loop.
+portMUX_TYPE subscription_mux = portMUX_INITIALIZER_UNLOCKED;
+
+// Snapshots of the status registers for the delta-encoded status (0x6).
+struct StatusSnapshot {
+  int id;  // 0 when there is none.
+  int16_t values[kNumStatusRegisters];
+};
+// The last snapshot the client has decoded, and the last one sent. They are
+// kept for a single client, like the telemetry peer of wifi.cpp: requests of
+// another client make each other fall back to full frames, which are still
+// correct.
+StatusSnapshot acked_snapshot;
+StatusSnapshot sent_snapshot;
+int last_snapshot_id;
+
+constexpr int kStatusBitmapSize = (kNumStatusRegisters + 7) / 8;
+
 int DecodeInt8(uint8_t* data) { return data[0]; }
 int DecodeInt16(uint8_t* data) { return data[0] | (data[1] << 8); }
 
@@ -17,16 +51,124 @@ void EncodeInt16(int16_t value, uint8_t* data) {
   data[1] = value >> 8;
 }
 
+int EncodeVarint(unsigned value, uint8_t* data) {
+  int n = 0;
+  while (value >= 0x80) {
+    data[n++] = (value & 0x7f) | 0x80;
+    value >>= 7;
+  }
+  data[n++] = value;
+  return n;
+}
+
+// Same as the reply of bulk read, except for the opcode.
+void EncodeTelemetry(uint8_t retData[], int* retSize) {
+  *retSize = 0;
+  retData[(*retSize)++] = 0x4;
+  retData[(*retSize)++] = subscription.addr;
+  retData[(*retSize)++] = subscription.size;
+  for (int i = 0; i < subscription.size; i++) {
+    EncodeInt16(reg[subscription.addr + i], &retData[*retSize]);
+    (*retSize) += 2;
+  }
+}
+
+// Multi-range read: [0x5, seq, count, (addr, size) * count]. The reply is
+// [0x5, seq, count, (addr, size, values...) * count], so that the client can
+// tell it from the reply of an earlier request. A request whose reply would
+// not fit a frame is not answered.
+void MultiRead(uint8_t data[], int length, uint8_t retData[], int* retSize) {
+  *retSize = 0;
+  if (length < 3) return;
+  int count = DecodeInt8(&data[2]);
+  if (length < 3 + count * 2) return;
+  int replySize = 3;
+  for (int i = 0; i < count; i++) {
+    int addr = DecodeInt8(&data[3 + i * 2]);
+    int size = DecodeInt8(&data[4 + i * 2]);
+    if (addr + size > N_REGISTERS) return;
+    replySize += 2 + size * 2;
+  }
+  if (replySize > kMaxFrameSize) return;
+  retData[(*retSize)++] = 0x5;
+  retData[(*retSize)++] = data[1];
+  retData[(*retSize)++] = count;
+  for (int i = 0; i < count; i++) {
+    int addr = DecodeInt8(&data[3 + i * 2]);
+    int size = DecodeInt8(&data[4 + i * 2]);
+    retData[(*retSize)++] = addr;
+    retData[(*retSize)++] = size;
+    for (int j = 0; j < size; j++) {
+      EncodeInt16(reg[addr + j], &retData[*retSize]);
+      (*retSize) += 2;
+    }
+  }
+}
+
+// Delta-encoded status: [0x6, ack], where ack is the id of the last snapshot
+// the client has decoded (0 for none). The reply is [0x6, id, base, ...]:
+//   base 0: the status registers (int16 each).
+//   otherwise: a bitmap of the registers changed from snapshot base (LSB
+//   first), and the change of each of them (int16 wrapping) as zigzag varint.
+// A delta is made only against the snapshot the client acknowledged, so that
+// a lost frame falls back to a full frame.
+void DeltaStatus(uint8_t data[], int length, uint8_t retData[],
+                 int* retSize) {
+  *retSize = 0;
+  int ack = data[1];
+  if (ack != 0 && ack == sent_snapshot.id) {
+    acked_snapshot = sent_snapshot;
+  } else if (ack == 0 || ack != acked_snapshot.id) {
+    acked_snapshot.id = 0;
+  }
+  last_snapshot_id = last_snapshot_id % 255 + 1;
+  sent_snapshot.id = last_snapshot_id;
+  memcpy(sent_snapshot.values, &reg[kFirstStatusRegister],
+         sizeof(sent_snapshot.values));
+  retData[(*retSize)++] = 0x6;
+  retData[(*retSize)++] = sent_snapshot.id;
+  retData[(*retSize)++] = acked_snapshot.id;
+  if (acked_snapshot.id == 0) {
+    for (int i = 0; i < kNumStatusRegisters; i++) {
+      EncodeInt16(sent_snapshot.values[i], &retData[*retSize]);
+      (*retSize) += 2;
+    }
+    return;
+  }
+  uint8_t* bitmap = &retData[*retSize];
+  memset(bitmap, 0, kStatusBitmapSize);
+  (*retSize) += kStatusBitmapSize;
+  for (int i = 0; i < kNumStatusRegisters; i++) {
+    uint16_t delta = sent_snapshot.values[i] - acked_snapshot.values[i];
+    if (delta == 0) continue;
+    bitmap[i / 8] |= 1 << (i % 8);
+    uint16_t zigzag = (delta << 1) ^ ((delta & 0x8000) ? 0xffff : 0);
+    (*retSize) += EncodeVarint(zigzag, &retData[*retSize]);
+  }
+}
+
 }  // namespace
 
 bool CommTimedOut(long current_millis) {
   return current_millis > last_receive_time + kTimeoutMillis;
 }
 
-void OnUdpReceived(long current_millis, uint8_t data[], int length,
-                   uint8_t retData[], int* retSize) {
+namespace {
+
+void HandleUdp(long current_millis, uint8_t data[], int length,
+               uint8_t retData[], int* retSize) {
   *retSize = 0;
   if (length < 2) return;
+  if (data[0] == 0x5) {  // multi-range read (data[1] is not an address)
+    MultiRead(data, length, retData, retSize);
+    last_receive_time = millis();
+    return;
+  }
+  if (data[0] == 0x6) {  // delta-encoded status (data[1] is not an address)
+    DeltaStatus(data, length, retData, retSize);
+    last_receive_time = millis();
+    return;
+  }
   int addr = data[1];
   if (addr < 0 || addr >= N_REGISTERS) {
     return;
@@ -60,8 +202,76 @@ void OnUdpReceived(long current_millis, uint8_t data[], int length,
         reg[addr + i] = DecodeInt16(&data[3 + i * 2]);
       }
       break;
+    case 0x04:  // subscribe (interval 0 to unsubscribe)
+      if (length < 5) return;
+      size = DecodeInt8(&data[2]);
+      value = DecodeInt16(&data[3]);
+      if (addr + size > N_REGISTERS || value < 0) {
+        return;
+      }
+      if (value > 0 && value < kMinTelemetryIntervalMillis) {
+        value = kMinTelemetryIntervalMillis;
+      }
+      portENTER_CRITICAL(&subscription_mux);
+      // A subscription renewed without change (a keep-alive) keeps its
+      // phase.
+      if (addr != subscription.addr || size != subscription.size ||
+          value != subscription.interval_millis) {
+        subscription.addr = addr;
+        subscription.size = size;
+        subscription.interval_millis = value;
+        subscription.next_millis = current_millis;
+        if (value > 0) {
+          // The first frame also works as the acknowledgement.
+          EncodeTelemetry(retData, retSize);
+          subscription.next_millis += value;
+        }
+      }
+      portEXIT_CRITICAL(&subscription_mux);
+      break;
     default:
       Serial.write(data, length);
   }
   last_receive_time = millis();
 }
+
+}  // namespace
+
+void OnUdpReceived(long current_millis, uint8_t data[], int length,
+                   uint8_t retData[], int* retSize) {
+  unsigned long begin_micros = micros();
+  HandleUdp(current_millis, data, length, retData, retSize);
+  unsigned long elapsed = micros() - begin_micros;
+  portENTER_CRITICAL(&receive_micros_mux);
+  receive_micros += elapsed;
+  portEXIT_CRITICAL(&receive_micros_mux);
+}
+
+unsigned long TakeReceiveMicros() {
+  portENTER_CRITICAL(&receive_micros_mux);
+  unsigned long elapsed = receive_micros;
+  receive_micros = 0;
+  portEXIT_CRITICAL(&receive_micros_mux);
+  return elapsed;
+}
+
+bool TelemetryTask(long current_millis, uint8_t data[], int* size) {
+  *size = 0;
+  bool due = false;
+  portENTER_CRITICAL(&subscription_mux);
+  if (subscription.interval_millis == 0) {
+    // No subscriber.
+  } else if (CommTimedOut(current_millis)) {
+    // The subscriber has gone.
+    subscription.interval_millis = 0;
+  } else if (current_millis >= subscription.next_millis) {
+    subscription.next_millis += subscription.interval_millis;
+    if (subscription.next_millis <= current_millis) {
+      subscription.next_millis = current_millis + subscription.interval_millis;
+    }
+    EncodeTelemetry(data, size);
+    due = true;
+  }
+  portEXIT_CRITICAL(&subscription_mux);
+  return due;
+}
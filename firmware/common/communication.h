@@ -5,10 +5,17 @@
 
 #include "registers.h"
 
+// Maximum size of the frames made by OnUdpReceived() and TelemetryTask().
+constexpr int kMaxFrameSize = 3 + N_REGISTERS * 2;
+
 extern int16_t reg[N_REGISTERS];
 
 bool CommTimedOut(long current_millis);
 void OnUdpReceived(long current_millis, uint8_t data[], int length,
                    uint8_t retData[], int* retSize);
+// Returns the time [us] spent in OnUdpReceived() since the last call.
+unsigned long TakeReceiveMicros();
+// Makes a telemetry frame for the subscriber when it is due.
+bool TelemetryTask(long current_millis, uint8_t data[], int* size);
 
 #endif  // COMMUNICATION_H_
\ No newline at end of file
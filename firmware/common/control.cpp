@@ -6,6 +6,7 @@
 #include "filter.h"
 #include "hal.h"
 #include "registers.h"
+#include "timing.h"
 #include "wifi.h"
 
 constexpr float kTrimScale = M_PI / 180 * 0.1;
@@ -122,10 +123,14 @@ void InitRegs() {
   // duty * 1023
   reg[LIMITTER] = 600;
   reg[TEST_MODE] = 0;
+  ResetTimingStats();
 }
 
 void ControlTask() {
   unsigned long begin_micros = micros();
+  if (reg[TIMING_RESET] == 1) {
+    ResetTimingStats();
+  }
   int batt_ad = GetBattAD();
   int batt_mv = ToBattVoltageMv(batt_ad);
 
@@ -166,7 +171,10 @@ void ControlTask() {
   }
 
   float sample_interval = kControlLoopIntervalMicros * 1.0e-6;
-  if (ImuTask(sample_interval, &imu)) {
+  unsigned long section_begin = micros();
+  bool imu_updated = ImuTask(sample_interval, &imu);
+  RecordSectionTime(TimingSection::IMU, micros() - section_begin);
+  if (imu_updated) {
     reg[YAW_ANGLE] = ToReg(imu.yaw);
     reg[PITCH_ANGLE] = ToReg(imu.pitch);
     reg[ROLL_ANGLE] = ToReg(imu.roll);
@@ -225,15 +233,30 @@ void ControlTask() {
     ctrl.elevator = 0;
     ctrl.aileron = 0;
   }
+  section_begin = micros();
   if (reg[TEST_MODE] == 0xa5) {
     TestMode();
   } else {
     RunMotor(ctrl, batt_mv_filtered);
   }
+  RecordSectionTime(TimingSection::MOTOR, micros() - section_begin);
+  section_begin = micros();
+  uint8_t telemetry[kMaxFrameSize];
+  int telemetry_size;
+  if (TelemetryTask(current_millis, telemetry, &telemetry_size)) {
+    SendToPeer(telemetry, telemetry_size);
+  }
+  // Requests are handled by OnUdpReceived() on the AsyncUDP task. Their time
+  // since the last loop is counted with the telemetry.
+  RecordSectionTime(TimingSection::COMM,
+                    micros() - section_begin + TakeReceiveMicros());
   unsigned long current_micros = micros();
   reg[CTRL_INTERVAL] = current_micros - begin_micros;
+  RecordLoopTime(begin_micros, current_micros);
   next_micros += kControlLoopIntervalMicros;
   if (micros() > next_micros) {
+    // The deadline is missed. Start the next loop now.
+    RecordOverrun();
     next_micros = micros();
   }
   while (micros() < next_micros) {
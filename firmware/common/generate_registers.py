@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Generates registers.h and registers.py from the register map (registers.csv).
+#
+# usage: generate_registers.py <registers.csv> <registers.h> <registers.py>
+
+import csv
+import math
+import sys
+
+BLOCKS = ('command', 'config', 'status', 'timing')
+TYPES = {'int16': '<i2', 'uint16': '<u2'}
+
+
+class Register:
+
+    def __init__(self, addr, row):
+        self.addr = addr
+        self.name = row['name']
+        self.block = row['block']
+        self.type = row['type']
+        self.unit = row['unit']
+        self.scale_expr = row['scale']
+        self.scale = float(eval(row['scale'], {'__builtins__': {}},
+                                {'pi': math.pi}))
+        self.description = row['description']
+        if self.block not in BLOCKS:
+            raise ValueError('%s: unknown block %s' % (self.name, self.block))
+        if self.type not in TYPES:
+            raise ValueError('%s: unknown type %s' % (self.name, self.type))
+
+    def comment(self):
+        if not self.unit:
+            return self.description
+        if self.scale == 1:
+            return '%s [%s]' % (self.description, self.unit)
+        return '%s [%s * %s]' % (self.description, self.unit, self.scale_expr)
+
+
+def load(path):
+    """Returns the registers and {block: (first address, count)}."""
+    with open(path) as f:
+        rows = csv.DictReader(line for line in f if not line.startswith('#'))
+        registers = [Register(i, row) for i, row in enumerate(rows)]
+    # A block is read or written at once, so it must be contiguous.
+    blocks = {}
+    for r in registers:
+        if r.block not in blocks:
+            blocks[r.block] = (r.addr, 0)
+        first, n = blocks[r.block]
+        if first + n != r.addr:
+            raise ValueError('%s: block %s is not contiguous' %
+                             (r.name, r.block))
+        blocks[r.block] = (first, n + 1)
+    return registers, blocks
+
+
+def status_fields(registers, blocks):
+    """Returns (names, formats, offsets) of the NumPy dtype of the status block.
+
+    A pair of <NAME>_L and <NAME>_H registers also gets a uint32 field <name>.
+    """
+    names = []
+    formats = []
+    offsets = []
+    first_status, n = blocks['status']
+    status = registers[first_status:first_status + n]
+    for r in status:
+        names.append(r.name.lower())
+        formats.append(TYPES[r.type])
+        offsets.append((r.addr - first_status) * 2)
+    for lo, hi in zip(status, status[1:]):
+        if (lo.name.endswith('_L') and hi.name == lo.name[:-2] + '_H' and
+                lo.type == 'uint16' and hi.type == 'uint16'):
+            names.append(lo.name[:-2].lower())
+            formats.append('<u4')
+            offsets.append((lo.addr - first_status) * 2)
+    return names, formats, offsets
+
+
+def write_header(f, registers, blocks):
+    width = max(len(r.name) for r in registers) + 1
+    f.write('// Generated from registers.csv by generate_registers.py. '
+            'Do not edit.\n')
+    f.write('#ifndef REGISTERS_H_\n#define REGISTERS_H_\n\n')
+    f.write('// Registers written/read by the communication commands.\n')
+    f.write('enum {\n')
+    for r in registers:
+        f.write('  %-*s  // %s\n' % (width, r.name + ',', r.comment()))
+    f.write('  N_REGISTERS,\n};\n\n')
+    f.write('// Blocks of registers.\n')
+    for block, (first, n) in blocks.items():
+        name = block.capitalize()
+        f.write('constexpr int kFirst%sRegister = %s;\n' %
+                (name, registers[first].name))
+        f.write('constexpr int kNum%sRegisters = %d;\n' % (name, n))
+    f.write('\n')
+    f.write('#endif  // REGISTERS_H_\n')
+
+
+def write_python(f, registers, blocks):
+    width = max(len(r.name) for r in registers) + 5
+    f.write('# Generated from firmware/common/registers.csv by '
+            'generate_registers.py.\n# Do not edit.\n\n')
+    f.write('try:\n    import numpy as np\nexcept ImportError:\n'
+            '    np = None\n\n')
+    for r in registers:
+        f.write('%-*s  # %s\n' % (width, '%s = %d' % (r.name, r.addr),
+                                  r.comment()))
+    f.write('N_REGISTERS = %d\n\n' % len(registers))
+    f.write('# Blocks of registers.\n')
+    for block, (first, n) in blocks.items():
+        f.write('FIRST_%s_REG = %s\n' % (block.upper(), registers[first].name))
+        f.write('N_%s_REGS = %d\n' % (block.upper(), n))
+    f.write('\n')
+    f.write('# Attributes of each register by address. A register holds a '
+            'value in UNITS\n# multiplied by SCALES.\n')
+    for attr, values in (('NAMES', [r.name for r in registers]),
+                         ('BLOCKS', [r.block for r in registers]),
+                         ('TYPES', [r.type for r in registers]),
+                         ('UNITS', [r.unit for r in registers]),
+                         ('SCALES', [r.scale for r in registers])):
+        f.write('%s = (\n' % attr)
+        for v in values:
+            f.write('    %r,\n' % v)
+        f.write(')\n')
+    f.write('\n\n')
+    f.write('def to_unit(addr, value):\n'
+            '    """Converts a register value into UNITS[addr]."""\n'
+            '    return value / SCALES[addr]\n\n\n')
+    f.write('def from_unit(addr, x):\n'
+            '    """Converts x in UNITS[addr] into a register value."""\n'
+            '    return int(round(x * SCALES[addr]))\n\n\n')
+    names, formats, offsets = status_fields(registers, blocks)
+    f.write('# Layout of the status block in frames, for np.frombuffer(). '
+            'Fields are the\n# lowercase register names.\n')
+    f.write('_STATUS_FIELDS = (\n')
+    for field in zip(names, formats, offsets):
+        f.write('    %r,\n' % (field,))
+    f.write(')\n')
+    f.write('if np is not None:\n'
+            '    STATUS_DTYPE = np.dtype({\n'
+            '        \'names\': [x[0] for x in _STATUS_FIELDS],\n'
+            '        \'formats\': [x[1] for x in _STATUS_FIELDS],\n'
+            '        \'offsets\': [x[2] for x in _STATUS_FIELDS],\n'
+            '        \'itemsize\': N_STATUS_REGS * 2,\n'
+            '    })\n'
+            'else:\n'
+            '    STATUS_DTYPE = None\n')
+
+
+def main(argv):
+    if len(argv) < 4:
+        print('usage: %s <registers.csv> <registers.h> <registers.py>' %
+              argv[0])
+        return 1
+    registers, blocks = load(argv[1])
+    with open(argv[2], 'w') as f:
+        write_header(f, registers, blocks)
+    with open(argv[3], 'w') as f:
+        write_python(f, registers, blocks)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
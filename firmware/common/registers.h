@@ -1,61 +1,105 @@
+// Generated from registers.csv by generate_registers.py. Do not edit.
 #ifndef REGISTERS_H_
 #define REGISTERS_H_
 
 // Registers written/read by the communication commands.
 enum {
-  JS_THROTTLE,
-  JS_YAW,
-  JS_PITCH,
-  JS_ROLL,
-  JS_BUTTONS,
-  TRIM_THROTTLE,
-  TRIM_YAW,
-  TRIM_PITCH,
-  TRIM_ROLL,
-  GAIN_YAW_P,
-  GAIN_YAW_D,
-  GAIN_PITCH_P,
-  GAIN_PITCH_D,
-  GAIN_ROLL_P,
-  GAIN_ROLL_D,
-  GAIN_ALT_P,
-  GAIN_ALT_D,
-  LIMITTER,
-  TRIP_ANGLE_PR,
-  TRIP_ANGLE_YAW,
-  ENABLE,
-  TEST_MODE,
-  HOVERING_VOLTAGE,
-  DESCEND_TIME,
-  LOW_BATTERY_THRESHOLD,
-  CALIBRATE,
-  ELAPSED_L,
-  ELAPSED_H,
-  CTRL_INTERVAL,
-  BATT_AD,
-  BATT_VOLTAGE,
-  BATT_VOLTAGE_FILTERED,
-  BATT_STATUS,
-  TARGET_YAW,
-  TARGET_PITCH,
-  TARGET_ROLL,
-  YAW_ANGLE,
-  PITCH_ANGLE,
-  ROLL_ANGLE,
-  ROTATION_X,
-  ROTATION_Y,
-  ROTATION_Z,
-  ACCEL_X,
-  ACCEL_Y,
-  ACCEL_Z,
-  OUT_PITCH,
-  OUT_ROLL,
-  OUT_YAW,
-  OUT_THROTTLE,
-  OUT_M0,
-  OUT_M1,
-  OUT_M2,
-  OUT_M3,
+  JS_THROTTLE,            // Throttle stick
+  JS_YAW,                 // Yaw stick (unused)
+  JS_PITCH,               // Pitch stick [rad * 1800/pi]
+  JS_ROLL,                // Roll stick [rad * 1800/pi]
+  JS_BUTTONS,             // Button bits
+  TRIM_THROTTLE,          // Throttle trim (unused)
+  TRIM_YAW,               // Yaw trim (unused) [rad * 1800/pi]
+  TRIM_PITCH,             // Pitch trim [rad * 1800/pi]
+  TRIM_ROLL,              // Roll trim [rad * 1800/pi]
+  GAIN_YAW_P,             // Yaw P gain
+  GAIN_YAW_D,             // Yaw D gain
+  GAIN_PITCH_P,           // Pitch P gain
+  GAIN_PITCH_D,           // Pitch D gain
+  GAIN_ROLL_P,            // Roll P gain
+  GAIN_ROLL_D,            // Roll D gain
+  GAIN_ALT_P,             // Altitude P gain (unused)
+  GAIN_ALT_D,             // Altitude D gain (unused)
+  LIMITTER,               // Maximum motor duty [duty * 1000]
+  TRIP_ANGLE_PR,          // Pitch/roll trip angle (unused) [rad * 1800/pi]
+  TRIP_ANGLE_YAW,         // Yaw trip angle (unused) [rad * 1800/pi]
+  ENABLE,                 // Motors are enabled if 1
+  TEST_MODE,              // 0xa5: OUT_Mx are output directly
+  HOVERING_VOLTAGE,       // Throttle while landing on low battery
+  DESCEND_TIME,           // Duration of landing on low battery [s * 1000]
+  LOW_BATTERY_THRESHOLD,  // Battery voltage to start landing [V * 1000]
+  CALIBRATE,              // 1: start calibration. 2: calibrating. 0: done
+  ELAPSED_L,              // Lower 16 bits of the time since boot [s * 1000]
+  ELAPSED_H,              // Upper 16 bits of the time since boot [s * 1000/65536]
+  CTRL_INTERVAL,          // Duration of the last control cycle [s * 1000000]
+  BATT_AD,                // Battery ADC value
+  BATT_VOLTAGE,           // Battery voltage [V * 1000]
+  BATT_VOLTAGE_FILTERED,  // Moving average of battery voltage [V * 1000]
+  BATT_STATUS,            // 1: low. 2: normal
+  TARGET_YAW,             // Target yaw angle [rad * 1800/pi]
+  TARGET_PITCH,           // Target pitch angle [rad * 1800/pi]
+  TARGET_ROLL,            // Target roll angle [rad * 1800/pi]
+  YAW_ANGLE,              // Yaw angle [rad * 1800/pi]
+  PITCH_ANGLE,            // Pitch angle [rad * 1800/pi]
+  ROLL_ANGLE,             // Roll angle [rad * 1800/pi]
+  ROTATION_X,             // Angular velocity around X [deg/s * 100]
+  ROTATION_Y,             // Angular velocity around Y [deg/s * 100]
+  ROTATION_Z,             // Angular velocity around Z [deg/s * 100]
+  ACCEL_X,                // Acceleration along X [g * 1000]
+  ACCEL_Y,                // Acceleration along Y [g * 1000]
+  ACCEL_Z,                // Acceleration along Z [g * 1000]
+  OUT_PITCH,              // Pitch output of the controller
+  OUT_ROLL,               // Roll output of the controller
+  OUT_YAW,                // Yaw output of the controller
+  OUT_THROTTLE,           // Throttle output of the controller
+  OUT_M0,                 // Motor 0 duty [duty * 1000]
+  OUT_M1,                 // Motor 1 duty [duty * 1000]
+  OUT_M2,                 // Motor 2 duty [duty * 1000]
+  OUT_M3,                 // Motor 3 duty [duty * 1000]
+  TIMING_RESET,           // 1: reset the timing statistics
+  LOOP_COUNT,             // Control loops since the reset (saturates)
+  LOOP_OVERRUNS,          // Loops which missed the deadline
+  LOOP_TIME_MIN,          // Minimum execution time of a loop [s * 1000000]
+  LOOP_TIME_MAX,          // Maximum execution time of a loop [s * 1000000]
+  LOOP_TIME_MEAN,         // Mean execution time of a loop [s * 1000000]
+  LOOP_PERIOD_MIN,        // Minimum interval between loops [s * 1000000]
+  LOOP_PERIOD_MAX,        // Maximum interval between loops [s * 1000000]
+  IMU_HIST_0,             // Loops with ImuTask() time < 64 us
+  IMU_HIST_1,             // Loops with ImuTask() time 64-128 us
+  IMU_HIST_2,             // Loops with ImuTask() time 128-256 us
+  IMU_HIST_3,             // Loops with ImuTask() time 256-512 us
+  IMU_HIST_4,             // Loops with ImuTask() time 512-1024 us
+  IMU_HIST_5,             // Loops with ImuTask() time 1024-2048 us
+  IMU_HIST_6,             // Loops with ImuTask() time 2048-4096 us
+  IMU_HIST_7,             // Loops with ImuTask() time >= 4096 us
+  COMM_HIST_0,            // Loops with communication time < 64 us
+  COMM_HIST_1,            // Loops with communication time 64-128 us
+  COMM_HIST_2,            // Loops with communication time 128-256 us
+  COMM_HIST_3,            // Loops with communication time 256-512 us
+  COMM_HIST_4,            // Loops with communication time 512-1024 us
+  COMM_HIST_5,            // Loops with communication time 1024-2048 us
+  COMM_HIST_6,            // Loops with communication time 2048-4096 us
+  COMM_HIST_7,            // Loops with communication time >= 4096 us
+  MOTOR_HIST_0,           // Loops with motor output time < 64 us
+  MOTOR_HIST_1,           // Loops with motor output time 64-128 us
+  MOTOR_HIST_2,           // Loops with motor output time 128-256 us
+  MOTOR_HIST_3,           // Loops with motor output time 256-512 us
+  MOTOR_HIST_4,           // Loops with motor output time 512-1024 us
+  MOTOR_HIST_5,           // Loops with motor output time 1024-2048 us
+  MOTOR_HIST_6,           // Loops with motor output time 2048-4096 us
+  MOTOR_HIST_7,           // Loops with motor output time >= 4096 us
   N_REGISTERS,
 };
+
+// Blocks of registers.
+constexpr int kFirstCommandRegister = JS_THROTTLE;
+constexpr int kNumCommandRegisters = 5;
+constexpr int kFirstConfigRegister = TRIM_THROTTLE;
+constexpr int kNumConfigRegisters = 20;
+constexpr int kFirstStatusRegister = CALIBRATE;
+constexpr int kNumStatusRegisters = 28;
+constexpr int kFirstTimingRegister = TIMING_RESET;
+constexpr int kNumTimingRegisters = 32;
+
 #endif  // REGISTERS_H_
@@ -0,0 +1,78 @@
+#include "timing.h"
+
+#include "communication.h"
+#include "registers.h"
+
+namespace {
+
+unsigned long last_begin_micros;
+// LOOP_COUNT saturates, so the mean is calculated from these.
+unsigned long loop_count;
+unsigned long loop_time_sum;
+
+// Registers hold unsigned values, which saturate instead of wrapping.
+uint16_t GetU16(int addr) { return static_cast<uint16_t>(reg[addr]); }
+void SetU16(int addr, unsigned long value) {
+  reg[addr] = static_cast<int16_t>(value > 0xffff ? 0xffff : value);
+}
+void Increment(int addr) { SetU16(addr, GetU16(addr) + 1ul); }
+
+}  // namespace
+
+void ResetTimingStats() {
+  for (int i = 0; i < kNumTimingRegisters; i++) {
+    reg[kFirstTimingRegister + i] = 0;
+  }
+  SetU16(LOOP_TIME_MIN, 0xffff);
+  SetU16(LOOP_PERIOD_MIN, 0xffff);
+  loop_count = 0;
+  loop_time_sum = 0;
+}
+
+void RecordSectionTime(TimingSection section, unsigned long micros) {
+  int first;
+  switch (section) {
+    case TimingSection::IMU:
+      first = IMU_HIST_0;
+      break;
+    case TimingSection::COMM:
+      first = COMM_HIST_0;
+      break;
+    default:
+      first = MOTOR_HIST_0;
+      break;
+  }
+  int bin = 0;
+  unsigned long bound = kFirstBinMicros;
+  while (bin < kTimingBins - 1 && micros >= bound) {
+    bin++;
+    bound <<= 1;
+  }
+  Increment(first + bin);
+}
+
+void RecordLoopTime(unsigned long begin_micros, unsigned long end_micros) {
+  unsigned long t = end_micros - begin_micros;
+  if (loop_count > 0) {
+    unsigned long period = begin_micros - last_begin_micros;
+    if (period < GetU16(LOOP_PERIOD_MIN)) {
+      SetU16(LOOP_PERIOD_MIN, period);
+    }
+    if (period > GetU16(LOOP_PERIOD_MAX)) {
+      SetU16(LOOP_PERIOD_MAX, period);
+    }
+  }
+  last_begin_micros = begin_micros;
+  if (t < GetU16(LOOP_TIME_MIN)) {
+    SetU16(LOOP_TIME_MIN, t);
+  }
+  if (t > GetU16(LOOP_TIME_MAX)) {
+    SetU16(LOOP_TIME_MAX, t);
+  }
+  Increment(LOOP_COUNT);
+  loop_count++;
+  loop_time_sum += t;
+  SetU16(LOOP_TIME_MEAN, loop_time_sum / loop_count);
+}
+
+void RecordOverrun() { Increment(LOOP_OVERRUNS); }
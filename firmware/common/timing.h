@@ -0,0 +1,25 @@
+#ifndef TIMING_H_
+#define TIMING_H_
+
+// Execution time statistics of ControlTask(), kept in the timing registers
+// (TIMING_RESET..MOTOR_HIST_7) for the host to read.
+
+// Sections of ControlTask() with a histogram of their execution time. COMM
+// includes the time of OnUdpReceived() since the previous loop.
+enum class TimingSection { IMU, COMM, MOTOR };
+
+// Number of bins of a histogram. Bin 0 counts times below kFirstBinMicros,
+// and each next bin doubles the bound. The last bin counts the rest.
+constexpr int kTimingBins = 8;
+constexpr unsigned long kFirstBinMicros = 64;
+
+// Clears the statistics. Also done when the host writes 1 to TIMING_RESET.
+void ResetTimingStats();
+void RecordSectionTime(TimingSection section, unsigned long micros);
+// Records a loop which started at begin_micros and finished its work at
+// end_micros.
+void RecordLoopTime(unsigned long begin_micros, unsigned long end_micros);
+// Records a loop which finished after the deadline of the next one.
+void RecordOverrun();
+
+#endif  // TIMING_H_
@@ -9,6 +9,8 @@ namespace {
 
 AsyncUDP udp;
 CommCallback cb_;
+IPAddress peer_ip;
+uint16_t peer_port = 0;
 
 }  // namespace
 
@@ -38,6 +40,8 @@ bool ConnectToAP(const char* ssid, const char* password) {
 void onPacket(AsyncUDPPacket packet) {
   int returnSize;
   uint8_t returnPacket[256];
+  peer_ip = packet.remoteIP();
+  peer_port = packet.remotePort();
   cb_(millis(), packet.data(), packet.length(), returnPacket, &returnSize);
   if (returnSize > 0) {
     packet.write(returnPacket, returnSize);
@@ -53,4 +57,11 @@ void SetupUdpReceiver(CommCallback cb) {
   }
 }
 
+void SendToPeer(const unsigned char* data, int size) {
+  if (peer_port == 0) {
+    return;
+  }
+  udp.writeTo(data, size, peer_ip, peer_port);
+}
+
 void PrintIPAddress() { Serial.println(WiFi.localIP()); }
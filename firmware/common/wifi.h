@@ -7,5 +7,7 @@ typedef void (*CommCallback)(long current_millis, unsigned char[], int,
 bool ConnectToAP(const char* ssid, const char* password);
 void PrintIPAddress();
 void SetupUdpReceiver(CommCallback cb);
+// Sends a datagram to the sender of the last received packet.
+void SendToPeer(const unsigned char* data, int size);
 
 #endif  // WIFI_H_
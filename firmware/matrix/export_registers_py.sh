@@ -1 +0,0 @@
-../common/export_registers_py.sh
\ No newline at end of file
@@ -0,0 +1 @@
+../common/generate_registers.py
\ No newline at end of file
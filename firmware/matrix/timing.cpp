@@ -0,0 +1 @@
+../common/timing.cpp
\ No newline at end of file
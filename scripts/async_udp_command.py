@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# asyncio version of udp_command.UDPCommand.
+#
+# Requests do not wait for each other: several reads can be outstanding at the
+# same time, and writes are sent immediately. Replies of multi_read() are
+# matched to requests by their sequence numbers. The other replies are matched
+# by their opcode and range in FIFO order, since those frames do not carry a
+# request ID. (A reply arriving after its request timed out is taken as the
+# answer to the next request of the same kind.)
+
+import asyncio
+import collections
+import sys
+
+import codec
+import registers as regs
+import udp_command
+
+
+class _Protocol(asyncio.DatagramProtocol):
+
+    def __init__(self, client):
+        self._client = client
+
+    def datagram_received(self, data, addr):
+        self._client._on_reply(data)
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable. Pending requests just time out.
+        pass
+
+
+class AsyncUDPCommand:
+
+    def __init__(self, addr, port, timeout=0.01):
+        self.host = addr
+        self.port = port
+        self.timeout = timeout
+        self._transport = None
+        # Futures waiting for a reply, keyed by the reply header.
+        self._pending = collections.defaultdict(collections.deque)
+        # Queues of the telemetry() iterators.
+        self._telemetry_queues = []
+        # Sequence number of the last multi-range read.
+        self._seq = 0
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Protocol(self), remote_addr=(self.host, self.port))
+        return self
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _on_reply(self, d):
+        if not d:
+            return
+        if d[0] == codec.OP_SUBSCRIBE:
+            for q in self._telemetry_queues:
+                q.put_nowait(d)
+            return
+        if d[0] == codec.OP_BULK_READ and len(d) >= 3:
+            key = (codec.OP_BULK_READ, d[1], d[2])
+        elif d[0] == codec.OP_MULTI_READ and len(d) >= 2:
+            key = (codec.OP_MULTI_READ, d[1])
+        else:
+            key = (d[0],)
+        waiters = self._pending.get(key)
+        while waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(d)
+                return
+
+    async def _request(self, cmd, key):
+        fut = asyncio.get_running_loop().create_future()
+        waiters = self._pending[key]
+        waiters.append(fut)
+        self._transport.sendto(cmd)
+        try:
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if fut in waiters:
+                waiters.remove(fut)
+
+    async def read_reg(self, addr):
+        d = await self._request(codec.encode_read(addr), (codec.OP_READ,))
+        if d is None:
+            return None
+        return codec.decode_read(d)
+
+    async def write_reg(self, addr, value):
+        self._transport.sendto(codec.encode_write(addr, value))
+
+    async def bulk_read(self, addr, n):
+        d = await self._request(codec.encode_bulk_read(addr, n),
+                                (codec.OP_BULK_READ, addr, n))
+        if d is None:
+            return None
+        return codec.decode_bulk_read(d, addr, n)
+
+    async def multi_read(self, ranges):
+        """See UDPCommand.multi_read()."""
+        self._seq = (self._seq + 1) & 0xff
+        seq = self._seq
+        d = await self._request(codec.encode_multi_read(seq, ranges),
+                                (codec.OP_MULTI_READ, seq))
+        if d is None:
+            return None
+        return codec.decode_multi_read(d, seq, ranges)
+
+    async def bulk_write(self, addr, values):
+        self._transport.sendto(codec.encode_bulk_write(addr, values))
+
+    async def read_all_status(self):
+        d = await self._request(
+            codec.STATUS_REQUEST,
+            (codec.OP_BULK_READ, codec.FIRST_STATUS_REG, codec.N_STATUS_REGS))
+        if d is None or not codec.is_status_frame(d):
+            return None, None
+        return codec.decode_status_frame(d)
+
+    def subscribe(self, interval_ms):
+        """See UDPCommand.subscribe()."""
+        self._transport.sendto(
+            codec.encode_subscribe(codec.FIRST_STATUS_REG,
+                                   codec.N_STATUS_REGS, interval_ms))
+
+    async def telemetry(self, interval_ms=10, resubscribe_timeout=0.1):
+        """Asynchronously iterates (elapsed, regs) pushed by the drone.
+
+        See UDPCommand.telemetry().
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self._telemetry_queues.append(queue)
+        self.subscribe(interval_ms)
+        last_subscribed = loop.time()
+        try:
+            while True:
+                try:
+                    d = await asyncio.wait_for(queue.get(),
+                                               resubscribe_timeout)
+                except asyncio.TimeoutError:
+                    d = None
+                now = loop.time()
+                if (d is None or now >
+                        last_subscribed + udp_command.SUBSCRIPTION_KEEPALIVE):
+                    self.subscribe(interval_ms)
+                    last_subscribed = now
+                if d is None:
+                    continue
+                if codec.is_status_frame(d):
+                    yield codec.decode_status_frame(d)
+        finally:
+            self._telemetry_queues.remove(queue)
+            if self._transport is not None:
+                self.subscribe(0)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+async def _main(argv):
+    async with AsyncUDPCommand(argv[1], 1234) as udp:
+        # Status, gains, and attitude with motor outputs are requested at
+        # once.
+        (t, d), gains, outputs = await asyncio.gather(
+            udp.read_all_status(), udp.bulk_read(regs.GAIN_YAW_P, 6),
+            udp.multi_read([(regs.YAW_ANGLE, 3), (regs.OUT_M0, 4)]))
+        print(t, d)
+        print('gains', gains)
+        if outputs is not None:
+            print('attitude', outputs[0])
+            print('motors', outputs[1])
+
+
+def main(argv):
+    if len(argv) < 2:
+        print('usage: %s <IP address>' % argv[0])
+        return
+    asyncio.run(_main(argv))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
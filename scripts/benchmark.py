@@ -0,0 +1,328 @@
+#!/usr/bin/python3
+
+# Benchmarks of the ground station hot paths.
+#
+# Each benchmark measures one path alone against an emulator (emulator.py)
+# served on a local port, so that the results do not depend on a drone or the
+# Wi-Fi link. The results can be saved as JSON and compared with a previous
+# run to find regressions.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+# Must be set before pygame is imported.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+
+import codec
+import console
+import emulator
+import filters
+import flight
+import registers as regs
+import udp_command
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           'ini', 'matrix1.ini')
+# A benchmark is slower than the baseline when its time exceeds this ratio.
+DEFAULT_THRESHOLD = 1.2
+# Wait between benchmarks for the emulator to process queued requests.
+SETTLE_TIME = 0.1
+
+# (name, setup(context) -> callable), in the order to run.
+BENCHMARKS = []
+
+
+def benchmark(name):
+
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+
+    return register
+
+
+class Context:
+    """Objects shared by the benchmarks, created on first use."""
+
+    def __init__(self):
+        self.random = random.Random(0)
+        self._server = None
+        self._udp = None
+        self._flight = None
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = emulator.EmulatorServer(port=0)
+            self._server.start()
+        return self._server
+
+    @property
+    def udp(self):
+        if self._udp is None:
+            self._udp = udp_command.UDPCommand(*self.server.address)
+        return self._udp
+
+    @property
+    def flight(self):
+        if self._flight is None:
+            self._flight = flight.Flight(CONFIG_FILE, *self.server.address)
+        return self._flight
+
+    def status_frame(self):
+        values = [self.random.randrange(-32768, 32768)
+                  for _ in range(regs.N_STATUS_REGS)]
+        return (bytes((codec.OP_BULK_READ, regs.FIRST_STATUS_REG,
+                       regs.N_STATUS_REGS)) +
+                b''.join(v.to_bytes(2, 'little', signed=True)
+                         for v in values))
+
+    def close(self):
+        if self._udp is not None:
+            self._udp.close()
+        if self._flight is not None:
+            self._flight.comm.close()
+        if self._server is not None:
+            self._server.stop()
+
+
+@benchmark('codec.encode_bulk_write')
+def _encode_bulk_write(ctx):
+    buf = bytearray(codec.MAX_FRAME_SIZE)
+    values = [100, -3, 5, 7]
+    return lambda: codec.encode_bulk_write(regs.JS_THROTTLE, values, buf)
+
+
+@benchmark('codec.decode_status_frame')
+def _decode_status_frame(ctx):
+    d = ctx.status_frame()
+    return lambda: codec.decode_status_frame(d)
+
+
+@benchmark('udp.bulk_read')
+def _bulk_read(ctx):
+    udp = ctx.udp
+    return lambda: udp.bulk_read(regs.GAIN_YAW_P, 6)
+
+
+@benchmark('udp.multi_read')
+def _multi_read(ctx):
+    udp = ctx.udp
+    ranges = [(regs.YAW_ANGLE, 3), (regs.OUT_M0, 4)]
+    return lambda: udp.multi_read(ranges)
+
+
+@benchmark('udp.bulk_write')
+def _bulk_write(ctx):
+    udp = ctx.udp
+    values = [0, 0, 0, 0]
+    return lambda: udp.bulk_write(regs.JS_THROTTLE, values)
+
+
+@benchmark('udp.read_all_status')
+def _read_all_status(ctx):
+    return ctx.udp.read_all_status
+
+
+@benchmark('flight.send')
+def _flight_send(ctx):
+    f = ctx.flight
+    ctrl = flight.Control()
+    ctrl.pitch = 100
+    ctrl.roll = -100
+    return lambda: f.send(ctrl)
+
+
+@benchmark('flight.task')
+def _flight_task(ctx):
+    f = ctx.flight
+    _, d = codec.decode_status_frame(ctx.status_frame())
+    st = flight.summarize_status(d)
+    return lambda: f.task(st)
+
+
+@benchmark('console.update')
+def _console_update(ctx):
+    pygame.init()
+    con = console.Console()
+    ctrl = flight.Control()
+    frames = [codec.decode_status_frame(ctx.status_frame()) for _ in range(64)]
+    state = {'i': 0, 't': 0}
+
+    def run():
+        _, d = frames[state['i'] % len(frames)]
+        state['i'] += 1
+        # 5 ms of device time per frame, as received at the control rate.
+        state['t'] += 5
+        con.update(state['t'], ctrl, d, None)
+
+    return run
+
+
+@benchmark('filters.MeanFilter')
+def _mean_filter(ctx):
+    f = filters.MeanFilter(100)
+    samples = [ctx.random.randrange(3000, 4200) for _ in range(1000)]
+    state = {'i': 0}
+
+    def run():
+        f.push(samples[state['i'] % len(samples)])
+        state['i'] += 1
+        f.get_mean()
+
+    return run
+
+
+@benchmark('loop.control')
+def _control_loop(ctx):
+    """A cycle of joystick.py without drawing."""
+    f = ctx.flight
+    ctrl = flight.Control()
+
+    def run():
+        f.send(ctrl)
+        t, d = f.read_all_status()
+        if t is not None:
+            f.task(flight.summarize_status(d))
+            f.set_target_yaw_to_current()
+
+    return run
+
+
+def measure(func, repeat, min_time):
+    """Returns the time [s] of a call of func in each of repeat runs.
+
+    The number of calls of a run is calibrated to take about min_time.
+    """
+    number = 1
+    while True:
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - begin
+        if elapsed >= min_time / 10:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9) / 10))
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - begin) / number)
+    return number, times
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'pygame': pygame.version.ver,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def run(names, repeat, min_time):
+    ctx = Context()
+    results = {}
+    try:
+        for name, setup in BENCHMARKS:
+            if names and not any(n in name for n in names):
+                continue
+            number, times = measure(setup(ctx), repeat, min_time)
+            time.sleep(SETTLE_TIME)
+            results[name] = {
+                'number': number,
+                'repeat': repeat,
+                'min_us': min(times) * 1e6,
+                'median_us': statistics.median(times) * 1e6,
+                'max_us': max(times) * 1e6,
+                'per_second': 1.0 / statistics.median(times),
+            }
+            r = results[name]
+            print('%-28s %10.2f us  (min %.2f, %d x %d)  %10.0f /s' %
+                  (name, r['median_us'], r['min_us'], repeat, number,
+                   r['per_second']),
+                  file=sys.stderr)
+    finally:
+        ctx.close()
+        pygame.quit()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the ratio to the baseline. Returns the names of regressions."""
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            continue
+        ratio = r['median_us'] / b['median_us']
+        mark = ''
+        if ratio > threshold:
+            mark = '  REGRESSION'
+            regressions.append(name)
+        print('%-28s %10.2f -> %10.2f us  x%.2f%s' %
+              (name, b['median_us'], r['median_us'], ratio, mark),
+              file=sys.stderr)
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the ground station against the emulator.')
+    parser.add_argument('names',
+                        nargs='*',
+                        help='run only benchmarks containing these names')
+    parser.add_argument('--json',
+                        metavar='FILE',
+                        help='write the results to FILE (- for stdout)')
+    parser.add_argument('--compare',
+                        metavar='FILE',
+                        help='compare with the results saved by --json')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help='time ratio to the baseline regarded as a '
+                        'regression')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time',
+                        type=float,
+                        default=0.2,
+                        help='approximate duration [s] of a repeat')
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    if args.list:
+        for name, _ in BENCHMARKS:
+            print(name)
+        return 0
+    results = run(args.names, args.repeat, args.min_time)
+    doc = {'environment': environment(), 'results': results}
+    if args.json == '-':
+        json.dump(doc, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(doc, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
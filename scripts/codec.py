@@ -0,0 +1,238 @@
+# Encoders and decoders of the UDP register protocol frames.
+# (See OnUdpReceived() in firmware/common/communication.cpp.)
+#
+# Frame layouts are precompiled struct.Struct objects. Decoders read from any
+# buffer (bytes, bytearray or memoryview) without slicing it, so that frames
+# can be received into a preallocated buffer with recv_into().
+
+import functools
+import struct
+
+import registers as regs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OP_READ = 0x00
+OP_WRITE = 0x01
+OP_BULK_READ = 0x02
+OP_BULK_WRITE = 0x03
+OP_SUBSCRIBE = 0x04
+OP_MULTI_READ = 0x05
+OP_DELTA_STATUS = 0x06
+
+FIRST_STATUS_REG = regs.FIRST_STATUS_REG
+N_STATUS_REGS = regs.N_STATUS_REGS
+# Size of the reply buffer in the firmware (see wifi.cpp).
+MAX_FRAME_SIZE = 256
+# Maximum size of the replies made by the firmware (kMaxFrameSize of
+# communication.h).
+MAX_REPLY_SIZE = 3 + regs.N_REGISTERS * 2
+
+_READ = struct.Struct('<BB')
+_READ_REPLY = struct.Struct('<Bh')
+_WRITE = struct.Struct('<BBH')
+_BULK_READ = struct.Struct('<BBB')
+_SUBSCRIBE = struct.Struct('<BBBH')
+# opcode, addr, n of bulk read/write and telemetry frames.
+HEADER = struct.Struct('<BBB')
+
+
+@functools.lru_cache(maxsize=None)
+def _values(n):
+    """n int16 values following the header."""
+    return struct.Struct('<3x%dh' % n)
+
+
+@functools.lru_cache(maxsize=None)
+def _bulk_write(n):
+    return struct.Struct('<BBB%dH' % n)
+
+
+def encode_read(addr):
+    return _READ.pack(OP_READ, addr)
+
+
+def encode_write(addr, value):
+    return _WRITE.pack(OP_WRITE, addr, value & 0xffff)
+
+
+def encode_bulk_read(addr, n):
+    return _BULK_READ.pack(OP_BULK_READ, addr, n)
+
+
+def encode_bulk_write(addr, values, buf=None):
+    """Encodes a bulk write. Values may be signed or unsigned 16-bit.
+
+    If buf (a bytearray of MAX_FRAME_SIZE) is given, the frame is written into
+    it and a memoryview of the frame is returned.
+    """
+    s = _bulk_write(len(values))
+    v = [x & 0xffff for x in values]
+    if buf is None:
+        return s.pack(OP_BULK_WRITE, addr, len(v), *v)
+    s.pack_into(buf, 0, OP_BULK_WRITE, addr, len(v), *v)
+    return memoryview(buf)[:s.size]
+
+
+@functools.lru_cache(maxsize=None)
+def _multi_read(count):
+    return struct.Struct('<BBB%dB' % (count * 2))
+
+
+@functools.lru_cache(maxsize=None)
+def _multi_read_reply(ranges):
+    """Values of a multi-range read reply, skipping the headers."""
+    return struct.Struct('<3x' + ''.join('2x%dh' % n for _, n in ranges))
+
+
+def multi_read_reply_size(ranges):
+    return 3 + sum(2 + n * 2 for _, n in ranges)
+
+
+def encode_multi_read(seq, ranges):
+    """Encodes a read of [(addr, n), ...] in one request.
+
+    The reply carries seq (0 to 255) back. Raises ValueError if the reply
+    would not fit a frame, which the firmware does not answer.
+    """
+    if multi_read_reply_size(ranges) > MAX_REPLY_SIZE:
+        raise ValueError('too many registers to read at once')
+    items = [x for r in ranges for x in r]
+    return _multi_read(len(ranges)).pack(OP_MULTI_READ, seq, len(ranges),
+                                         *items)
+
+
+def decode_multi_read(d, seq, ranges):
+    """Decodes a multi-range read reply into a list of the values of each of
+    ranges. Returns None if d is not the reply to the request of seq and
+    ranges."""
+    ranges = tuple((addr, n) for addr, n in ranges)
+    if (len(d) != multi_read_reply_size(ranges) or d[0] != OP_MULTI_READ or
+            d[1] != seq or d[2] != len(ranges)):
+        return None
+    i = 3
+    for addr, n in ranges:
+        if d[i] != addr or d[i + 1] != n:
+            return None
+        i += 2 + n * 2
+    values = _multi_read_reply(ranges).unpack_from(d)
+    result = []
+    i = 0
+    for _, n in ranges:
+        result.append(list(values[i:i + n]))
+        i += n
+    return result
+
+
+def encode_subscribe(addr, n, interval_ms):
+    return _SUBSCRIBE.pack(OP_SUBSCRIBE, addr, n, interval_ms)
+
+
+# Request of read_all_status(), which never changes.
+STATUS_REQUEST = encode_bulk_read(FIRST_STATUS_REG, N_STATUS_REGS)
+STATUS_BITMAP_SIZE = (N_STATUS_REGS + 7) // 8
+
+
+def encode_delta_status(ack):
+    """Encodes a request of the delta-encoded status.
+
+    ack is the id of the last snapshot decoded by decode_delta_status(), or 0
+    to request a full frame.
+    """
+    return bytes((OP_DELTA_STATUS, ack))
+
+
+def decode_read(d):
+    return _READ_REPLY.unpack_from(d)[1]
+
+
+def decode_bulk_read(d, addr, n):
+    """Decodes a bulk read reply. Returns None if d is not a bulk read reply."""
+    if d[0] != OP_BULK_READ:
+        return None
+    assert d[1] == addr
+    assert d[2] == n
+    assert len(d) == 3 + n * 2
+    return list(_values(n).unpack_from(d))
+
+
+def decode_telemetry(d):
+    """Decodes a frame pushed by a subscription into (addr, values)."""
+    if d[0] != OP_SUBSCRIBE:
+        return None, None
+    _, addr, n = HEADER.unpack_from(d)
+    assert len(d) == 3 + n * 2
+    return addr, list(_values(n).unpack_from(d))
+
+
+def is_status_frame(d):
+    """True if d is a reply of read_all_status() or a status telemetry."""
+    return (len(d) == 3 + N_STATUS_REGS * 2 and
+            (d[0] == OP_BULK_READ or d[0] == OP_SUBSCRIBE) and
+            d[1] == FIRST_STATUS_REG and d[2] == N_STATUS_REGS)
+
+
+def decode_status(values):
+    """Converts the values of the status registers to (elapsed, regs)."""
+    d = [None] * FIRST_STATUS_REG + values
+    elapsed = ((d[regs.ELAPSED_L] & 0xffff) |
+               ((d[regs.ELAPSED_H] & 0xffff) << 16))
+    return elapsed, d
+
+
+def decode_status_frame(d):
+    """Decodes a frame accepted by is_status_frame() into (elapsed, regs)."""
+    return decode_status(list(_values(N_STATUS_REGS).unpack_from(d)))
+
+
+def decode_delta_status(d, base=None):
+    """Decodes a delta-encoded status reply into a snapshot (id, values of the
+    status registers).
+
+    A delta is applied to base, the snapshot acknowledged by the request.
+    Returns None if d is not a full frame, nor a delta against base.
+    """
+    if len(d) < 3 or d[0] != OP_DELTA_STATUS or d[1] == 0:
+        return None
+    _, snapshot_id, base_id = HEADER.unpack_from(d)
+    if base_id == 0:
+        if len(d) != 3 + N_STATUS_REGS * 2:
+            return None
+        return snapshot_id, list(_values(N_STATUS_REGS).unpack_from(d))
+    if base is None or base[0] != base_id:
+        return None
+    i = 3 + STATUS_BITMAP_SIZE
+    if len(d) < i:
+        return None
+    bitmap = int.from_bytes(d[3:i], 'little')
+    values = list(base[1])
+    for k in range(N_STATUS_REGS):
+        if not bitmap >> k & 1:
+            continue
+        zigzag = 0
+        shift = 0
+        while True:
+            if i >= len(d):
+                return None
+            b = d[i]
+            i += 1
+            zigzag |= (b & 0x7f) << shift
+            shift += 7
+            if b < 0x80:
+                break
+        delta = (zigzag >> 1) ^ -(zigzag & 1)
+        v = (values[k] + delta) & 0xffff
+        values[k] = v - 0x10000 if v > 0x7fff else v
+    if i != len(d):
+        return None
+    return snapshot_id, values
+
+
+def decode_status_record(d):
+    """Views a frame accepted by is_status_frame() as a record of
+    registers.STATUS_DTYPE (needs NumPy). The record shares the memory of d.
+    """
+    return np.frombuffer(d, regs.STATUS_DTYPE, 1, 3)[0]
@@ -1,4 +1,9 @@
 import configparser
+import os
+import time
+
+# Interval [s] of checking the modification of a watched file.
+DEFAULT_WATCH_INTERVAL = 0.5
 
 
 class Config:
@@ -39,6 +44,54 @@ def load(name, cfg):
     cfg.low_battery_threshold = int(others['LowBatteryThreshold'])
 
 
+class WatchedConfig:
+    """A Config loaded again when its file is modified.
+
+    The file is checked by poll(), at most every interval seconds.
+    """
+
+    def __init__(self, name, interval=DEFAULT_WATCH_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.error = None
+        self._stamp = self._stat()
+        self.config = Config(name)
+        self._next_check = time.monotonic() + interval
+
+    def _stat(self):
+        try:
+            st = os.stat(self.name)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def poll(self, now=None):
+        """Returns (old Config, new Config) if the file has been modified since
+        the last load, or None.
+
+        A file which fails to load, e.g. saved in the middle of an edit, is
+        skipped and the error is kept in `error` until the next modification.
+        """
+        if now is None:
+            now = time.monotonic()
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            cfg = Config(self.name)
+        except (configparser.Error, KeyError, ValueError) as e:
+            self.error = e
+            return None
+        self.error = None
+        old = self.config
+        self.config = cfg
+        return old, cfg
+
+
 def main():
     c = Config('matrix1.ini')
 
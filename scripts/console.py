@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-import collections
+import numpy as np
 import pygame
 
 import filters
@@ -17,6 +17,12 @@ DARK_GREEN = (0, 64, 0)
 WINDOW_WIDTH = 640
 WINDOW_HEIGHT = 480
 
+GRAPH_WIDTH = 200
+GRAPH_HEIGHT = 100
+GRAPH_GAP = 20
+# Number of samples kept by a Graph. (10 seconds at 800Hz)
+GRAPH_CAPACITY = 8192
+
 # TODO: Share these conversions code or factors with firmwares.
 # int toReg(float radians) { return radians * 1800 / M_PI; }
 # float toRadians(int reg) { return reg * M_PI / 1800; }
@@ -63,12 +69,23 @@ class XyGraph(panels.Panel):
     def addChild(self, child):
         assert False
 
+    def set(self, roll, pitch, tgt_roll, tgt_pitch):
+        v = (roll, pitch, tgt_roll, tgt_pitch)
+        if v != (self.roll, self.pitch, self.tgt_roll, self.tgt_pitch):
+            self.roll, self.pitch, self.tgt_roll, self.tgt_pitch = v
+            self.dirty = True
+
     def draw(self, screen, rect):
-        r = self.getRect()
-        r.left += rect.left
-        r.top += rect.top
+        if not self.dirty:
+            return []
+        r = self.getRect().move(rect.left, rect.top)
+        screen.fill(panels.BACKGROUND, r)
+        screen.set_clip(r)
         drawXYGraph(screen, r, self.roll, self.pitch, self.tgt_roll,
                     self.tgt_pitch)
+        screen.set_clip(None)
+        self.dirty = False
+        return [r]
 
 
 def drawSignal(screen, frame, val):
@@ -84,43 +101,144 @@ def drawSignal(screen, frame, val):
     pygame.draw.circle(screen, color, (x0, y0), radius)
 
 
-class Graph:
+class Signal(panels.Panel):
+    """Green when the value is 0, red otherwise."""
+
+    def __init__(self, left, top, width, height):
+        super().__init__(left, top, width, height)
+        self.value = 0
+
+    def addChild(self, child):
+        assert False
 
-    def __init__(self, name, duration, min, max):
-        self.data = collections.deque()
+    def set(self, value):
+        if value != self.value:
+            self.value = value
+            self.dirty = True
+
+    def draw(self, screen, rect):
+        if not self.dirty:
+            return []
+        r = self.getRect().move(rect.left, rect.top)
+        screen.fill(panels.BACKGROUND, r)
+        drawSignal(screen, r, self.value)
+        self.dirty = False
+        return [r]
+
+
+class BarMeter(panels.Panel):
+    """A bar meter of 0..max_value with the value printed below."""
+
+    def __init__(self, left, top, width, height, max_value, text_size,
+                 color):
+        super().__init__(left, top, width, height)
+        self.value = 0
+        self._max_value = max_value
+        self._label = panels.Label(0, height, text_size, '', color)
+        super().addChild(self._label)
+
+    def addChild(self, child):
+        assert False
+
+    def set(self, value):
+        if value != self.value:
+            self.value = value
+            self.dirty = True
+        self._label.setText('%4d' % value)
+
+    def draw(self, screen, rect):
+        updated = []
+        if self.dirty:
+            r = self.getRect().move(rect.left, rect.top)
+            screen.fill(panels.BACKGROUND, r)
+            screen.set_clip(r)
+            drawBarMeter(screen, r, self.value / self._max_value)
+            screen.set_clip(None)
+            updated.append(r)
+        return updated + super().draw(screen, rect)
+
+
+class Graph:
+    """Time-series graph of the latest `duration` of data.
+
+    Samples are kept in a fixed-capacity ring buffer. Each pixel column is
+    drawn as the range of the samples falling on it, so that the drawing cost
+    does not depend on the sampling rate.
+    """
+
+    def __init__(self,
+                 name,
+                 duration,
+                 min,
+                 max,
+                 width=GRAPH_WIDTH,
+                 height=GRAPH_HEIGHT,
+                 capacity=GRAPH_CAPACITY):
+        self._t = np.zeros(capacity)
+        self._v = np.zeros(capacity)
+        self._head = 0
+        self._count = 0
         self._duration = duration
         self._min = min
         self._max = max
         self._name = name
+        self._width = width
+        self._height = height
+        self._name_surface = panels.render_text(name, 24, WHITE)
 
     def update(self, t, data):
-        while self.data and self.data[0][0] < t - self._duration:
-            self.data.popleft()
-        self.data.append((t, data))
+        self._t[self._head] = t
+        self._v[self._head] = data
+        self._head = (self._head + 1) % len(self._t)
+        self._count = min(self._count + 1, len(self._t))
+
+    def data(self):
+        """Returns (t, values) in chronological order."""
+        if self._count < len(self._t):
+            return self._t[:self._count], self._v[:self._count]
+        return (np.concatenate((self._t[self._head:], self._t[:self._head])),
+                np.concatenate((self._v[self._head:], self._v[:self._head])))
+
+    def _points(self, current_time, origin_x, origin_y):
+        t, v = self.data()
+        begin = np.searchsorted(t, current_time - self._duration)
+        t = t[begin:]
+        v = v[begin:]
+        if len(t) == 0:
+            return []
+        w = self._width
+        col = ((t - current_time) * (w / self._duration) + w).astype(int)
+        np.clip(col, 0, w - 1, out=col)
+        # First sample of each pixel column.
+        starts = np.flatnonzero(np.diff(col)) + 1
+        starts = np.concatenate(([0], starts))
+        x = col[starts] + origin_x
+        y = np.empty((len(starts), 2))
+        y[:, 0] = np.minimum.reduceat(v, starts)
+        y[:, 1] = np.maximum.reduceat(v, starts)
+        y = origin_y + self._height - ((y - self._min) * self._height /
+                                       (self._max - self._min))
+        pts = np.empty((len(starts) * 2, 2))
+        pts[:, 0] = np.repeat(x, 2)
+        pts[:, 1] = y.ravel()
+        return pts.tolist()
 
     def draw(self, screen, current_time, origin_x, origin_y):
-        w = 200
-        h = 100
-        pts = []
-        T_SCALE = w / self._duration
+        """Draws the graph. Returns the updated screen area."""
+        w = self._width
+        h = self._height
         rect = pygame.Rect(origin_x, origin_y, w, h)
         screen.fill(DARK_GREEN, rect)
-
-        def get_y(v):
-            return origin_y + h - ((v - self._min) * h /
-                                   (self._max - self._min))
-
-        for p in self.data:
-            x = origin_x + w - (current_time - p[0]) * T_SCALE
-            y = get_y(p[1])
-            pts.append((x, y))
-            pts.append((x, y))
+        screen.set_clip(rect)
+        pts = self._points(current_time, origin_x, origin_y)
         if pts:
             pygame.draw.lines(screen, WHITE, False, pts, 1)
-        y0 = int(get_y(0))
+        y0 = int(origin_y + h - ((0 - self._min) * h /
+                                 (self._max - self._min)))
         pygame.draw.line(screen, GRAY, (origin_x, y0), (origin_x + w, y0))
-        font = pygame.font.Font(None, 24)
-        screen.blit(font.render(self._name, True, WHITE), (origin_x, origin_y))
+        screen.blit(self._name_surface, (origin_x, origin_y))
+        screen.set_clip(None)
+        return rect
 
 
 class GraphItem:
@@ -132,6 +250,21 @@ class GraphItem:
         self.max = maxval
 
 
+def registerGraphItem(name, minval, maxval):
+    """Makes a GraphItem which plots a register, e.g. 'ROTATION_Z'."""
+    addr = getattr(regs, name)
+    return GraphItem(name.lower(), lambda r, ctrl: r[addr], minval, maxval)
+
+
+DEFAULT_GRAPH_ITEMS = [
+    GraphItem('throttle', lambda r, ctrl: ctrl.throttle, 0, 1023),
+    GraphItem('pitch', lambda r, ctrl: r[regs.PITCH_ANGLE], -1800, 1800),
+    GraphItem('roll', lambda r, ctrl: r[regs.ROLL_ANGLE], -1800, 1800),
+    GraphItem('yaw', lambda r, ctrl: r[regs.YAW_ANGLE], -1800, 1800),
+    # GraphItem('yaw velocity', lambda r, ctrl : r[regs.ROTATION_Z], -180000, 180000),
+]
+
+
 class ConsoleData:
 
     def __init__(self):
@@ -146,88 +279,133 @@ class ConsoleData:
 
 class Console:
 
-    def __init__(self):
+    def __init__(self, screen=None, graph_items=None):
+        """Draws on the display window, or on screen (a pygame.Surface) if
+        given, without touching the display.
+
+        graph_items is a list of GraphItem to plot (DEFAULT_GRAPH_ITEMS if
+        not given).
+        """
         self._TEXT_SIZE = 32
         self._TEXT_COLOR = (255, 255, 255)
-        self.screen = pygame.display.set_mode((512, 512))
+        self._use_display = screen is None
+        if self._use_display:
+            self.screen = pygame.display.set_mode((512, 512))
+        else:
+            self.screen = screen
         self.DURATION = 10e3
-        self._graph_items = [
-            GraphItem('throttle', lambda r, ctrl: ctrl.throttle, 0, 1023),
-            GraphItem('pitch', lambda r, ctrl: r[regs.PITCH_ANGLE], -1800,
-                      1800),
-            GraphItem('roll', lambda r, ctrl: r[regs.ROLL_ANGLE], -1800, 1800),
-            GraphItem('yaw', lambda r, ctrl: r[regs.YAW_ANGLE], -1800, 1800),
-            # GraphItem('yaw velocity', lambda r, ctrl : r[regs.ROTATION_Z], -180000, 180000),
-        ]
+        if graph_items is None:
+            graph_items = DEFAULT_GRAPH_ITEMS
+        self._graph_items = graph_items
+        # Graphs are stacked in a column, shrunk to fit in the window.
+        self._graph_height = min(
+            GRAPH_HEIGHT,
+            self.screen.get_height() // len(graph_items) - GRAPH_GAP)
+        self._build_views()
+        self.reset()
+
+    def _build_views(self):
+        XYGRAPH_FRAME = pygame.Rect(100, 10, 100, 100)
+        CALIB_SIGNAL_FRAME = pygame.Rect(80, 0, 30, 30)
+        METER_HEIGHT = 40
+        TRIM_POS = (0, 200)
+
+        self._root_view = panels.Panel(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
+        list_view = panels.Panel(0, 100, 100, 100)
+        self._root_view.addChild(list_view)
+        self._item_labels = []
+        y = 0
+        for i in range(3):
+            label = panels.Label(0, y, self._TEXT_SIZE, '', WHITE)
+            list_view.addChild(label)
+            self._item_labels.append(label)
+            y += self._TEXT_SIZE
+
+        self._meters = []
+        for reg, x, y in [
+            (regs.OUT_M0, 0, METER_HEIGHT + 10),
+            (regs.OUT_M1, 40, 0),
+            (regs.OUT_M2, 40, METER_HEIGHT + 10),
+            (regs.OUT_M3, 0, 0),
+        ]:
+            meter = BarMeter(x, y, 10, METER_HEIGHT, 1023, 20,
+                             self._TEXT_COLOR)
+            self._root_view.addChild(meter)
+            self._meters.append((reg, meter))
+
+        self._rp_view = XyGraph(XYGRAPH_FRAME.left, XYGRAPH_FRAME.top,
+                                XYGRAPH_FRAME.width, XYGRAPH_FRAME.height, 0,
+                                0, 0, 0)
+        self._root_view.addChild(self._rp_view)
+        self._trim_label = panels.Label(TRIM_POS[0], TRIM_POS[1], 20, '',
+                                        self._TEXT_COLOR)
+        self._root_view.addChild(self._trim_label)
+        self._calib_signal = Signal(CALIB_SIGNAL_FRAME.left,
+                                    CALIB_SIGNAL_FRAME.top,
+                                    CALIB_SIGNAL_FRAME.width,
+                                    CALIB_SIGNAL_FRAME.height)
+        self._root_view.addChild(self._calib_signal)
+
+    def reset(self):
+        """Clears the history of graphs and filters."""
         self._graphs = []
         for i in self._graph_items:
-            self._graphs.append(Graph(i.name, self.DURATION, i.min, i.max))
+            self._graphs.append(
+                Graph(i.name,
+                      self.DURATION,
+                      i.min,
+                      i.max,
+                      height=self._graph_height))
         self._batt_filter = filters.MeanFilter(300)
+        self.invalidate()
+
+    def invalidate(self):
+        """Redraws the whole screen on the next update()."""
+        self._full_redraw = True
 
     def update2(self, data):
         return self.update(data.t, data.ctrl, data.regs, data.conf)
 
     def update(self, t, ctrl, r, conf):
-        XYGRAPH_FRAME = pygame.Rect(100, 10, 100, 100)
-        CALIB_SIGNAL_FRAME = pygame.Rect(80, 0, 30, 30)
-
+        """Draws a frame. Returns the list of updated screen areas."""
         self._batt_filter.push(r[regs.BATT_AD])
 
-        self.screen.fill((0, 0, 0))
-        font = pygame.font.Font(None, self._TEXT_SIZE)
+        if self._full_redraw:
+            self.screen.fill(panels.BACKGROUND)
+            self._root_view.invalidate()
 
-        root_view = panels.Panel(0, 0, WINDOW_WIDTH, WINDOW_HEIGHT)
-        list_view = panels.Panel(0, 100, 100, 100)
-        root_view.addChild(list_view)
         ITEMS = [
             ('t', t),
             ('THROTTLE', ctrl.throttle),
             ('BATTERY', r[regs.BATT_VOLTAGE]),
         ]
-        y = 0
-        for i in ITEMS:
-            label = i[0]
-            val = i[1]
-            text = '%s %04d' % (label, val)
-            list_view.addChild(panels.Label(0, y, self._TEXT_SIZE, text,
-                                            WHITE))
-            y += self._TEXT_SIZE
-        idx = 0
+        for label, i in zip(self._item_labels, ITEMS):
+            label.setText('%s %04d' % i)
+        updated = []
         x = 300
         y = 0
-        for i in self._graph_items:
-            self._graphs[idx].update(t, i.func(r, ctrl))
-            self._graphs[idx].draw(self.screen, t, x, y)
-            idx += 1
-            y += 120
-
-        METER_HEIGHT = 40
-        outs = [
-            (regs.OUT_M0, 0, METER_HEIGHT + 10),
-            (regs.OUT_M1, 40, 0),
-            (regs.OUT_M2, 40, METER_HEIGHT + 10),
-            (regs.OUT_M3, 0, 0),
-        ]
-        meter_font = pygame.font.Font(None, 20)
-        for x in outs:
-            f = pygame.Rect(x[1], x[2], 10, METER_HEIGHT)
-            drawBarMeter(self.screen, f, r[x[0]] / 1023)
-            self.screen.blit(
-                meter_font.render('%4d' % r[x[0]], True, self._TEXT_COLOR),
-                (x[1], x[2] + METER_HEIGHT))
-
-        rpView = XyGraph(XYGRAPH_FRAME.left, XYGRAPH_FRAME.top,
-                         XYGRAPH_FRAME.width, XYGRAPH_FRAME.height,
-                         r[regs.ROLL_ANGLE], r[regs.PITCH_ANGLE],
-                         jsToAngle(ctrl.roll) * 10,
-                         jsToAngle(ctrl.pitch) * 10)
-        root_view.addChild(rpView)
-        TRIM_POS = (0, 200)
+        for graph, i in zip(self._graphs, self._graph_items):
+            graph.update(t, i.func(r, ctrl))
+            updated.append(graph.draw(self.screen, t, x, y))
+            y += self._graph_height + GRAPH_GAP
+
+        for reg, meter in self._meters:
+            meter.set(r[reg])
+        self._rp_view.set(r[regs.ROLL_ANGLE], r[regs.PITCH_ANGLE],
+                          jsToAngle(ctrl.roll) * 10,
+                          jsToAngle(ctrl.pitch) * 10)
         if conf is not None and conf.trim_x:
-            self.screen.blit(
-                meter_font.render('TRIM %4d %4d' % (conf.trim_x, conf.trim_y),
-                                  True, self._TEXT_COLOR), TRIM_POS)
-        drawSignal(self.screen, CALIB_SIGNAL_FRAME, r[regs.CALIBRATE])
-
-        root_view.draw(self.screen, pygame.Rect(0, 0, 0, 0))
-        pygame.display.update()
+            self._trim_label.setText('TRIM %4d %4d' %
+                                     (conf.trim_x, conf.trim_y))
+        else:
+            self._trim_label.setText('')
+        self._calib_signal.set(r[regs.CALIBRATE])
+
+        updated += self._root_view.draw(self.screen, pygame.Rect(0, 0, 0, 0))
+        if self._use_display:
+            if self._full_redraw:
+                pygame.display.update()
+            else:
+                pygame.display.update(updated)
+        self._full_redraw = False
+        return updated
@@ -0,0 +1,90 @@
+# Status panel on a terminal with ANSI escape sequences.
+#
+# The labels are printed once, and each update rewrites only the values which
+# have changed since the last one, in a single write. Updates are rate-limited,
+# so that the caller can call update() on every loop.
+
+import sys
+import time
+
+DEFAULT_RATE_HZ = 10
+LABEL_WIDTH = 20
+
+
+def _move(row, col):
+    # ANSI rows and columns are 1-based.
+    return '\033[%d;%dH' % (row + 1, col + 1)
+
+
+class RateMeter:
+    """Rate of a counter, e.g. loops per second, between the calls of
+    update()."""
+
+    def __init__(self):
+        self._count = None
+        self._time = None
+        self.rate = None
+
+    def update(self, count, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self._time is not None and now > self._time:
+            self.rate = (count - self._count) / (now - self._time)
+        self._count = count
+        self._time = now
+        return self.rate
+
+
+class Dashboard:
+    """Lines of 'label value' at fixed positions, plus a message line."""
+
+    def __init__(self, labels, out=sys.stdout, rate_hz=DEFAULT_RATE_HZ):
+        self.labels = list(labels)
+        self.out = out
+        self.interval = 1.0 / rate_hz
+        self._values = None
+        self._message = None
+        self._next_time = 0.0
+
+    def due(self, now=None):
+        """True if the next update() draws."""
+        if now is None:
+            now = time.monotonic()
+        return now >= self._next_time
+
+    def _layout(self):
+        s = ['\033[2J']
+        for row, label in enumerate(self.labels):
+            s.append(_move(row, 0) + label)
+        self._values = [None] * len(self.labels)
+        self._message = None
+        return s
+
+    def update(self, values, message='', now=None):
+        """Draws values (one string per label) and the message, if due.
+
+        Returns whether it has drawn.
+        """
+        if now is None:
+            now = time.monotonic()
+        if not self.due(now):
+            return False
+        self._next_time = max(self._next_time + self.interval, now)
+        s = self._layout() if self._values is None else []
+        for row, v in enumerate(values):
+            if v != self._values[row]:
+                s.append(_move(row, LABEL_WIDTH + 1) + v + '\033[K')
+                self._values[row] = v
+        if message != self._message:
+            s.append(_move(len(self.labels) + 1, 0) + message + '\033[K')
+            self._message = message
+        if s:
+            # Leave the cursor below the panel.
+            s.append(_move(len(self.labels) + 2, 0))
+            self.out.write(''.join(s))
+            self.out.flush()
+        return True
+
+    def invalidate(self):
+        """Redraws everything on the next update(), e.g. after other output."""
+        self._values = None
@@ -0,0 +1,614 @@
+#!/usr/bin/python3
+
+# Software-in-the-loop emulator of the quadcopter firmware.
+#
+# Serves the UDP register protocol of firmware/common/communication.cpp on a
+# local port and runs a simplified version of ControlTask()
+# (firmware/common/control.cpp) behind it, so that the host-side scripts can be
+# run and benchmarked without a drone.
+
+import math
+import socket
+import sys
+import threading
+import time
+
+import filters
+import registers as regs
+
+TIMEOUT_MILLIS = 300
+MIN_TELEMETRY_INTERVAL_MILLIS = 5
+# kMaxFrameSize of communication.h.
+MAX_FRAME_SIZE = 3 + regs.N_REGISTERS * 2
+CONTROL_LOOP_INTERVAL_MICROS = 5000
+TRIM_SCALE = math.pi / 180 * 0.1
+BASE_BATTERY_VOLTAGE = 4200
+# All motor output is shut off when battery voltage is below this level.
+SHUTOFF_VOLTAGE_MV = 2700
+BATT_FILTER_WINDOW_SIZE = 100
+# Number of gyro samples averaged by the IMU calibration (BUFSIZE in imu.cpp).
+CALIBRATION_SAMPLES = 1000
+# Fake A/D converter result (approx. 3.7V), same as the AtomFly firmware.
+DEFAULT_BATT_AD = 2048
+# Histograms of the timing registers (see firmware/common/timing.h).
+TIMING_BINS = 8
+FIRST_BIN_MICROS = 64
+SECTION_IMU = regs.IMU_HIST_0
+SECTION_COMM = regs.COMM_HIST_0
+SECTION_MOTOR = regs.MOTOR_HIST_0
+
+# Motor mixing matrix of WriteMotorPWM().
+#     FRONT
+# CW  M4 M2 CCW
+# CCW M1 M3 CW
+#     REAR(switches and connectors)
+MIXING = [
+    [1, 1, 1, 1],  # throttle
+    [1, 1, -1, -1],  # rudder   +CW -CCW
+    [-1, 1, -1, 1],  # elevator +up -down
+    [-1, 1, 1, -1],  # aileron  +left -right
+]
+
+
+def to_int16(value):
+    """Wraps a value into the range of the int16_t register file."""
+    return ((int(value) + 32768) & 0xffff) - 32768
+
+
+def to_reg(radians):
+    return int(radians * 1800 / math.pi)
+
+
+def to_radians(reg):
+    return reg * math.pi / 1800
+
+
+def to_batt_voltage_mv(adc):
+    # Same as firmware/matrix/batt_voltage.cpp
+    return adc * 1.8659 + -147.0441
+
+
+def _decode_int16(d):
+    v = d[0] | (d[1] << 8)
+    if v > 32767:
+        v -= 65536
+    return v
+
+
+def _encode_int16(value):
+    return (value & 0xffff).to_bytes(2, 'little')
+
+
+class Control:
+    """Mirrors struct Control in firmware/common/control.h."""
+
+    def __init__(self, throttle=0, rudder=0, elevator=0, aileron=0):
+        self.throttle = throttle
+        self.rudder = rudder
+        self.elevator = elevator
+        self.aileron = aileron
+
+
+class IMUData:
+    """Mirrors struct IMUData in firmware/common/imu.h."""
+
+    def __init__(self):
+        self.yaw = 0.0
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.rotation = [0, 0, 0]
+        self.accel = [0, 0, 0]
+
+
+class StaticIMU:
+    """An IMU lying still and level on the floor.
+
+    Calibration finishes after CALIBRATION_SAMPLES calls of task(), as the
+    firmware does.
+    """
+
+    def __init__(self):
+        self._calib_count = 0
+        self._calib_ready = False
+
+    def start_calibration(self):
+        self._calib_count = 0
+        self._calib_ready = False
+
+    def calibration_ready(self):
+        return self._calib_ready
+
+    def task(self, sample_interval):
+        if not self._calib_ready:
+            self._calib_count += 1
+            if self._calib_count >= CALIBRATION_SAMPLES:
+                self._calib_count = 0
+                self._calib_ready = True
+        result = IMUData()
+        result.accel = [0, 0, 1000]
+        return result
+
+
+class AutoPilot:
+    """Mirrors AutoPilot in firmware/common/auto_pilot.h."""
+
+    def __init__(self, throttle_for_landing):
+        self.throttle_for_landing = throttle_for_landing
+        self.low_battery = False
+        self.descend_time_millis = 2000
+        self.low_battery_begin_time = 0
+
+    def init(self):
+        self.low_battery = False
+
+    def enter_low_battery_mode(self, current_time_millis):
+        if self.low_battery:
+            return
+        self.low_battery_begin_time = current_time_millis
+        self.low_battery = True
+
+    def get_throttle(self, time_millis, manual_throttle):
+        if not self.low_battery:
+            return manual_throttle
+        if time_millis > self.low_battery_begin_time + self.descend_time_millis:
+            return 0
+        if manual_throttle > self.throttle_for_landing:
+            return self.throttle_for_landing
+        return manual_throttle
+
+
+class LoopTiming:
+    """Execution time statistics in the timing registers, same as
+    firmware/common/timing.cpp.
+
+    section is the first register of a histogram (SECTION_IMU etc.).
+    """
+
+    def __init__(self, reg):
+        self.reg = reg
+        self.reset()
+
+    def _get(self, addr):
+        return self.reg[addr] & 0xffff
+
+    def _set(self, addr, value):
+        self.reg[addr] = to_int16(min(int(value), 0xffff))
+
+    def _increment(self, addr):
+        self._set(addr, self._get(addr) + 1)
+
+    def reset(self):
+        for i in range(regs.N_TIMING_REGS):
+            self.reg[regs.FIRST_TIMING_REG + i] = 0
+        self._set(regs.LOOP_TIME_MIN, 0xffff)
+        self._set(regs.LOOP_PERIOD_MIN, 0xffff)
+        self._last_begin_micros = 0
+        self._loop_count = 0
+        self._loop_time_sum = 0
+
+    def record_section(self, section, micros):
+        b = 0
+        bound = FIRST_BIN_MICROS
+        while b < TIMING_BINS - 1 and micros >= bound:
+            b += 1
+            bound <<= 1
+        self._increment(section + b)
+
+    def record_loop(self, begin_micros, end_micros):
+        t = end_micros - begin_micros
+        if self._loop_count > 0:
+            period = begin_micros - self._last_begin_micros
+            if period < self._get(regs.LOOP_PERIOD_MIN):
+                self._set(regs.LOOP_PERIOD_MIN, period)
+            if period > self._get(regs.LOOP_PERIOD_MAX):
+                self._set(regs.LOOP_PERIOD_MAX, period)
+        self._last_begin_micros = begin_micros
+        if t < self._get(regs.LOOP_TIME_MIN):
+            self._set(regs.LOOP_TIME_MIN, t)
+        if t > self._get(regs.LOOP_TIME_MAX):
+            self._set(regs.LOOP_TIME_MAX, t)
+        self._increment(regs.LOOP_COUNT)
+        self._loop_count += 1
+        self._loop_time_sum += t
+        self._set(regs.LOOP_TIME_MEAN, self._loop_time_sum // self._loop_count)
+
+    def record_overrun(self):
+        self._increment(regs.LOOP_OVERRUNS)
+
+
+def _micros():
+    return int(time.perf_counter() * 1e6)
+
+
+class Emulator:
+    """Register file, communication handler and control task of a drone.
+
+    All the methods take the current time in milliseconds, so that the
+    emulator can be driven either by the wall clock (see EmulatorServer) or by
+    a simulated one.
+    """
+
+    def __init__(self, imu=None, batt_ad=DEFAULT_BATT_AD):
+        self.reg = [0] * regs.N_REGISTERS
+        self.imu = imu if imu is not None else StaticIMU()
+        self.batt_ad = batt_ad
+        self.pwm = [0] * 4
+        self.last_receive_time = 0
+        self._auto_pilot = AutoPilot(0)
+        self._batt_filter = filters.AverageFilter(BATT_FILTER_WINDOW_SIZE)
+        # The firmware passes an uninitialized value to RunMotor() until the
+        # battery filter is filled. Keep motors stopped instead.
+        self._batt_mv_filtered = 0
+        # interval (0 when there is no subscriber), addr, size, next millis
+        self._subscription = [0, 0, 0, 0]
+        # (id, values) of the status snapshots of the delta-encoded status:
+        # the last one the client has decoded, and the last one sent. Kept for
+        # a single client, like the firmware.
+        self._acked_snapshot = (0, None)
+        self._sent_snapshot = (0, None)
+        self._last_snapshot_id = 0
+        self.timing = LoopTiming(self.reg)
+        self.init_regs()
+
+    def init_regs(self):
+        for i in range(regs.N_REGISTERS):
+            self.reg[i] = 0
+        self.reg[regs.TRIP_ANGLE_PR] = 300
+        self.reg[regs.TRIP_ANGLE_YAW] = 300
+        self.reg[regs.LIMITTER] = 600
+        self.reg[regs.TEST_MODE] = 0
+        self.timing.reset()
+
+    def _set(self, addr, value):
+        self.reg[addr] = to_int16(value)
+
+    def comm_timed_out(self, current_millis):
+        return current_millis > self.last_receive_time + TIMEOUT_MILLIS
+
+    def on_udp_received(self, current_millis, data):
+        """Handles a request datagram and returns the reply (may be empty)."""
+        ret = b''
+        if len(data) < 2:
+            return ret
+        if data[0] == 0x05:  # multi-range read (data[1] is not an address)
+            self.last_receive_time = current_millis
+            return self._multi_read(data)
+        if data[0] == 0x06:  # delta-encoded status
+            self.last_receive_time = current_millis
+            return self._delta_status(data[1])
+        addr = data[1]
+        if addr >= regs.N_REGISTERS:
+            return ret
+        if data[0] == 0x00:  # read
+            ret = b'\x00' + _encode_int16(self.reg[addr])
+        elif data[0] == 0x01:  # write
+            if len(data) < 4:
+                return ret
+            self.reg[addr] = _decode_int16(data[2:4])
+        elif data[0] == 0x02:  # bulk read
+            if len(data) < 3:
+                return ret
+            size = data[2]
+            if addr + size > regs.N_REGISTERS:
+                return ret
+            ret = bytes([0x02, addr, size]) + b''.join(
+                _encode_int16(v) for v in self.reg[addr:addr + size])
+        elif data[0] == 0x03:  # bulk write
+            if len(data) < 3:
+                return ret
+            size = data[2]
+            if addr + size > regs.N_REGISTERS or len(data) < 3 + size * 2:
+                return ret
+            for i in range(size):
+                j = 3 + i * 2
+                self.reg[addr + i] = _decode_int16(data[j:j + 2])
+        elif data[0] == 0x04:  # subscribe (interval 0 to unsubscribe)
+            if len(data) < 5:
+                return ret
+            size = data[2]
+            interval = _decode_int16(data[3:5])
+            if addr + size > regs.N_REGISTERS or interval < 0:
+                return ret
+            if 0 < interval < MIN_TELEMETRY_INTERVAL_MILLIS:
+                interval = MIN_TELEMETRY_INTERVAL_MILLIS
+            # A subscription renewed without change (a keep-alive) keeps its
+            # phase.
+            if self._subscription[:3] != [interval, addr, size]:
+                self._subscription = [interval, addr, size, current_millis]
+                if interval > 0:
+                    # The first frame also works as the acknowledgement.
+                    ret = self._encode_telemetry()
+                    self._subscription[3] += interval
+        self.last_receive_time = current_millis
+        return ret
+
+    def _multi_read(self, data):
+        if len(data) < 3:
+            return b''
+        count = data[2]
+        if len(data) < 3 + count * 2:
+            return b''
+        ranges = [(data[3 + i * 2], data[4 + i * 2]) for i in range(count)]
+        if any(addr + size > regs.N_REGISTERS for addr, size in ranges):
+            return b''
+        if 3 + sum(2 + size * 2 for _, size in ranges) > MAX_FRAME_SIZE:
+            return b''
+        ret = bytes([0x05, data[1], count])
+        for addr, size in ranges:
+            ret += bytes([addr, size]) + b''.join(
+                _encode_int16(v) for v in self.reg[addr:addr + size])
+        return ret
+
+    def _delta_status(self, ack):
+        if ack != 0 and ack == self._sent_snapshot[0]:
+            self._acked_snapshot = self._sent_snapshot
+        elif ack == 0 or ack != self._acked_snapshot[0]:
+            self._acked_snapshot = (0, None)
+        self._last_snapshot_id = self._last_snapshot_id % 255 + 1
+        values = self.reg[regs.FIRST_STATUS_REG:regs.FIRST_STATUS_REG +
+                          regs.N_STATUS_REGS]
+        self._sent_snapshot = (self._last_snapshot_id, values)
+        base_id, base = self._acked_snapshot
+        ret = bytes([0x06, self._last_snapshot_id, base_id])
+        if base_id == 0:
+            return ret + b''.join(_encode_int16(v) for v in values)
+        bitmap = 0
+        deltas = b''
+        for i, (v, b) in enumerate(zip(values, base)):
+            delta = (v - b) & 0xffff
+            if delta == 0:
+                continue
+            bitmap |= 1 << i
+            zigzag = ((delta << 1) ^ (0xffff if delta & 0x8000 else 0)) & 0xffff
+            while zigzag >= 0x80:
+                deltas += bytes([(zigzag & 0x7f) | 0x80])
+                zigzag >>= 7
+            deltas += bytes([zigzag])
+        return ret + bitmap.to_bytes((regs.N_STATUS_REGS + 7) // 8,
+                                     'little') + deltas
+
+    def _encode_telemetry(self):
+        _, addr, size, _ = self._subscription
+        return bytes([0x04, addr, size]) + b''.join(
+            _encode_int16(v) for v in self.reg[addr:addr + size])
+
+    def telemetry_task(self, current_millis):
+        """Returns the frame to push to the subscriber, or b'' if not due."""
+        interval = self._subscription[0]
+        if interval == 0:
+            return b''
+        if self.comm_timed_out(current_millis):
+            # The subscriber has gone.
+            self._subscription[0] = 0
+            return b''
+        if current_millis < self._subscription[3]:
+            return b''
+        self._subscription[3] += interval
+        if self._subscription[3] <= current_millis:
+            self._subscription[3] = current_millis + interval
+        return self._encode_telemetry()
+
+    def feedback(self, cur, target, output):
+        """Adds PD feedback control output. Throttle is kept unchanged."""
+        d_yaw = cur.rotation[2] / 100000
+        d_pitch = cur.rotation[1] / 100000
+        d_roll = cur.rotation[0] / 100000
+        p_yaw = cur.yaw - target[0]
+        p_pitch = cur.pitch - target[1]
+        p_roll = cur.roll - target[2]
+        if p_yaw > math.pi:
+            p_yaw -= 2 * math.pi
+        if p_yaw < -math.pi:
+            p_yaw += 2 * math.pi
+        if p_roll > math.pi:
+            p_roll -= 2 * math.pi
+        if p_roll < -math.pi:
+            p_roll += 2 * math.pi
+        r = self.reg
+        output.rudder = int(output.rudder + p_yaw * r[regs.GAIN_YAW_P] +
+                            d_yaw * r[regs.GAIN_YAW_D])
+        output.elevator = int(output.elevator + p_pitch * r[regs.GAIN_PITCH_P] +
+                              d_pitch * r[regs.GAIN_PITCH_D])
+        output.aileron = int(output.aileron + p_roll * r[regs.GAIN_ROLL_P] +
+                             d_roll * r[regs.GAIN_ROLL_D])
+
+    def write_motor_pwm(self, o):
+        for i in range(4):
+            y = (o.throttle * MIXING[0][i] + o.rudder * MIXING[1][i] +
+                 o.elevator * MIXING[2][i] + o.aileron * MIXING[3][i])
+            y = max(0, min(self.reg[regs.LIMITTER], y))
+            self.pwm[i] = y
+            self._set(regs.OUT_M0 + i, y)
+
+    def run_motor(self, o, batt_mv):
+        if batt_mv < SHUTOFF_VOLTAGE_MV:
+            amp = 0
+        else:
+            amp = BASE_BATTERY_VOLTAGE / batt_mv
+        self.write_motor_pwm(
+            Control(int(o.throttle * amp), int(o.rudder * amp),
+                    int(o.elevator * amp), int(o.aileron * amp)))
+
+    def test_mode(self):
+        for i in range(4):
+            self.pwm[i] = self.reg[regs.OUT_M0 + i]
+
+    def control_task(self, current_millis):
+        """Runs a control loop except for the telemetry.
+
+        The IMU and motor sections are recorded to the timing registers. The
+        rest of the timing is recorded by the caller (see EmulatorServer).
+        """
+        begin = time.perf_counter()
+        r = self.reg
+        if r[regs.TIMING_RESET] == 1:
+            self.timing.reset()
+        batt_mv = int(to_batt_voltage_mv(self.batt_ad))
+        self._set(regs.BATT_AD, self.batt_ad)
+        self._set(regs.BATT_VOLTAGE, batt_mv)
+
+        self._auto_pilot.throttle_for_landing = r[regs.HOVERING_VOLTAGE]
+        self._auto_pilot.descend_time_millis = r[regs.DESCEND_TIME]
+
+        self._batt_filter.put(batt_mv)
+        filtered = self._batt_filter.get()
+        if filtered is not None:
+            self._batt_mv_filtered = filtered
+            self._set(regs.BATT_VOLTAGE_FILTERED, filtered)
+            if filtered < r[regs.LOW_BATTERY_THRESHOLD]:
+                r[regs.BATT_STATUS] = 1
+                self._auto_pilot.enter_low_battery_mode(current_millis)
+            else:
+                r[regs.BATT_STATUS] = 2
+
+        if r[regs.JS_THROTTLE] == 0:
+            self._auto_pilot.init()
+
+        if r[regs.CALIBRATE] == 1:
+            self.imu.start_calibration()
+            r[regs.CALIBRATE] = 2
+        if r[regs.CALIBRATE] == 2:
+            if self.imu.calibration_ready():
+                r[regs.CALIBRATE] = 0
+
+        section_begin = _micros()
+        imu = self.imu.task(CONTROL_LOOP_INTERVAL_MICROS * 1.0e-6)
+        self.timing.record_section(SECTION_IMU, _micros() - section_begin)
+        self._set(regs.YAW_ANGLE, to_reg(imu.yaw))
+        self._set(regs.PITCH_ANGLE, to_reg(imu.pitch))
+        self._set(regs.ROLL_ANGLE, to_reg(imu.roll))
+        for i in range(3):
+            self._set(regs.ROTATION_X + i, imu.rotation[i])
+            self._set(regs.ACCEL_X + i, imu.accel[i])
+
+        if self.comm_timed_out(current_millis):
+            r[regs.ENABLE] = 0
+
+        target_yaw = to_radians(r[regs.TARGET_YAW])
+        target_pitch = (r[regs.TRIM_PITCH] * TRIM_SCALE +
+                        to_radians(r[regs.JS_PITCH]))
+        target_roll = (r[regs.TRIM_ROLL] * TRIM_SCALE +
+                       to_radians(r[regs.JS_ROLL]))
+        self._set(regs.TARGET_PITCH, to_reg(target_pitch))
+        self._set(regs.TARGET_ROLL, to_reg(target_roll))
+
+        ctrl = Control()
+        # Throttle is directly given by the command.
+        ctrl.throttle = self._auto_pilot.get_throttle(current_millis,
+                                                      r[regs.JS_THROTTLE])
+        # Others are given by the PD feedback controller.
+        if r[regs.JS_THROTTLE] > 0:
+            self.feedback(imu, (target_yaw, target_pitch, target_roll), ctrl)
+
+        self._set(regs.OUT_YAW, ctrl.rudder)
+        self._set(regs.OUT_PITCH, ctrl.elevator)
+        self._set(regs.OUT_ROLL, ctrl.aileron)
+        self._set(regs.OUT_THROTTLE, ctrl.throttle)
+        if not r[regs.ENABLE]:
+            ctrl = Control()
+        section_begin = _micros()
+        if r[regs.TEST_MODE] == 0xa5:
+            self.test_mode()
+        else:
+            self.run_motor(ctrl, self._batt_mv_filtered)
+        self.timing.record_section(SECTION_MOTOR, _micros() - section_begin)
+        self._set(regs.CTRL_INTERVAL, (time.perf_counter() - begin) * 1e6)
+        current_millis &= 0xffffffff
+        self._set(regs.ELAPSED_L, current_millis & 0xffff)
+        self._set(regs.ELAPSED_H, current_millis >> 16)
+
+
+class EmulatorServer:
+    """Serves an Emulator over UDP and runs its control task in real time.
+
+    Requests and control ticks are handled on a single thread, so the register
+    file is never accessed concurrently, like the firmware.
+    """
+
+    def __init__(self, emulator=None, addr='127.0.0.1', port=1234):
+        self.emulator = emulator if emulator is not None else Emulator()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((addr, port))
+        self.address = self.socket.getsockname()
+        self._start_time = time.monotonic()
+        # Sender of the last received packet, to push telemetry to.
+        self._peer = None
+        self._active = False
+        self._thread = None
+        # Time [us] spent handling requests since the last control loop,
+        # counted in its COMM section like the firmware.
+        self._receive_micros = 0
+
+    def millis(self):
+        return int((time.monotonic() - self._start_time) * 1000)
+
+    def serve_forever(self):
+        interval = CONTROL_LOOP_INTERVAL_MICROS * 1e-6
+        next_time = time.monotonic()
+        self._active = True
+        while self._active:
+            timeout = next_time - time.monotonic()
+            if timeout <= 0:
+                begin_micros = _micros()
+                current_millis = self.millis()
+                self.emulator.control_task(current_millis)
+                section_begin = _micros()
+                telemetry = self.emulator.telemetry_task(current_millis)
+                if telemetry and self._peer is not None:
+                    self.socket.sendto(telemetry, self._peer)
+                timing = self.emulator.timing
+                timing.record_section(
+                    SECTION_COMM,
+                    _micros() - section_begin + self._receive_micros)
+                self._receive_micros = 0
+                timing.record_loop(begin_micros, _micros())
+                next_time += interval
+                if time.monotonic() > next_time:
+                    timing.record_overrun()
+                    next_time = time.monotonic()
+                continue
+            self.socket.settimeout(timeout)
+            try:
+                data, peer = self.socket.recvfrom(256)
+            except socket.timeout:
+                continue
+            except OSError:
+                # The socket is closed by stop().
+                break
+            self._peer = peer
+            receive_begin = _micros()
+            ret = self.emulator.on_udp_received(self.millis(), data)
+            if ret:
+                self.socket.sendto(ret, peer)
+            self._receive_micros += _micros() - receive_begin
+
+    def start(self):
+        """Runs serve_forever() on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._active = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.socket.close()
+
+
+def main(argv):
+    if len(argv) > 1 and argv[1] in ('-h', '--help'):
+        print('usage: %s [<port number>] [<bind address>]' % argv[0])
+        return
+    port = int(argv[1]) if len(argv) > 1 else 1234
+    addr = argv[2] if len(argv) > 2 else '127.0.0.1'
+    server = EmulatorServer(addr=addr, port=port)
+    print('UDP Listening on %s:%d' % server.address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.socket.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
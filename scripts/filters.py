@@ -1,7 +1,97 @@
+# Signal filters shared by the ground tools.
+#
+# Every filter takes samples one by one with put() and returns the latest
+# output with get() (None until it has enough samples). batch() filters a whole
+# NumPy array at once, for processing logs offline (needs NumPy). MeanFilter
+# keeps the original push()/get_mean() interface of this module.
+
+import bisect
 import collections
+import math
+import struct
+
+try:
+    from scipy import signal as _signal
+except ImportError:
+    _signal = None
+
+_FLOAT32 = struct.Struct('<f')
+
+
+def _f32(x):
+    """Rounds x to single precision, like a float variable in the firmware."""
+    return _FLOAT32.unpack(_FLOAT32.pack(x))[0]
+
+
+def _lfilter(b, a, x, zi):
+    """scipy.signal.lfilter() of a first or second order filter."""
+    import numpy as np
+    if _signal is not None:
+        y, _ = _signal.lfilter(b, a, x, zi=zi)
+        return y
+    # Direct form II transposed.
+    y = np.empty(len(x))
+    z = list(zi) + [0.0] * (2 - len(zi))
+    b = list(b) + [0.0] * (3 - len(b))
+    a = list(a) + [0.0] * (3 - len(a))
+    for i, xi in enumerate(x.tolist()):
+        yi = b[0] * xi + z[0]
+        z[0] = b[1] * xi - a[1] * yi + z[1]
+        z[1] = b[2] * xi - a[2] * yi
+        y[i] = yi
+    return y
+
+
+class AverageFilter:
+    """Moving average over the last window_size samples.
+
+    Mirrors AverageFilter in firmware/common/filter.cpp, including its single
+    precision running sum, so that put()/get() return the same values as the
+    firmware. O(1) per sample.
+    """
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self._data = [0.0] * window_size
+        self._sum = 0.0
+        self._i = 0
+        self._count = 0
+
+    def put(self, x):
+        x = _f32(x)
+        self._sum = _f32(self._sum + x)
+        if self._count < self.window_size:
+            self._count += 1
+        else:
+            self._sum = _f32(self._sum - self._data[self._i])
+        self._data[self._i] = x
+        if self._i >= self.window_size - 1:
+            self._i = 0
+        else:
+            self._i += 1
+
+    def get(self):
+        if self._count < self.window_size:
+            return None
+        return _f32(self._sum / self.window_size)
+
+    def batch(self, x):
+        """Returns the moving average of each element of x (NaN until the
+        window is filled), computed in double precision. The state of the
+        filter is not used nor changed."""
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        n = self.window_size
+        y = np.full(len(x), np.nan)
+        if len(x) >= n:
+            c = np.concatenate(([0.0], np.cumsum(x)))
+            y[n - 1:] = (c[n:] - c[:-n]) / n
+        return y
 
 
 class MeanFilter:
+    """Moving average over the last size samples, summed in double precision
+    on each get_mean(). See AverageFilter for the firmware's float filter."""
 
     def __init__(self, size):
         self.data = collections.deque()
@@ -16,7 +106,115 @@ class MeanFilter:
         l = len(self.data)
         if l < self.size:
             return None
-        sum = 0
-        for x in self.data:
-            sum += x
-        return sum / l
+        return sum(self.data) / l
+
+
+class EmaFilter:
+    """Exponential moving average y += alpha * (x - y).
+
+    The first sample initializes the output.
+    """
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self._y = None
+
+    def put(self, x):
+        if self._y is None:
+            self._y = x
+        else:
+            self._y += self.alpha * (x - self._y)
+
+    def get(self):
+        return self._y
+
+    def batch(self, x):
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) == 0:
+            return x.copy()
+        b = [self.alpha]
+        a = [1.0, self.alpha - 1.0]
+        return _lfilter(b, a, x, [(1.0 - self.alpha) * x[0]])
+
+
+class MedianFilter:
+    """Moving median over the last window_size samples."""
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+        self._data = collections.deque()
+        self._sorted = []
+
+    def put(self, x):
+        self._data.append(x)
+        bisect.insort(self._sorted, x)
+        if len(self._data) > self.window_size:
+            old = self._data.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+
+    def get(self):
+        n = len(self._sorted)
+        if n < self.window_size:
+            return None
+        if n % 2:
+            return self._sorted[n // 2]
+        return (self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2
+
+    def batch(self, x):
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        n = self.window_size
+        y = np.full(len(x), np.nan)
+        if len(x) >= n:
+            windows = np.lib.stride_tricks.sliding_window_view(x, n)
+            y[n - 1:] = np.median(windows, axis=1)
+        return y
+
+
+class BiquadLowPass:
+    """Second order low-pass filter (Audio EQ Cookbook coefficients).
+
+    The state starts from the steady state of the first sample, so that the
+    output does not ramp up from 0.
+    """
+
+    def __init__(self, cutoff_hz, sample_hz, q=1 / math.sqrt(2)):
+        w0 = 2 * math.pi * cutoff_hz / sample_hz
+        alpha = math.sin(w0) / (2 * q)
+        cos_w0 = math.cos(w0)
+        a0 = 1 + alpha
+        self.b = [(1 - cos_w0) / 2 / a0, (1 - cos_w0) / a0,
+                  (1 - cos_w0) / 2 / a0]
+        self.a = [1.0, -2 * cos_w0 / a0, (1 - alpha) / a0]
+        self._z = None
+        self._y = None
+
+    def _steady_state(self, x):
+        b = self.b
+        a = self.a
+        # y = x at DC. Solve the state of direct form II transposed.
+        z1 = (b[2] - a[2]) * x
+        z0 = (b[1] - a[1]) * x + z1
+        return [z0, z1]
+
+    def put(self, x):
+        if self._z is None:
+            self._z = self._steady_state(x)
+        b = self.b
+        a = self.a
+        z = self._z
+        y = b[0] * x + z[0]
+        z[0] = b[1] * x - a[1] * y + z[1]
+        z[1] = b[2] * x - a[2] * y
+        self._y = y
+
+    def get(self):
+        return self._y
+
+    def batch(self, x):
+        import numpy as np
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) == 0:
+            return x.copy()
+        return _lfilter(self.b, self.a, x, self._steady_state(x[0]))
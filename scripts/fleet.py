@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+# Ground station for several drones on a single event loop.
+#
+# Each drone has its own Flight (configuration file, address and socket) and
+# is driven at its own fixed control rate by a task of the scheduler
+# (scheduler.py): every cycle sends the control command and a status request
+# without waiting. Replies are handled as they arrive through a selector, so a
+# slow or lost drone does not delay the others.
+#
+# With --delta, the status is requested as delta-encoded frames, which are
+# much smaller when many drones share a Wi-Fi channel.
+
+import selectors
+import sys
+import time
+
+import flight
+import scheduler
+
+DEFAULT_RATE_HZ = 50
+STATS_INTERVAL = 1.0
+
+
+class Drone:
+    """A Flight driven at a fixed rate by FleetManager.
+
+    Set `control` (flight.Control) to command the drone. The latest status is
+    in `elapsed` and `regs`, and the link statistics in `stats`
+    (udp_command.LinkStats).
+    """
+
+    def __init__(self, name, cfg_name, addr, port, rate_hz=DEFAULT_RATE_HZ):
+        self.name = name
+        self.flight = flight.Flight(cfg_name, addr, port)
+        self.control = flight.Control()
+        self.rate_hz = rate_hz
+        # scheduler.Task running cycle(), set by FleetManager.add().
+        self.task = None
+        self.elapsed = None
+        self.regs = None
+
+    @property
+    def stats(self):
+        return self.flight.comm.stats
+
+    def cycle(self, now):
+        self.flight.send(self.control)
+        # Counts the previous request as timed out if it is not answered.
+        self.flight.comm.request_all_status()
+
+    def on_readable(self, now):
+        t, d = self.flight.comm.receive_all_status()
+        if t is None:
+            return
+        self.elapsed = t
+        self.regs = d
+        self.flight.task(flight.summarize_status(d))
+
+
+class FleetManager:
+
+    def __init__(self):
+        self.drones = []
+        self.scheduler = scheduler.Scheduler()
+        self._selector = selectors.DefaultSelector()
+
+    def add(self, drone):
+        drone.stats.reset()
+        drone.task = self.scheduler.add(drone.name, drone.rate_hz,
+                                        drone.cycle)
+        self.drones.append(drone)
+        self._selector.register(drone.flight.comm.socket,
+                                selectors.EVENT_READ, drone)
+
+    def run_once(self):
+        """Runs the due cycles and handles replies until the next deadline."""
+        timeout = self.scheduler.run_due()
+        for key, _ in self._selector.select(timeout):
+            key.data.on_readable(time.monotonic())
+
+    def run(self, duration=None, on_cycle=None):
+        """Runs the loop for duration seconds (forever if None).
+
+        on_cycle(fleet) is called after each run_once(), e.g. to update
+        controls.
+        """
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            self.run_once()
+            if on_cycle is not None:
+                on_cycle(self)
+
+    def print_stats(self):
+        def ms(t):
+            return '  -  ' if t is None else '%5.1f' % (t * 1e3)
+
+        for drone in self.drones:
+            s = drone.stats.summary()
+            task = drone.task
+            print('%-20s %6.1f Hz  overrun %3d  late %5.1f ms  '
+                  'timeout %3d  rtt %s / %s ms' %
+                  (drone.name, task.rate(), task.overruns,
+                   task.max_lateness * 1e3, s['timeouts'], ms(s['rtt_mean']),
+                   ms(s['rtt_max'])))
+            drone.stats.reset()
+            task.reset_stats()
+
+    def close(self):
+        self._selector.close()
+
+
+def parse_drone(arg, rate_hz):
+    """Makes a Drone from '<config file>:<IP address>[:<port number>]'."""
+    items = arg.split(':')
+    port = int(items[2]) if len(items) > 2 else 1234
+    return Drone(arg, items[0], items[1], port, rate_hz)
+
+
+def main(argv):
+    usage = ('usage: %s [--rate <Hz>] [--delta] '
+             '<config file>:<IP address>[:<port>] ...' % argv[0])
+    args = argv[1:]
+    rate_hz = DEFAULT_RATE_HZ
+    delta = False
+    while args and args[0].startswith('--'):
+        if args[0] == '--rate' and len(args) > 1:
+            rate_hz = float(args[1])
+            args = args[2:]
+        elif args[0] == '--delta':
+            delta = True
+            args = args[1:]
+        else:
+            print(usage)
+            return
+    if not args:
+        print(usage)
+        return
+    drones = [parse_drone(arg, rate_hz) for arg in args]
+    for drone in drones:
+        drone.flight.comm.delta_status = delta
+    # Added after all are connected, so that they start on time.
+    fleet = FleetManager()
+    for drone in drones:
+        if not drone.flight.connected:
+            print('%s: failed to confirm the configuration' % drone.name)
+        fleet.add(drone)
+
+    # Monitoring only: all drones are kept at zero throttle.
+    fleet.scheduler.add('stats', 1.0 / STATS_INTERVAL,
+                        lambda now: fleet.print_stats(),
+                        delay=STATS_INTERVAL)
+    try:
+        fleet.run()
+    except KeyboardInterrupt:
+        pass
+    fleet.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -5,6 +5,8 @@ import udp_command
 
 STABILIZATION_TIME = 1000
 MAX_CTRL_VAL = 1023
+# Number of attempts to read back and re-send the configuration in connect().
+CONNECT_RETRIES = 3
 
 
 class Control:
@@ -27,17 +29,38 @@ TAKEOFF_RISE_DURATION = 0.5
 TAKEOFF_TOTAL_TIME = TAKEOFF_IDLE_DURATION + TAKEOFF_RISE_DURATION
 
 
+def summarize_status(d):
+    """Extracts the status used by Flight.task() from the registers."""
+    return {
+        'yaw_angle': d[regs.YAW_ANGLE],
+        'filtered_batt_voltage': d[regs.BATT_VOLTAGE_FILTERED],
+    }
+
+
+def format_regs(values):
+    """Formats {addr: value} as 'NAME=value ...'."""
+    if not values:
+        return 'no register changed'
+    return ' '.join('%s=%d' % (regs.NAMES[addr], v)
+                    for addr, v in sorted(values.items()))
+
+
 class Flight:
-    """Flight controller state and tasks."""
+    """Flight controller state and tasks.
+
+    Trims, the target yaw, enable and calibration requests, and the edits of
+    the configuration file are set in the register cache of comm, and written
+    with the next command by send() only if changed.
+    """
 
     def __init__(self, cfg_name, addr, port):
-        self.config = config.Config(cfg_name)
+        self.watched_config = config.WatchedConfig(cfg_name)
+        self.config = self.watched_config.config
         self.comm = udp_command.UDPCommand(addr, port)
-        self.init(self.config)
-        self.set_trim(self.config.roll_trim, self.config.pitch_trim)
         self.trim_throttle = self.config.throttle_trim
         self.trim_x = self.config.roll_trim
         self.trim_y = self.config.pitch_trim
+        self.connected = self.connect(self.config)
         self.mode = M_MANUAL
         self.land_start = 0
         self.takeoff_start_time = None
@@ -54,8 +77,8 @@ class Flight:
     def set_trim(self, x, y):
         self.trim_x = x
         self.trim_y = y
-        self.comm.write_reg(regs.TRIM_ROLL, self.trim_x)
-        self.comm.write_reg(regs.TRIM_PITCH, self.trim_y)
+        self.comm.set_reg(regs.TRIM_ROLL, self.trim_x)
+        self.comm.set_reg(regs.TRIM_PITCH, self.trim_y)
 
     def set_throttle_trim(self, throttle):
         self.trim_throttle = throttle
@@ -63,10 +86,10 @@ class Flight:
     def add_trim(self, x, y):
         if x:
             self.trim_x += x
-            self.comm.write_reg(regs.TRIM_ROLL, self.trim_x)
+            self.comm.set_reg(regs.TRIM_ROLL, self.trim_x)
         if y:
             self.trim_y += y
-            self.comm.write_reg(regs.TRIM_PITCH, self.trim_y)
+            self.comm.set_reg(regs.TRIM_PITCH, self.trim_y)
 
     def take_off(self):
         self.mode = M_ON_FLIGHT
@@ -145,37 +168,103 @@ class Flight:
             int(control.roll)
         ]
         self.comm.bulk_write(regs.JS_THROTTLE, data)
+        # Registers set since the last command, e.g. by key handlers.
+        self.comm.flush()
 
     def read_all_status(self):
         return self.comm.read_all_status()
 
     def set_target_yaw(self, yaw):
-        self.comm.write_reg(regs.TARGET_YAW, yaw)
+        self.comm.set_reg(regs.TARGET_YAW, yaw)
 
     def set_target_yaw_to_current(self):
-        self.comm.write_reg(regs.TARGET_YAW, self.last_yaw_angle)
+        self.comm.set_reg(regs.TARGET_YAW, self.last_yaw_angle)
 
     def calibrate(self):
-        self.comm.write_reg(regs.CALIBRATE, 1)
+        self.comm.request_reg(regs.CALIBRATE, 1)
 
     def enable(self, enable):
         if enable:
-            self.comm.write_reg(regs.ENABLE, 1)
+            self.comm.set_reg(regs.ENABLE, 1)
         else:
-            self.comm.write_reg(regs.ENABLE, 0)
-
-    def init(self, cfg):
-        self.comm.write_reg(regs.CALIBRATE, 1)
-        self.comm.write_reg(regs.ENABLE, 1)
-        self.comm.write_reg(regs.LIMITTER, 1000)
-        self.comm.write_reg(regs.HOVERING_VOLTAGE, 450)
-        self.comm.write_reg(regs.DESCEND_TIME, 4000)
-
-        self.comm.write_reg(regs.GAIN_PITCH_P, cfg.pitch_p)
-        self.comm.write_reg(regs.GAIN_PITCH_D, cfg.pitch_d)
-        self.comm.write_reg(regs.GAIN_ROLL_P, cfg.roll_p)
-        self.comm.write_reg(regs.GAIN_ROLL_D, cfg.roll_d)
-        self.comm.write_reg(regs.GAIN_YAW_P, cfg.yaw_p)
-        self.comm.write_reg(regs.GAIN_YAW_D, cfg.yaw_d)
-        self.comm.write_reg(regs.LOW_BATTERY_THRESHOLD,
-                            cfg.low_battery_threshold)
+            self.comm.set_reg(regs.ENABLE, 0)
+
+    def _config_regs(self, cfg):
+        return {
+            regs.ENABLE: 1,
+            regs.LIMITTER: 1000,
+            regs.HOVERING_VOLTAGE: 450,
+            regs.DESCEND_TIME: 4000,
+            regs.GAIN_PITCH_P: cfg.pitch_p,
+            regs.GAIN_PITCH_D: cfg.pitch_d,
+            regs.GAIN_ROLL_P: cfg.roll_p,
+            regs.GAIN_ROLL_D: cfg.roll_d,
+            regs.GAIN_YAW_P: cfg.yaw_p,
+            regs.GAIN_YAW_D: cfg.yaw_d,
+            regs.LOW_BATTERY_THRESHOLD: cfg.low_battery_threshold,
+        }
+
+    def reload_config(self):
+        """Applies the edits of the configuration file since the last call.
+
+        Only the registers whose values have been changed are set, and
+        written with the next command by send(). The drone is not initialized
+        or calibrated again. Returns {addr: value} set, or None if the file has
+        not been modified.
+        """
+        changed = self.watched_config.poll()
+        if changed is None:
+            return None
+        old, cfg = changed
+        self.config = cfg
+        old_values = self._config_regs(old)
+        values = {
+            addr: v
+            for addr, v in self._config_regs(cfg).items()
+            if old_values[addr] != v
+        }
+        # Trims may have been adjusted by keys. Replace only the edited ones.
+        if cfg.roll_trim != old.roll_trim:
+            self.trim_x = cfg.roll_trim
+            values[regs.TRIM_ROLL] = self.trim_x
+        if cfg.pitch_trim != old.pitch_trim:
+            self.trim_y = cfg.pitch_trim
+            values[regs.TRIM_PITCH] = self.trim_y
+        if cfg.throttle_trim != old.throttle_trim:
+            self.trim_throttle = cfg.throttle_trim
+        self.comm.set_regs(values)
+        return values
+
+    def connect(self, cfg, retries=CONNECT_RETRIES):
+        """Sends the configuration, trim and calibration request, and verifies
+        them by reading back.
+
+        Registers are written with a bulk write per contiguous range, and read
+        back with a single bulk read. Values which did not reach the drone, or
+        all of them if the read back is lost, are sent again. Returns False if
+        the configuration is not confirmed.
+        """
+        values = self._config_regs(cfg)
+        values[regs.TRIM_ROLL] = self.trim_x
+        values[regs.TRIM_PITCH] = self.trim_y
+        values[regs.CALIBRATE] = 1
+        self.comm.write_regs(values)
+        first = min(values)
+        n = max(values) - first + 1
+        for _ in range(retries):
+            rd = self.comm.bulk_read(first, n)
+            if rd is None:
+                self.comm.write_regs(values)
+                continue
+            lost = {}
+            for addr, v in values.items():
+                if addr == regs.CALIBRATE:
+                    # Becomes 2 during calibration, and then 0 after seconds.
+                    if rd[addr - first] == 0:
+                        lost[addr] = v
+                elif rd[addr - first] != v:
+                    lost[addr] = v
+            if not lost:
+                return True
+            self.comm.write_regs(lost)
+        return False
@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+
+# Offline sweep of the PD feedback gains with a quadcopter dynamics model.
+#
+# Step responses are simulated for every combination of P and D gains of an
+# axis at once, with NumPy arrays indexed by combination. The control law is
+# that of ControlTask() (firmware/common/control.cpp): Feedback(), RunMotor()
+# battery compensation, WriteMotorPWM() mixing and the LIMITTER clamp, at the
+# 5 ms loop interval and with the same integer truncations. The vehicle is a
+# rigid body rotated by the differential thrust of first-order lagged motors,
+# with an ideal IMU. The combinations are split among a process pool.
+#
+# Each combination is scored by the settling time and the overshoot of the
+# step response, and the best gains of each axis are written to a copy of the
+# configuration file as a candidate for a test flight.
+
+import argparse
+import concurrent.futures
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+import config
+import emulator
+
+AXES = ('roll', 'pitch', 'yaw')
+# Row of emulator.MIXING driven by the output of each axis.
+MIXING_ROW = {'roll': 3, 'pitch': 2, 'yaw': 1}
+# Keys of each axis in the [feedback_gain] section.
+GAIN_KEYS = {
+    'roll': ('RollP', 'RollD'),
+    'pitch': ('PitchP', 'PitchD'),
+    'yaw': ('YawP', 'YawD'),
+}
+# Lines of a configuration file, as parsed by configparser.
+SECTION_LINE = re.compile(r'\[([^\]]+)\]')
+OPTION_LINE = re.compile(r'(\s*)([^=:\s][^=:]*?)(\s*[=:]\s*)')
+DEFAULT_P_RANGE = {'roll': (0, 1000), 'pitch': (0, 1000), 'yaw': (0, 2000)}
+DEFAULT_D_RANGE = {'roll': (0, 4000), 'pitch': (0, 4000), 'yaw': (0, 8000)}
+
+# Rough model of an M5Atom Matrix class quadcopter.
+MASS = 0.035  # [kg]
+GRAVITY = 9.8  # [m/s^2]
+# Distance of a motor from the roll and pitch axes [m].
+ARM = 0.03
+# Moments of inertia around roll, pitch and yaw axes [kg m^2].
+INERTIA = np.array([1.4e-5, 1.4e-5, 2.2e-5])
+# Reaction torque of a propeller per thrust [N m / N].
+YAW_TORQUE_RATIO = 0.006
+MOTOR_TIME_CONSTANT = 0.03  # [s]
+
+DT = emulator.CONTROL_LOOP_INTERVAL_MICROS * 1e-6
+LIMITTER = 1000  # Written by Flight.connect()
+DEFAULT_BATTERY_MV = 3700
+DEFAULT_DURATION = 2.0  # [s]
+DEFAULT_STEP_DEGREES = 10.0
+DEFAULT_GRID = 64
+# The response is settled when it stays within this ratio of the step.
+SETTLING_BAND = 0.05
+# Score added per 100% of overshoot [s].
+OVERSHOOT_WEIGHT = 2.0
+
+
+def wrap(x):
+    """Wraps angles above pi or below -pi, as Feedback() does."""
+    x = np.where(x > math.pi, x - 2 * math.pi, x)
+    return np.where(x < -math.pi, x + 2 * math.pi, x)
+
+
+def simulate(p_gains, d_gains, target, throttle, batt_mv=DEFAULT_BATTERY_MV,
+             duration=DEFAULT_DURATION):
+    """Simulates the vehicle hovering at throttle from level, towards the
+    target angles (roll, pitch, yaw) [rad].
+
+    p_gains and d_gains are (N, 3) arrays of the register values of the roll,
+    pitch and yaw gains of N combinations. Returns the angles of every loop as
+    a (steps, N, 3) array.
+    """
+    n = len(p_gains)
+    steps = int(round(duration / DT))
+    mixing = np.array(emulator.MIXING)
+    # Rows of the outputs in the order of AXES.
+    axis_mixing = mixing[[MIXING_ROW[a] for a in AXES]]
+    # The throttle register trimmed for hovering lifts the weight when the
+    # battery compensation is applied.
+    thrust_per_duty = MASS * GRAVITY / (4 * max(throttle, 1))
+    if batt_mv < emulator.SHUTOFF_VOLTAGE_MV:
+        amp = 0.0
+    else:
+        amp = emulator.BASE_BATTERY_VOLTAGE / batt_mv
+    motor_gain = thrust_per_duty * batt_mv / emulator.BASE_BATTERY_VOLTAGE
+    torque_arm = np.array([ARM, ARM, YAW_TORQUE_RATIO])
+
+    angle = np.zeros((n, 3))
+    rate = np.zeros((n, 3))
+    thrust = np.full((n, 4), throttle * amp * motor_gain)
+    angles = np.empty((steps, n, 3))
+    for k in range(steps):
+        # Feedback(): the gyro in [deg/s * 100] as ImuTask() gives.
+        d = np.trunc(np.degrees(rate) * 100) / 100000
+        p = angle - target
+        p[:, 0] = wrap(p[:, 0])
+        p[:, 2] = wrap(p[:, 2])
+        out = np.trunc(p * p_gains + d * d_gains)
+        # RunMotor() and WriteMotorPWM().
+        duty = np.trunc(throttle * amp) + np.trunc(out * amp) @ axis_mixing
+        duty = np.clip(duty, 0, LIMITTER)
+        thrust += (duty * motor_gain - thrust) * (DT / MOTOR_TIME_CONSTANT)
+        # A positive output rotates towards the negative angle.
+        torque = -(thrust @ axis_mixing.T) * torque_arm
+        rate += torque / INERTIA * DT
+        angle += rate * DT
+        angles[k] = angle
+    return angles
+
+
+def score(response, step):
+    """Returns (score, overshoot ratio, settling time [s]) of step responses.
+
+    response is a (steps, N) array of an angle following a step from 0 to
+    step. Lower score is better.
+    """
+    error = np.abs(response - step)
+    outside = error > abs(step) * SETTLING_BAND
+    # Index of the last sample outside the band (-1 if none).
+    last = len(response) - 1 - np.argmax(outside[::-1], axis=0)
+    last = np.where(outside.any(axis=0), last, -1)
+    settling = (last + 1) * DT
+    overshoot = np.maximum(0.0, (response * np.sign(step)).max(axis=0) /
+                           abs(step) - 1)
+    # Diverged responses may overshoot many turns.
+    overshoot = np.nan_to_num(overshoot, nan=np.inf)
+    return settling + OVERSHOOT_WEIGHT * overshoot, overshoot, settling
+
+
+def _sweep_chunk(args):
+    axis, p, d, base_p, base_d, throttle, batt_mv, duration, step = args
+    i = AXES.index(axis)
+    p_gains = np.tile(base_p, (len(p), 1))
+    d_gains = np.tile(base_d, (len(d), 1))
+    p_gains[:, i] = p
+    d_gains[:, i] = d
+    target = np.zeros(3)
+    target[i] = step
+    angles = simulate(p_gains, d_gains, target, throttle, batt_mv, duration)
+    return score(angles[:, :, i], step)
+
+
+def sweep(axis, p_values, d_values, cfg, batt_mv=DEFAULT_BATTERY_MV,
+          duration=DEFAULT_DURATION, step=math.radians(DEFAULT_STEP_DEGREES),
+          jobs=None):
+    """Scores every combination of p_values and d_values for axis, the other
+    axes having the gains of cfg.
+
+    Returns (P, D, score, overshoot, settling) arrays of the combinations.
+    """
+    p, d = np.meshgrid(p_values, d_values, indexing='ij')
+    p = p.ravel()
+    d = d.ravel()
+    base_p = np.array([cfg.roll_p, cfg.pitch_p, cfg.yaw_p], dtype=float)
+    base_d = np.array([cfg.roll_d, cfg.pitch_d, cfg.yaw_d], dtype=float)
+    jobs = jobs or os.cpu_count() or 1
+    chunks = [(axis, pc, dc, base_p, base_d, cfg.throttle_trim, batt_mv,
+               duration, step)
+              for pc, dc in zip(np.array_split(p, jobs),
+                                np.array_split(d, jobs))
+              if len(pc)]
+    if jobs == 1:
+        results = [_sweep_chunk(c) for c in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            results = list(pool.map(_sweep_chunk, chunks))
+    scores, overshoot, settling = (np.concatenate(x) for x in zip(*results))
+    return p, d, scores, overshoot, settling
+
+
+def write_config(src, dst, gains):
+    """Copies configuration file src to dst with gains {axis: (P, D)}.
+
+    Only the values of the gain keys in [feedback_gain] are replaced. The
+    other lines, including comments and layout, are copied as they are.
+    """
+    values = {}
+    for axis, (p, d) in gains.items():
+        p_key, d_key = GAIN_KEYS[axis]
+        # Keys are case-insensitive, as read by configparser in config.py.
+        values[p_key.lower()] = int(p)
+        values[d_key.lower()] = int(d)
+    with open(src) as f:
+        lines = f.readlines()
+    section = None
+    for i, line in enumerate(lines):
+        m = SECTION_LINE.match(line)
+        if m:
+            section = m.group(1).strip()
+            continue
+        m = OPTION_LINE.match(line)
+        if (section == 'feedback_gain' and m and
+                m.group(2).lower() in values):
+            lines[i] = '%s%d\n' % (m.group(0), values.pop(m.group(2).lower()))
+    if values:
+        raise ValueError('%s: [feedback_gain] has no %s' %
+                         (src, ', '.join(sorted(values))))
+    with open(dst, 'w') as f:
+        f.write('# Gains tuned by gain_sweep.py from %s\n' %
+                os.path.basename(src))
+        f.writelines(lines)
+
+
+def parse_range(s):
+    lo, hi = s.split(':')
+    return float(lo), float(hi)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Sweeps the PD gains offline and writes the best ones.')
+    parser.add_argument('config', help='configuration file (ini/*.ini)')
+    parser.add_argument('--axes',
+                        default='roll,pitch,yaw',
+                        help='comma-separated axes to sweep')
+    parser.add_argument('--grid',
+                        type=int,
+                        default=DEFAULT_GRID,
+                        help='number of P and of D values of an axis')
+    parser.add_argument('--p-range',
+                        type=parse_range,
+                        metavar='MIN:MAX',
+                        help='range of P (default depends on the axis)')
+    parser.add_argument('--d-range',
+                        type=parse_range,
+                        metavar='MIN:MAX',
+                        help='range of D (default depends on the axis)')
+    parser.add_argument('--battery',
+                        type=float,
+                        default=DEFAULT_BATTERY_MV / 1000,
+                        help='battery voltage [V]')
+    parser.add_argument('--step',
+                        type=float,
+                        default=DEFAULT_STEP_DEGREES,
+                        help='step of the target angle [deg]')
+    parser.add_argument('--duration',
+                        type=float,
+                        default=DEFAULT_DURATION,
+                        help='simulated time of a step response [s]')
+    parser.add_argument('--jobs', type=int, help='number of processes')
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--output',
+                        metavar='FILE',
+                        help='candidate configuration file to write')
+    args = parser.parse_args(argv[1:])
+
+    cfg = config.Config(args.config)
+    batt_mv = args.battery * 1000
+    step = math.radians(args.step)
+    best = {}
+    for axis in args.axes.split(','):
+        if axis not in AXES:
+            print('unknown axis %s' % axis)
+            return 1
+        p_values = np.linspace(*(args.p_range or DEFAULT_P_RANGE[axis]),
+                               args.grid).round()
+        d_values = np.linspace(*(args.d_range or DEFAULT_D_RANGE[axis]),
+                               args.grid).round()
+        p, d, scores, overshoot, settling = sweep(axis, p_values, d_values,
+                                                  cfg, batt_mv, args.duration,
+                                                  step, args.jobs)
+        p_key, d_key = GAIN_KEYS[axis]
+        current = sweep(axis, [getattr(cfg, axis + '_p')],
+                        [getattr(cfg, axis + '_d')], cfg, batt_mv,
+                        args.duration, step, 1)
+        print('%s: %d combinations' % (axis, len(scores)))
+        print('  current  %s=%-5d %s=%-5d score %6.3f  overshoot %5.1f%%  '
+              'settling %.3f s' %
+              (p_key, current[0][0], d_key, current[1][0], current[2][0],
+               current[3][0] * 100, current[4][0]))
+        for rank, i in enumerate(np.argsort(scores, kind='stable')[:args.top]):
+            print('  #%-7d %s=%-5d %s=%-5d score %6.3f  overshoot %5.1f%%  '
+                  'settling %.3f s' % (rank + 1, p_key, p[i], d_key, d[i],
+                                       scores[i], overshoot[i] * 100,
+                                       settling[i]))
+        i = np.argmin(scores)
+        best[axis] = (p[i], d[i])
+    if args.output:
+        write_config(args.config, args.output, best)
+        print('wrote %s' % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
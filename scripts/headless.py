@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+# Ground station without display or joystick, for scripted and batch runs.
+#
+# Flight is driven from a stick script or a recorded stick trace (a flight
+# record of joystick.py or of this script), and the status of every cycle is
+# written to a flight record only. Each cycle sends the command and reads the
+# status, at a fixed rate kept by scheduler.py; with --rate 0 cycles run back
+# to back, e.g. for soak tests against the emulator.
+#
+# A stick script has a line '<time [s]> <throttle> <roll> <pitch> [<yaw>]' per
+# change of the sticks, in the units of flight.Control. Each line holds until
+# the time of the next one. '#' starts a comment.
+
+import bisect
+import sys
+import time
+
+import flight
+import recorder
+import registers as regs
+import scheduler
+
+DEFAULT_RATE_HZ = 100
+STATS_INTERVAL = 1.0
+
+
+class StickInput:
+    """Controls changing at the given times [s] from the start."""
+
+    def __init__(self, times, controls):
+        if not times:
+            raise ValueError('no stick input')
+        self.times = times
+        self.controls = controls
+
+    @property
+    def duration(self):
+        return self.times[-1]
+
+    def control(self, t):
+        """Returns the control at time t, the first one before it starts."""
+        i = bisect.bisect_right(self.times, t) - 1
+        return self.controls[max(0, i)]
+
+
+def make_control(throttle, roll, pitch, yaw=0):
+    ctrl = flight.Control()
+    ctrl.throttle = throttle
+    ctrl.roll = roll
+    ctrl.pitch = pitch
+    ctrl.yaw = yaw
+    return ctrl
+
+
+def load_script(path):
+    times = []
+    controls = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            items = line.split('#', 1)[0].split()
+            if not items:
+                continue
+            if len(items) not in (4, 5):
+                raise ValueError('%s:%d: expected <time> <throttle> <roll> '
+                                 '<pitch> [<yaw>]' % (path, n))
+            t = float(items[0])
+            if times and t < times[-1]:
+                raise ValueError('%s:%d: time goes backward' % (path, n))
+            times.append(t)
+            controls.append(make_control(*[float(x) for x in items[1:]]))
+    return StickInput(times, controls)
+
+
+def load_trace(path):
+    """Reads the sticks recorded in the JS_* registers of a flight record."""
+    a = recorder.load(path)
+    if len(a) == 0:
+        raise ValueError('%s has no records' % path)
+    times = (a['host_time'] - a['host_time'][0]).tolist()
+    sticks = a['regs'][:, [
+        regs.JS_THROTTLE, regs.JS_ROLL, regs.JS_PITCH, regs.JS_YAW
+    ]].tolist()
+    return StickInput(times, [make_control(*s) for s in sticks])
+
+
+def record_status(rec, t, d, ctrl):
+    # The command block is not in the status. Record the sticks there, so
+    # that the record can be played back as a trace.
+    d[regs.JS_THROTTLE] = ctrl.throttle
+    d[regs.JS_YAW] = ctrl.yaw
+    d[regs.JS_PITCH] = ctrl.pitch
+    d[regs.JS_ROLL] = ctrl.roll
+    rec.write(t, d)
+
+
+def run(f, stick, rec, rate_hz=DEFAULT_RATE_HZ, duration=None, repeat=False,
+        on_stats=None):
+    """Runs the cycles until the input (or duration, if given) ends.
+
+    With repeat, the input starts over at its end. on_stats(scheduler, stats)
+    is called every STATS_INTERVAL. Returns the number of cycles.
+    """
+    if duration is None:
+        duration = None if repeat else stick.duration
+    begin = time.monotonic()
+
+    def cycle(now):
+        elapsed = now - begin
+        if repeat and stick.duration > 0:
+            elapsed %= stick.duration
+        ctrl = stick.control(elapsed)
+        f.send(ctrl)
+        values = f.reload_config()
+        if values is not None:
+            print('config reloaded: %s' % flight.format_regs(values))
+        t, d = f.read_all_status()
+        if t is not None:
+            record_status(rec, t, d, ctrl)
+            f.task(flight.summarize_status(d))
+            if ctrl.throttle == 0:
+                f.set_target_yaw_to_current()
+
+    sched = scheduler.Scheduler()
+    cycle_task = sched.add('cycle', rate_hz, cycle)
+    if on_stats is not None:
+        sched.add('stats', 1.0 / STATS_INTERVAL,
+                  lambda now: on_stats(sched, f.comm.stats),
+                  delay=STATS_INTERVAL)
+    sched.run(duration=duration)
+    return cycle_task.runs
+
+
+def print_stats(sched, stats):
+    print('%s  %s' % (sched.format_stats(), stats.format()))
+    stats.reset()
+
+
+def main(argv):
+    args = argv[1:]
+    rate_hz = DEFAULT_RATE_HZ
+    duration = None
+    repeat = False
+    script = None
+    trace = None
+    path = None
+    while args and args[0].startswith('--'):
+        if args[0] == '--rate' and len(args) > 1:
+            rate_hz = float(args[1])
+            args = args[2:]
+        elif args[0] == '--duration' and len(args) > 1:
+            duration = float(args[1])
+            args = args[2:]
+        elif args[0] == '--repeat':
+            repeat = True
+            args = args[1:]
+        elif args[0] == '--script' and len(args) > 1:
+            script = args[1]
+            args = args[2:]
+        elif args[0] == '--trace' and len(args) > 1:
+            trace = args[1]
+            args = args[2:]
+        elif args[0] == '--record' and len(args) > 1:
+            path = args[1]
+            args = args[2:]
+        else:
+            args = []
+    if len(args) < 2 or (script is None) == (trace is None):
+        print('usage: %s (--script <file> | --trace <record file>) '
+              '[--rate <Hz>] [--duration <s>] [--repeat] '
+              '[--record <file>] <config file> <IP address> [<port>]' %
+              argv[0])
+        return 1
+    stick = load_script(script) if script else load_trace(trace)
+    port = int(args[2]) if len(args) > 2 else 1234
+    f = flight.Flight(args[0], args[1], port)
+    if not f.connected:
+        print('failed to confirm the configuration of the drone')
+    f.comm.stats.reset()
+
+    rec = recorder.Recorder()
+    rec.start(path)
+    print('recording to %s' % rec.path)
+    try:
+        run(f, stick, rec, rate_hz, duration, repeat, on_stats=print_stats)
+    except KeyboardInterrupt:
+        pass
+    rec.stop()
+    f.comm.close()
+    print('%d records' % rec.count)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,42 +1,148 @@
 #!/usr/bin/python3
 
 # Non-ROS version of the manual control console using USB game controller.
+#
+# Control commands are sent at a fixed rate on their own thread, and the
+# status pushed by the drone at the telemetry interval is received on another
+# thread. The main thread handles the events and draws the latest status at the
+# display rate, so that a slow frame does not delay the commands. The terminal
+# dashboard is updated at its own, lower rate. The rates are kept by
+# schedulers (scheduler.py), whose overruns are shown on the dashboard.
 
-import datetime
 import math
 import pygame
 from pygame.locals import *
 import sys
+import threading
+import time
 
 import console
+import dashboard
 import registers as regs
 import flight
+import recorder
+import scheduler
 
+CONTROL_RATE_HZ = 100
+TELEMETRY_INTERVAL_MS = 10
+DISPLAY_RATE_HZ = 30
+# Rate of checking the edits of the configuration file.
+CONFIG_POLL_RATE_HZ = 2
+# The status is regarded as lost when not received for this duration [s].
+STATUS_TIMEOUT = 0.5
+# Duration [s] to show a notice on the dashboard.
+NOTICE_DURATION = 3.0
 
-class Recorder:
+
+class Snapshot:
+    """The latest status, shared between the threads."""
 
     def __init__(self):
-        self.active = False
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._t = None
+        self._d = None
+        self._time = None
+
+    def set(self, t, d):
+        with self._lock:
+            self._seq += 1
+            self._t = t
+            self._d = d
+            self._time = time.monotonic()
+
+    def get(self):
+        """Returns (sequence number, elapsed, regs, host time received)."""
+        with self._lock:
+            return self._seq, self._t, self._d, self._time
+
+
+def reload_config(f, state):
+    values = f.reload_config()
+    if values is not None:
+        state['notice'] = ('config reloaded: %s' % flight.format_regs(values),
+                           time.monotonic())
+
+
+def telemetry_loop(f, state, snapshot, rec, rec_lock, stop):
+    """Receives the status pushed by the drone until stop is set."""
+    for t, d in f.comm.telemetry(TELEMETRY_INTERVAL_MS, stop=stop):
+        ctrl = state['ctrl']
+        # The sticks are not received. Fill sent values instead for printing,
+        # and for headless.py to play the record back as a trace.
+        d[regs.JS_THROTTLE] = ctrl.throttle
+        d[regs.JS_YAW] = ctrl.yaw
+        d[regs.JS_PITCH] = ctrl.pitch
+        d[regs.JS_ROLL] = ctrl.roll
+        with rec_lock:
+            if rec.active:
+                rec.write(t, d)
+        f.task(flight.summarize_status(d))
+        if ctrl.throttle == 0:
+            f.set_target_yaw_to_current()
+        snapshot.set(t, d)
+
 
-    def start(self):
-        current = datetime.datetime.now()
-        self.path = '%s.txt' % current.isoformat(timespec='seconds')
-        self.file = open(self.path, 'w')
-        self.active = True
+# Registers shown on the dashboard.
+STATUS_ITEMS = [
+    (regs.ROLL_ANGLE, 'angle roll'),
+    (regs.PITCH_ANGLE, 'angle pitch'),
+    (regs.YAW_ANGLE, 'angle yaw'),
+    (regs.TARGET_ROLL, 'tatget roll'),
+    (regs.TARGET_PITCH, 'tatget pitch'),
+    (regs.TARGET_YAW, 'tatget yaw'),
+    (regs.OUT_ROLL, 'out roll'),
+    (regs.OUT_PITCH, 'out pitch'),
+    (regs.OUT_YAW, 'out yaw'),
+    (regs.JS_THROTTLE, 'throttle'),
+    (regs.BATT_VOLTAGE, 'battery [mV]'),
+    (regs.BATT_VOLTAGE_FILTERED, '  (after LPF)'),
+    (regs.ROTATION_X, 'rot.x'),
+    (regs.ROTATION_Y, 'rot.y'),
+    (regs.ROTATION_Z, 'rot.z'),
+    (regs.ACCEL_X, 'acc.x'),
+    (regs.ACCEL_Y, 'acc.y'),
+    (regs.ACCEL_Z, 'acc.z'),
+    (regs.BATT_AD, 'batt.AD'),
+    (regs.CTRL_INTERVAL, 'control interval'),
+]
+# Values derived from the threads and the link statistics.
+DERIVED_LABELS = [
+    'control rate [Hz]', 'status rate [Hz]', 'link loss [%]', 'rtt p50 [ms]',
+    'status age [ms]', 'overruns ctrl/ui'
+]
+DASHBOARD_LABELS = (['time'] + [label for _, label in STATUS_ITEMS] +
+                    DERIVED_LABELS)
 
-    def write(self, data):
-        assert (self.active)
-        self.file.write("\t".join([str(i[1]) for i in data]))
-        self.file.write("\n")
 
-    def stop(self):
-        self.active = False
-        self.file.close()
+def dashboard_values(f, t, d, control_rate, status_rate, tasks):
+    values = ['-' if t is None else '%d' % t]
+    for addr, _ in STATUS_ITEMS:
+        values.append('-' if d is None else '%d' % d[addr])
+
+    def fmt(format, value):
+        return '-' if value is None else format % value
+
+    stats = f.comm.stats
+    rtt = stats.rtt_percentile(50)
+    age = stats.status_age()
+    values += [
+        fmt('%.1f', control_rate),
+        fmt('%.1f', status_rate),
+        '%.1f' % (stats.loss() * 100),
+        fmt('%.3f', None if rtt is None else rtt * 1e3),
+        fmt('%.0f', None if age is None else age * 1e3),
+        '/'.join('%d' % task.overruns for task in tasks),
+    ]
+    return values
 
 
 def main(argv):
-    ctrl = flight.Control()
-    recorder = Recorder()
+    # The command sent by the control thread. Replaced as a whole, so that the
+    # thread never sees a partially updated one.
+    state = {'ctrl': flight.Control(), 'notice': ('', 0.0)}
+    rec = recorder.Recorder()
+    rec_lock = threading.Lock()
 
     def onUpdate(joystick):
 
@@ -44,6 +150,7 @@ def main(argv):
             # 1/10 degrees
             return val * 30.0 * 10
 
+        ctrl = flight.Control()
         THROTTLE_DEADBAND = 0.05
         if math.fabs(joystick.get_axis(1)) < THROTTLE_DEADBAND:
             ctrl.throttle = 0
@@ -54,48 +161,7 @@ def main(argv):
         ctrl.yaw = 0
         ctrl.pitch = jsToAngle(-joystick.get_axis(4))
         ctrl.roll = jsToAngle(joystick.get_axis(3))
-
-    def sync(c):
-        t, d = f.read_all_status()
-        if t is None:
-            return
-        # THROTTLE is not received. Fill sent value instead for printing.
-        d[regs.JS_THROTTLE] = ctrl.throttle
-        raw_items = [
-            (regs.ROLL_ANGLE, 'angle roll'),
-            (regs.PITCH_ANGLE, 'angle pitch'),
-            (regs.YAW_ANGLE, 'angle yaw'),
-            (regs.TARGET_ROLL, 'tatget roll'),
-            (regs.TARGET_PITCH, 'tatget pitch'),
-            (regs.TARGET_YAW, 'tatget yaw'),
-            (regs.OUT_ROLL, 'out roll'),
-            (regs.OUT_PITCH, 'out pitch'),
-            (regs.OUT_YAW, 'out yaw'),
-            (regs.JS_THROTTLE, 'throttle'),
-            (regs.BATT_VOLTAGE, 'battery [mV]'),
-            (regs.BATT_VOLTAGE_FILTERED, '  (after LPF)'),
-            (regs.ROTATION_X, 'rot.x'),
-            (regs.ROTATION_Y, 'rot.y'),
-            (regs.ROTATION_Z, 'rot.z'),
-            (regs.ACCEL_X, 'acc.x'),
-            (regs.ACCEL_Y, 'acc.y'),
-            (regs.ACCEL_Z, 'acc.z'),
-            (regs.BATT_AD, 'batt.AD'),
-            (regs.CTRL_INTERVAL, 'control interval'),
-        ]
-        items = [('time', t)]
-        for i in raw_items:
-            items.append((i[1], '%d' % d[i[0]]))
-        print("\033[2J\033[%d;%dH" % (0, 0))
-        for i in items:
-            print("%-20s %s" % (i[0], i[1]))
-        if recorder.active:
-            recorder.write(items)
-        con.update(t, ctrl, d, f)
-        return {
-            'yaw_angle': d[regs.YAW_ANGLE],
-            'filtered_batt_voltage': d[regs.BATT_VOLTAGE_FILTERED],
-        }
+        state['ctrl'] = ctrl
 
     pygame.joystick.init()
 
@@ -118,12 +184,37 @@ def main(argv):
     else:
         port = 1234
     f = flight.Flight(argv[1], argv[2], port)
+    if not f.connected:
+        print('failed to confirm the configuration of the drone')
+
+    snapshot = Snapshot()
+    stop = threading.Event()
+    control = scheduler.Scheduler()
+    command_task = control.add('command', CONTROL_RATE_HZ,
+                               lambda now: f.send(state['ctrl']))
+    # Pushed from the control thread, between the commands. The file is
+    # checked at the rate of the task.
+    f.watched_config.interval = 0
+    control.add('config', CONFIG_POLL_RATE_HZ,
+                lambda now: reload_config(f, state))
+    threads = [
+        threading.Thread(target=control.run, args=(stop,), daemon=True),
+        threading.Thread(target=telemetry_loop,
+                         args=(f, state, snapshot, rec, rec_lock, stop),
+                         daemon=True),
+    ]
+    for th in threads:
+        th.start()
+
+    board = dashboard.Dashboard(DASHBOARD_LABELS)
+    control_rate = dashboard.RateMeter()
+    status_rate = dashboard.RateMeter()
+    last_seq = 0
 
-    active = True
-    while active:
+    def handleEvents():
         for e in pygame.event.get():
             if e.type == QUIT:
-                active = False
+                stop.set()
 
             if e.type == pygame.locals.JOYAXISMOTION:
                 onUpdate(joystick)
@@ -147,22 +238,52 @@ def main(argv):
                 if c == ord('1'):
                     f.enable(True)
                 if c == ord('r'):
-                    recorder.start()
+                    with rec_lock:
+                        rec.start()
                 if c == ord('e'):
-                    recorder.stop()
+                    with rec_lock:
+                        rec.stop()
                 if c == ord('\x1b'):
-                    active = False
-
-        f.send(ctrl)
-        st = sync(ctrl)
-        if st is None:
-            print("data not received")
-            continue
-        f.task(st)
-        if ctrl.throttle == 0:
-            f.set_target_yaw_to_current()
-        if not f.stabilized:
-            print("Initializing...")
+                    stop.set()
+
+    def draw(now):
+        nonlocal last_seq
+        handleEvents()
+        seq, t, d, received = snapshot.get()
+        if seq != last_seq:
+            last_seq = seq
+            con.update(t, state['ctrl'], d, f)
+        # Drawing the console may take a while.
+        now = time.monotonic()
+        if board.due(now):
+            control_rate.update(command_task.runs, now)
+            status_rate.update(seq, now)
+            notice, notice_time = state['notice']
+            if received is None or now > received + STATUS_TIMEOUT:
+                message = 'data not received'
+            elif f.watched_config.error is not None:
+                # Parse errors span lines.
+                message = ('config not reloaded: %s' %
+                           str(f.watched_config.error).splitlines()[0])
+            elif not f.stabilized:
+                message = 'Initializing...'
+            elif now < notice_time + NOTICE_DURATION:
+                message = notice
+            else:
+                message = ''
+            board.update(
+                dashboard_values(f, t, d, control_rate.rate, status_rate.rate,
+                                 [command_task, ui_task]), message, now)
+
+    ui = scheduler.Scheduler()
+    ui_task = ui.add('ui', DISPLAY_RATE_HZ, draw)
+    ui.run(stop)
+
+    stop.set()
+    for th in threads:
+        th.join(1.0)
+    with rec_lock:
+        rec.stop()
 
 
 if __name__ == "__main__":
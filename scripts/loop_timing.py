@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+# Reports the timing statistics of the control loop of a drone (or the
+# emulator), which the firmware keeps in the timing registers.
+#
+# The statistics are reset, collected for a while and read back, to see
+# whether the loop holds its rate, how much of the period it uses, and how long
+# ImuTask(), the communication (telemetry and request handling) and the motor
+# output take. The counters saturate at
+# 65535 loops (about 5 minutes).
+
+import sys
+import time
+
+import registers as regs
+import udp_command
+
+CONTROL_LOOP_INTERVAL_MICROS = 5000
+DEFAULT_DURATION = 5.0
+# The loop is regarded as holding its rate above this ratio of the nominal
+# rate.
+RATE_TOLERANCE = 0.99
+TIMING_BINS = 8
+FIRST_BIN_MICROS = 64
+SECTIONS = [
+    ('imu', regs.IMU_HIST_0),
+    ('comm', regs.COMM_HIST_0),
+    ('motor', regs.MOTOR_HIST_0),
+]
+HISTOGRAM_WIDTH = 40
+# The reset is confirmed when LOOP_COUNT is read back within the loops of the
+# time since the write, plus this margin.
+RESET_MARGIN_LOOPS = 2
+RESET_RETRIES = 3
+# Time [s] to wait for the control loop to take a reset.
+RESET_TIMEOUT = 0.1
+
+
+def read_elapsed(udp):
+    t, _ = udp.read_all_status()
+    return t
+
+
+def read_timing(udp):
+    """Returns {register name: value} of the timing registers, or None."""
+    values = udp.bulk_read(regs.FIRST_TIMING_REG, regs.N_TIMING_REGS)
+    if values is None:
+        return None
+    return {
+        regs.NAMES[regs.FIRST_TIMING_REG + i]: v & 0xffff
+        for i, v in enumerate(values)
+    }
+
+
+def reset_timing(udp):
+    """Resets the statistics, and confirms it by reading back LOOP_COUNT.
+
+    The next loop takes the reset and clears TIMING_RESET. Returns False if
+    the reset is not confirmed, e.g. the write is lost.
+    """
+    for _ in range(RESET_RETRIES):
+        udp.write_reg(regs.TIMING_RESET, 1)
+        sent = time.monotonic()
+        while time.monotonic() < sent + RESET_TIMEOUT:
+            rd = udp.bulk_read(regs.TIMING_RESET, 2)
+            if rd is None or rd[0] != 0:
+                continue
+            loops = ((time.monotonic() - sent) * 1e6 /
+                     CONTROL_LOOP_INTERVAL_MICROS)
+            if rd[1] & 0xffff <= loops + RESET_MARGIN_LOOPS:
+                return True
+            # Cleared, but not by this write.
+            break
+    return False
+
+
+def measure(udp, duration):
+    """Resets the statistics and reads them after duration seconds.
+
+    Returns (timing registers, elapsed device time [ms]), or (None, None).
+    """
+    if not reset_timing(udp):
+        return None, None
+    begin = read_elapsed(udp)
+    time.sleep(duration)
+    end = read_elapsed(udp)
+    timing = read_timing(udp)
+    if begin is None or end is None or timing is None:
+        return None, None
+    return timing, end - begin
+
+
+def bin_label(i):
+    if i == 0:
+        return '< %d us' % FIRST_BIN_MICROS
+    if i == TIMING_BINS - 1:
+        return '>= %d us' % (FIRST_BIN_MICROS << (i - 1))
+    return '%d-%d us' % (FIRST_BIN_MICROS << (i - 1), FIRST_BIN_MICROS << i)
+
+
+def report(timing, elapsed_ms):
+    """Returns the report as a list of lines."""
+    nominal_hz = 1e6 / CONTROL_LOOP_INTERVAL_MICROS
+    count = timing['LOOP_COUNT']
+    rate = count * 1000.0 / elapsed_ms if elapsed_ms > 0 else 0.0
+    overruns = timing['LOOP_OVERRUNS']
+    lines = [
+        'loops      %d in %.3f s (%.1f Hz, nominal %.0f Hz)' %
+        (count, elapsed_ms / 1000.0, rate, nominal_hz),
+        'overruns   %d' % overruns,
+    ]
+    if count == 0:
+        lines.append('no loop recorded')
+        return lines
+    lines += [
+        'exec time  min %d  mean %d  max %d us (%.0f%% of the period)' %
+        (timing['LOOP_TIME_MIN'], timing['LOOP_TIME_MEAN'],
+         timing['LOOP_TIME_MAX'],
+         timing['LOOP_TIME_MEAN'] * 100.0 / CONTROL_LOOP_INTERVAL_MICROS),
+    ]
+    if count > 1:
+        lines.append('period     min %d  max %d us' %
+                     (timing['LOOP_PERIOD_MIN'], timing['LOOP_PERIOD_MAX']))
+    for name, first in SECTIONS:
+        hist = [timing[regs.NAMES[first + i]] for i in range(TIMING_BINS)]
+        peak = max(hist)
+        lines.append('%s:' % name)
+        for i, n in enumerate(hist):
+            bar = '#' * (n * HISTOGRAM_WIDTH // peak if peak else 0)
+            lines.append(('  %-12s %6d %s' % (bin_label(i), n, bar)).rstrip())
+    if rate >= nominal_hz * RATE_TOLERANCE and overruns == 0:
+        lines.append('OK: the loop holds %.0f Hz' % nominal_hz)
+    else:
+        lines.append('NG: the loop does not hold %.0f Hz' % nominal_hz)
+    return lines
+
+
+def main(argv):
+    args = argv[1:]
+    duration = DEFAULT_DURATION
+    watch = False
+    while args and args[0].startswith('--'):
+        if args[0] == '--duration' and len(args) > 1:
+            duration = float(args[1])
+            args = args[2:]
+        elif args[0] == '--watch':
+            watch = True
+            args = args[1:]
+        else:
+            args = []
+    if not args:
+        print('usage: %s [--duration <s>] [--watch] <IP address> [<port>]' %
+              argv[0])
+        return
+    port = int(args[1]) if len(args) > 1 else 1234
+    udp = udp_command.UDPCommand(args[0], port)
+    udp.timeout = 0.1
+    try:
+        while True:
+            timing, elapsed_ms = measure(udp, duration)
+            if timing is None:
+                print('data not received')
+            else:
+                print('\n'.join(report(timing, elapsed_ms)))
+            if not watch:
+                break
+            print()
+    except KeyboardInterrupt:
+        pass
+    udp.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
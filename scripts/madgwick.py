@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+
+# Python port of the attitude estimation of ImuTask() (firmware/*/imu.cpp),
+# to re-estimate the attitude from the recorded gyro and accelerometer
+# registers with different parameters.
+#
+# Madgwick mirrors Madgwick::updateIMU() of the Arduino MadgwickAHRS library
+# used by the firmware, including the approximate invSqrt(). MadgwickBatch runs
+# N filters at once in NumPy float32, e.g. with different beta values, over the
+# same samples. GyroCalibration mirrors Calibrate()/AddCalibPoint().
+#
+# The recorded ROTATION_* [deg/s * 100] and ACCEL_* [g * 1000] registers are
+# already remapped to the robot axes and calibrated on the device (see
+# from_record()). A record holds the received frames, e.g. every other control
+# loop, so the filter runs at the rate of the record (record_sample_freq())
+# unless --rate is given.
+
+import math
+import struct
+import sys
+
+import numpy as np
+
+import recorder
+import registers as regs
+
+DEFAULT_BETA = 0.1  # betaDef of MadgwickAHRS
+DEFAULT_SAMPLE_FREQ = 200.0  # 5 ms control loop, if a record has no rate
+# Number of gyro samples averaged by the calibration (BUFSIZE in imu.cpp).
+CALIBRATION_SAMPLES = 1000
+DEG_TO_RAD = 0.0174533  # as in updateIMU()
+# estimate() runs fewer filters one by one on floats, which is faster than
+# MadgwickBatch below this number.
+BATCH_MIN_FILTERS = 24
+
+_F32 = struct.Struct('<f')
+_I32 = struct.Struct('<i')
+
+
+def inv_sqrt(x):
+    """Fast inverse square root of invSqrt(), on a float."""
+    halfx = 0.5 * x
+    i = _I32.unpack(_F32.pack(x))[0]
+    i = 0x5f3759df - (i >> 1)
+    y = _F32.unpack(_I32.pack(i))[0]
+    y = y * (1.5 - halfx * y * y)
+    return y * (1.5 - halfx * y * y)
+
+
+def inv_sqrt_array(x):
+    """Fast inverse square root of invSqrt(), on a float32 array."""
+    x = np.asarray(x, dtype=np.float32)
+    halfx = np.float32(0.5) * x
+    y = (np.int32(0x5f3759df) - (x.view(np.int32) >> 1)).view(np.float32)
+    y = y * (np.float32(1.5) - halfx * y * y)
+    return y * (np.float32(1.5) - halfx * y * y)
+
+
+def update_imu(q, gx, gy, gz, ax, ay, az, beta, inv_sample_freq, inv_sqrt):
+    """Returns quaternion q = (q0, q1, q2, q3) updated by a sample of gyro
+    [deg/s] and accelerometer [any unit] values.
+
+    All arguments may be floats or arrays of N filters, with the matching
+    inv_sqrt function.
+    """
+    q0, q1, q2, q3 = q
+    gx *= DEG_TO_RAD
+    gy *= DEG_TO_RAD
+    gz *= DEG_TO_RAD
+
+    # Rate of change of quaternion from gyroscope
+    q_dot1 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+    q_dot2 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+    q_dot3 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+    q_dot4 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+    # Corrective step, skipped where the accelerometer reads all 0 (NaN in
+    # normalisation).
+    norm = ax * ax + ay * ay + az * az
+    valid = norm != 0
+    recip_norm = inv_sqrt(norm)
+    ax *= recip_norm
+    ay *= recip_norm
+    az *= recip_norm
+    _2q0 = 2.0 * q0
+    _2q1 = 2.0 * q1
+    _2q2 = 2.0 * q2
+    _2q3 = 2.0 * q3
+    _4q0 = 4.0 * q0
+    _4q1 = 4.0 * q1
+    _4q2 = 4.0 * q2
+    _8q1 = 8.0 * q1
+    _8q2 = 8.0 * q2
+    q0q0 = q0 * q0
+    q1q1 = q1 * q1
+    q2q2 = q2 * q2
+    q3q3 = q3 * q3
+    # Gradient decent algorithm corrective step
+    s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+    s1 = (_4q1 * q3q3 - _2q3 * ax + 4.0 * q0q0 * q1 - _2q0 * ay - _4q1 +
+          _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az)
+    s2 = (4.0 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 +
+          _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az)
+    s3 = 4.0 * q1q1 * q3 - _2q1 * ax + 4.0 * q2q2 * q3 - _2q2 * ay
+    recip_norm = inv_sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3) * beta * valid
+    q_dot1 -= s0 * recip_norm
+    q_dot2 -= s1 * recip_norm
+    q_dot3 -= s2 * recip_norm
+    q_dot4 -= s3 * recip_norm
+
+    # Integrate rate of change of quaternion to yield quaternion
+    q0 += q_dot1 * inv_sample_freq
+    q1 += q_dot2 * inv_sample_freq
+    q2 += q_dot3 * inv_sample_freq
+    q3 += q_dot4 * inv_sample_freq
+    recip_norm = inv_sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 * recip_norm, q1 * recip_norm, q2 * recip_norm, q3 * recip_norm
+
+
+class Madgwick:
+    """A filter on floats, for streaming samples one by one."""
+
+    def __init__(self, beta=DEFAULT_BETA, sample_freq=DEFAULT_SAMPLE_FREQ):
+        self.beta = beta
+        self.q = (1.0, 0.0, 0.0, 0.0)
+        self.begin(sample_freq)
+
+    def begin(self, sample_freq):
+        self.inv_sample_freq = 1.0 / sample_freq
+
+    def update_imu(self, gx, gy, gz, ax, ay, az):
+        self.q = update_imu(self.q, gx, gy, gz, ax, ay, az, self.beta,
+                            self.inv_sample_freq, inv_sqrt)
+
+    def angles(self):
+        """Returns (yaw, pitch, roll) [rad]."""
+        q0, q1, q2, q3 = self.q
+        roll = math.atan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2)
+        # Clipped, as rounding errors may exceed the domain of asin().
+        pitch = math.asin(max(-1.0, min(1.0, -2.0 * (q1 * q3 - q0 * q2))))
+        yaw = math.atan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3)
+        return yaw, pitch, roll
+
+
+class MadgwickBatch:
+    """N filters in float32 arrays, updated with the same or their own
+    samples.
+
+    beta and sample_freq may be arrays of N values; n defaults to their size.
+    """
+
+    def __init__(self, beta=DEFAULT_BETA, sample_freq=DEFAULT_SAMPLE_FREQ,
+                 n=None):
+        if n is None:
+            n = np.broadcast(np.asarray(beta), np.asarray(sample_freq)).size
+        self.beta = np.broadcast_to(np.float32(beta), (n,))
+        self.inv_sample_freq = np.broadcast_to(
+            (1.0 / np.asarray(sample_freq, dtype=np.float32)).astype(
+                np.float32), (n,))
+        self.q = (np.ones(n, np.float32), np.zeros(n, np.float32),
+                  np.zeros(n, np.float32), np.zeros(n, np.float32))
+
+    def update_imu(self, gx, gy, gz, ax, ay, az):
+        f = np.float32
+        self.q = update_imu(self.q, f(gx), f(gy), f(gz), f(ax), f(ay), f(az),
+                            self.beta, self.inv_sample_freq, inv_sqrt_array)
+
+    def angles(self):
+        """Returns (yaw, pitch, roll) [rad], each an array of N filters."""
+        q0, q1, q2, q3 = self.q
+        roll = np.arctan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2)
+        pitch = np.arcsin(np.clip(-2.0 * (q1 * q3 - q0 * q2), -1.0, 1.0))
+        yaw = np.arctan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3)
+        return yaw, pitch, roll
+
+
+class GyroCalibration:
+    """Gyro origin averaged over the first CALIBRATION_SAMPLES samples after
+    start(), as AddCalibPoint() and Calibrate().
+
+    The origin is 0 until the first calibration finishes.
+    """
+
+    def __init__(self, samples=CALIBRATION_SAMPLES):
+        self.samples = samples
+        self.origin = (0.0, 0.0, 0.0)
+        self.start()
+
+    def start(self):
+        self._points = []
+        self.ready = False
+
+    def add_point(self, x, y, z):
+        if self.ready:
+            return
+        self._points.append((x, y, z))
+        if len(self._points) >= self.samples:
+            self.origin = tuple(np.mean(self._points, axis=0).tolist())
+            self._points = []
+            self.ready = True
+
+    def apply(self, gyro):
+        """Calibrates a (T, 3) array of gyro samples from start(), at once.
+
+        Returns the samples with the origin subtracted.
+        """
+        gyro = np.asarray(gyro, dtype=float)
+        out = gyro - self.origin
+        if not self.ready and len(gyro) >= self.samples - len(self._points):
+            n = self.samples - len(self._points)
+            points = np.concatenate([np.reshape(self._points, (-1, 3)),
+                                     gyro[:n]])
+            self.origin = tuple(points.mean(axis=0).tolist())
+            self._points = []
+            self.ready = True
+            # The sample completing the calibration is already calibrated.
+            out[n - 1:] = gyro[n - 1:] - self.origin
+        elif not self.ready:
+            self._points += [tuple(g) for g in gyro.tolist()]
+        return out
+
+
+def from_record(a):
+    """Returns (gyro [deg/s], accel [g]) (T, 3) arrays of a flight record
+    (recorder.load()).
+    """
+    r = a['regs']
+    gyro = r[:, regs.ROTATION_X:regs.ROTATION_Z + 1] / 100.0
+    accel = r[:, regs.ACCEL_X:regs.ACCEL_Z + 1] / 1000.0
+    return gyro, accel
+
+
+def record_sample_freq(a):
+    """Returns the sample rate [Hz] of a flight record (recorder.load()).
+
+    Taken from the median step of the device time, robust to lost frames, or
+    of the host time if the device time does not advance.
+    """
+    if len(a) < 2:
+        return DEFAULT_SAMPLE_FREQ
+    # elapsed [ms] is unsigned 32-bit and may wrap around.
+    step = np.median(np.diff(a['elapsed'].astype(np.int64)) % (1 << 32)) * 1e-3
+    if step <= 0:
+        step = np.median(np.diff(a['host_time']))
+    return 1.0 / step if step > 0 else DEFAULT_SAMPLE_FREQ
+
+
+def estimate(gyro, accel, beta=DEFAULT_BETA, sample_freq=DEFAULT_SAMPLE_FREQ):
+    """Runs filters over (T, 3) arrays of gyro [deg/s] and accel samples.
+
+    With scalar beta and sample_freq, returns a (T, 3) array of (yaw, pitch,
+    roll) [rad] after each sample. With arrays of N values, runs N filters at
+    once and returns a (T, N, 3) array.
+    """
+    if np.ndim(beta) == 0 and np.ndim(sample_freq) == 0:
+        f = Madgwick(beta, sample_freq)
+        out = np.empty((len(gyro), 3))
+        for t, (g, a) in enumerate(
+                zip(np.asarray(gyro).tolist(), np.asarray(accel).tolist())):
+            f.update_imu(*g, *a)
+            out[t] = f.angles()
+        return out
+    beta, sample_freq = np.broadcast_arrays(beta, sample_freq)
+    if beta.size < BATCH_MIN_FILTERS:
+        return np.stack([
+            estimate(gyro, accel, b, s)
+            for b, s in zip(beta.tolist(), sample_freq.tolist())
+        ], axis=1)
+    f = MadgwickBatch(beta, sample_freq)
+    gyro = np.asarray(gyro, dtype=np.float32)
+    accel = np.asarray(accel, dtype=np.float32)
+    out = np.empty((len(gyro), beta.size, 3), dtype=np.float32)
+    for t in range(len(gyro)):
+        f.update_imu(*gyro[t], *accel[t])
+        out[t] = np.stack(f.angles(), axis=-1)
+    return out
+
+
+def main(argv):
+    args = argv[1:]
+    betas = [DEFAULT_BETA]
+    # Taken from the record unless given.
+    sample_freq = None
+    calibrate = False
+    while args and args[0].startswith('--'):
+        if args[0] == '--beta' and len(args) > 1:
+            betas = [float(b) for b in args[1].split(',')]
+            args = args[2:]
+        elif args[0] == '--rate' and len(args) > 1:
+            sample_freq = float(args[1])
+            args = args[2:]
+        elif args[0] == '--calibrate':
+            calibrate = True
+            args = args[1:]
+        else:
+            args = []
+    if not args:
+        print('usage: %s [--beta <beta>[,<beta>...]] [--rate <Hz>] '
+              '[--calibrate] <record file>' % argv[0])
+        return
+    a = recorder.load(args[0])
+    gyro, accel = from_record(a)
+    if sample_freq is None:
+        sample_freq = record_sample_freq(a)
+    if calibrate:
+        # Re-estimate the residual bias, as after a calibration request.
+        gyro = GyroCalibration().apply(gyro)
+    est = estimate(gyro, accel, np.array(betas), sample_freq)
+    recorded = np.radians(
+        a['regs'][:, [regs.YAW_ANGLE, regs.PITCH_ANGLE, regs.ROLL_ANGLE]] /
+        10.0)
+    print('%d samples at %.1f Hz' % (len(a), sample_freq))
+    print('%-8s %12s %12s %12s' % ('beta', 'yaw [deg]', 'pitch [deg]',
+                                   'roll [deg]'))
+    for i, beta in enumerate(betas):
+        # Wrapped difference from the angles estimated by the device.
+        diff = np.angle(np.exp(1j * (est[:, i, :] - recorded)))
+        rms = np.degrees(np.sqrt(np.mean(diff**2, axis=0)))
+        print('%-8g %12.3f %12.3f %12.3f  (RMS difference)' %
+              (beta, *rms))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,12 +1,34 @@
+import functools
+
 import pygame
 from pygame.locals import *
 
+BACKGROUND = (0, 0, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size):
+    """Returns the default font of the size. Fonts are created only once."""
+    return pygame.font.Font(None, size)
+
+
+@functools.lru_cache(maxsize=1024)
+def render_text(text, size, color):
+    """Renders a text. A text rendered recently is not rendered again."""
+    return get_font(size).render(text, True, color)
+
 
 class Panel:
+    """A node of the view tree.
+
+    Panels are kept across frames, and draw() only draws those which have
+    changed (dirty) since the last call.
+    """
 
     def __init__(self, left, top, width, height):
         self.rect = pygame.Rect(left, top, width, height)
         self.children = []
+        self.dirty = True
 
     def getRect(self):
         return self.rect
@@ -14,12 +36,24 @@ class Panel:
     def addChild(self, child):
         self.children.append(child)
 
+    def invalidate(self):
+        """Makes the panel and its children drawn by the next draw()."""
+        self.dirty = True
+        for n in self.children:
+            n.invalidate()
+
     def draw(self, screen, rect):
-        r = self.getRect()
-        r.left += rect.left
-        r.top += rect.top
+        """Draws dirty panels. Returns the list of updated screen areas."""
+        r = self.getRect().move(rect.left, rect.top)
+        updated = []
         for n in self.children:
-            n.draw(screen, r)
+            # Redraw a child overlapped by its former siblings just drawn.
+            if (not n.dirty and updated and
+                    n.getRect().move(r.left, r.top).collidelist(updated) >= 0):
+                n.invalidate()
+            updated += n.draw(screen, r)
+        self.dirty = False
+        return updated
 
 
 class Label(Panel):
@@ -31,36 +65,53 @@ class Label(Panel):
         self.str = str
         self.color = color
         self.size = size
+        # Screen area of the text drawn last time.
+        self._drawn = None
 
     def addChild(self, child):
         assert (False)
 
+    def setText(self, str):
+        if str != self.str:
+            self.str = str
+            self.dirty = True
+
     def draw(self, screen, rect):
+        if not self.dirty:
+            return []
         r = self.getRect()
-        r.left += rect.left
-        r.top += rect.top
-        font = pygame.font.Font(None, self.size)
-        origin_x = r.left
-        origin_y = r.top
-        screen.blit(font.render(self.str, True, self.color),
-                    (origin_x, origin_y))
+        origin_x = r.left + rect.left
+        origin_y = r.top + rect.top
+        updated = []
+        if self._drawn is not None:
+            screen.fill(BACKGROUND, self._drawn)
+            updated.append(self._drawn)
+        self._drawn = screen.blit(render_text(self.str, self.size, self.color),
+                                  (origin_x, origin_y))
+        updated.append(self._drawn)
+        self.dirty = False
+        return updated
 
 
 def main():
     pygame.init()
     screen = pygame.display.set_mode((512, 512))
 
+    p1 = Panel(100, 50, 100, 10)
+    l1 = Label(10, 10, 24, 'Hello')
+    l2 = Label(10, 40, 24, 'World')
+    l3 = Label(40, 54, 48, '')
+    p1.addChild(l1)
+    p1.addChild(l2)
+    p1.addChild(l3)
+    screen.fill(BACKGROUND)
+    pygame.display.update()
+
     active = True
     i = 0
     while active:
         i += 1
-        p1 = Panel(100, 50, 100, 10)
-        l1 = Label(10, 10, 24, 'Hello')
-        l2 = Label(10, 40, 24, 'World')
-        l3 = Label(40, 54, 48, '%d' % i)
-        p1.addChild(l1)
-        p1.addChild(l2)
-        p1.addChild(l3)
+        l3.setText('%d' % i)
         for e in pygame.event.get():
             if e.type == pygame.locals.QUIT:
                 active = False
@@ -68,9 +119,7 @@ def main():
                 c = e.key
                 if c == ord('\x1b'):
                     active = False
-        screen.fill((0, 0, 0))
-        p1.draw(screen, pygame.Rect(0, 0, 512, 512))
-        pygame.display.update()
+        pygame.display.update(p1.draw(screen, pygame.Rect(0, 0, 512, 512)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+# Flight recorder writing register snapshots into a memory-mapped binary file.
+#
+# File layout (little endian):
+#   header:  magic 'GHRC', version (u16), number of registers (u16),
+#            number of records (u32), reserved (4 bytes)
+#   records: host time [s] (f8), device time ELAPSED_L/H [ms] (u4),
+#            registers (i2 x number of registers)
+#
+# The file is preallocated and grown by doubling, and truncated to the
+# recorded size on stop(). load() returns the records as a NumPy structured
+# array backed by the file, without copying.
+
+import datetime
+import mmap
+import struct
+import sys
+import time
+
+import registers as regs
+
+MAGIC = b'GHRC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI4x')
+_COUNT = struct.Struct('<I')
+_COUNT_OFFSET = 8
+RECORD = struct.Struct('<dI%dh' % regs.N_REGISTERS)
+INITIAL_CAPACITY = 4096
+
+
+def record_dtype(n_registers=regs.N_REGISTERS):
+    import numpy as np
+    return np.dtype([
+        ('host_time', '<f8'),
+        ('elapsed', '<u4'),
+        ('regs', '<i2', (n_registers,)),
+    ])
+
+
+def load(path):
+    """Returns the records of a file as a read-only NumPy structured array.
+
+    Use e.g. a['regs'][:, regs.ROLL_ANGLE] to get a time series.
+    """
+    import numpy as np
+    with open(path, 'rb') as f:
+        magic, version, n_registers, count = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a flight record' % path)
+    if count == 0:
+        return np.empty(0, dtype=record_dtype(n_registers))
+    return np.memmap(path,
+                     dtype=record_dtype(n_registers),
+                     mode='r',
+                     offset=HEADER.size,
+                     shape=(count,))
+
+
+class Recorder:
+
+    def __init__(self, initial_capacity=INITIAL_CAPACITY):
+        self.active = False
+        self.count = 0
+        self._initial_capacity = initial_capacity
+
+    def start(self, path=None):
+        if path is None:
+            current = datetime.datetime.now()
+            path = '%s.bin' % current.isoformat(timespec='seconds')
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.count = 0
+        self._capacity = self._initial_capacity
+        self._map()
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, regs.N_REGISTERS, 0)
+        self.active = True
+
+    def _map(self):
+        self.file.truncate(HEADER.size + self._capacity * RECORD.size)
+        self._mm = mmap.mmap(self.file.fileno(), 0)
+
+    def _grow(self):
+        self._mm.close()
+        self._capacity *= 2
+        self._map()
+
+    def write(self, elapsed, d, host_time=None):
+        """Appends a snapshot of registers d (truncated to integers; None, or
+        missing at the end, is stored as 0)."""
+        assert (self.active)
+        if self.count >= self._capacity:
+            self._grow()
+        if host_time is None:
+            host_time = time.time()
+        RECORD.pack_into(self._mm, HEADER.size + self.count * RECORD.size,
+                         host_time, elapsed & 0xffffffff,
+                         *[0 if v is None else int(v) for v in d],
+                         *[0] * (regs.N_REGISTERS - len(d)))
+        self.count += 1
+        _COUNT.pack_into(self._mm, _COUNT_OFFSET, self.count)
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        self._mm.flush()
+        self._mm.close()
+        self.file.truncate(HEADER.size + self.count * RECORD.size)
+        self.file.close()
+
+
+def main(argv):
+    if len(argv) < 2:
+        print('usage: %s <record file>' % argv[0])
+        return
+    a = load(argv[1])
+    print('%d records' % len(a))
+    if len(a):
+        print('host time  %f - %f' % (a['host_time'][0], a['host_time'][-1]))
+        print('elapsed    %d - %d [ms]' % (a['elapsed'][0], a['elapsed'][-1]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,54 +1,596 @@
-JS_THROTTLE = 0
-JS_YAW = 1
-JS_PITCH = 2
-JS_ROLL = 3
-JS_BUTTONS = 4
-TRIM_THROTTLE = 5
-TRIM_YAW = 6
-TRIM_PITCH = 7
-TRIM_ROLL = 8
-GAIN_YAW_P = 9
-GAIN_YAW_D = 10
-GAIN_PITCH_P = 11
-GAIN_PITCH_D = 12
-GAIN_ROLL_P = 13
-GAIN_ROLL_D = 14
-GAIN_ALT_P = 15
-GAIN_ALT_D = 16
-LIMITTER = 17
-TRIP_ANGLE_PR = 18
-TRIP_ANGLE_YAW = 19
-ENABLE = 20
-TEST_MODE = 21
-HOVERING_VOLTAGE = 22
-DESCEND_TIME = 23
-LOW_BATTERY_THRESHOLD = 24
-CALIBRATE = 25
-ELAPSED_L = 26
-ELAPSED_H = 27
-CTRL_INTERVAL = 28
-BATT_AD = 29
-BATT_VOLTAGE = 30
-BATT_VOLTAGE_FILTERED = 31
-BATT_STATUS = 32
-TARGET_YAW = 33
-TARGET_PITCH = 34
-TARGET_ROLL = 35
-YAW_ANGLE = 36
-PITCH_ANGLE = 37
-ROLL_ANGLE = 38
-ROTATION_X = 39
-ROTATION_Y = 40
-ROTATION_Z = 41
-ACCEL_X = 42
-ACCEL_Y = 43
-ACCEL_Z = 44
-OUT_PITCH = 45
-OUT_ROLL = 46
-OUT_YAW = 47
-OUT_THROTTLE = 48
-OUT_M0 = 49
-OUT_M1 = 50
-OUT_M2 = 51
-OUT_M3 = 52
-N_REGISTERS = 53
+# Generated from firmware/common/registers.csv by generate_registers.py.
+# Do not edit.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+JS_THROTTLE = 0             # Throttle stick
+JS_YAW = 1                  # Yaw stick (unused)
+JS_PITCH = 2                # Pitch stick [rad * 1800/pi]
+JS_ROLL = 3                 # Roll stick [rad * 1800/pi]
+JS_BUTTONS = 4              # Button bits
+TRIM_THROTTLE = 5           # Throttle trim (unused)
+TRIM_YAW = 6                # Yaw trim (unused) [rad * 1800/pi]
+TRIM_PITCH = 7              # Pitch trim [rad * 1800/pi]
+TRIM_ROLL = 8               # Roll trim [rad * 1800/pi]
+GAIN_YAW_P = 9              # Yaw P gain
+GAIN_YAW_D = 10             # Yaw D gain
+GAIN_PITCH_P = 11           # Pitch P gain
+GAIN_PITCH_D = 12           # Pitch D gain
+GAIN_ROLL_P = 13            # Roll P gain
+GAIN_ROLL_D = 14            # Roll D gain
+GAIN_ALT_P = 15             # Altitude P gain (unused)
+GAIN_ALT_D = 16             # Altitude D gain (unused)
+LIMITTER = 17               # Maximum motor duty [duty * 1000]
+TRIP_ANGLE_PR = 18          # Pitch/roll trip angle (unused) [rad * 1800/pi]
+TRIP_ANGLE_YAW = 19         # Yaw trip angle (unused) [rad * 1800/pi]
+ENABLE = 20                 # Motors are enabled if 1
+TEST_MODE = 21              # 0xa5: OUT_Mx are output directly
+HOVERING_VOLTAGE = 22       # Throttle while landing on low battery
+DESCEND_TIME = 23           # Duration of landing on low battery [s * 1000]
+LOW_BATTERY_THRESHOLD = 24  # Battery voltage to start landing [V * 1000]
+CALIBRATE = 25              # 1: start calibration. 2: calibrating. 0: done
+ELAPSED_L = 26              # Lower 16 bits of the time since boot [s * 1000]
+ELAPSED_H = 27              # Upper 16 bits of the time since boot [s * 1000/65536]
+CTRL_INTERVAL = 28          # Duration of the last control cycle [s * 1000000]
+BATT_AD = 29                # Battery ADC value
+BATT_VOLTAGE = 30           # Battery voltage [V * 1000]
+BATT_VOLTAGE_FILTERED = 31  # Moving average of battery voltage [V * 1000]
+BATT_STATUS = 32            # 1: low. 2: normal
+TARGET_YAW = 33             # Target yaw angle [rad * 1800/pi]
+TARGET_PITCH = 34           # Target pitch angle [rad * 1800/pi]
+TARGET_ROLL = 35            # Target roll angle [rad * 1800/pi]
+YAW_ANGLE = 36              # Yaw angle [rad * 1800/pi]
+PITCH_ANGLE = 37            # Pitch angle [rad * 1800/pi]
+ROLL_ANGLE = 38             # Roll angle [rad * 1800/pi]
+ROTATION_X = 39             # Angular velocity around X [deg/s * 100]
+ROTATION_Y = 40             # Angular velocity around Y [deg/s * 100]
+ROTATION_Z = 41             # Angular velocity around Z [deg/s * 100]
+ACCEL_X = 42                # Acceleration along X [g * 1000]
+ACCEL_Y = 43                # Acceleration along Y [g * 1000]
+ACCEL_Z = 44                # Acceleration along Z [g * 1000]
+OUT_PITCH = 45              # Pitch output of the controller
+OUT_ROLL = 46               # Roll output of the controller
+OUT_YAW = 47                # Yaw output of the controller
+OUT_THROTTLE = 48           # Throttle output of the controller
+OUT_M0 = 49                 # Motor 0 duty [duty * 1000]
+OUT_M1 = 50                 # Motor 1 duty [duty * 1000]
+OUT_M2 = 51                 # Motor 2 duty [duty * 1000]
+OUT_M3 = 52                 # Motor 3 duty [duty * 1000]
+TIMING_RESET = 53           # 1: reset the timing statistics
+LOOP_COUNT = 54             # Control loops since the reset (saturates)
+LOOP_OVERRUNS = 55          # Loops which missed the deadline
+LOOP_TIME_MIN = 56          # Minimum execution time of a loop [s * 1000000]
+LOOP_TIME_MAX = 57          # Maximum execution time of a loop [s * 1000000]
+LOOP_TIME_MEAN = 58         # Mean execution time of a loop [s * 1000000]
+LOOP_PERIOD_MIN = 59        # Minimum interval between loops [s * 1000000]
+LOOP_PERIOD_MAX = 60        # Maximum interval between loops [s * 1000000]
+IMU_HIST_0 = 61             # Loops with ImuTask() time < 64 us
+IMU_HIST_1 = 62             # Loops with ImuTask() time 64-128 us
+IMU_HIST_2 = 63             # Loops with ImuTask() time 128-256 us
+IMU_HIST_3 = 64             # Loops with ImuTask() time 256-512 us
+IMU_HIST_4 = 65             # Loops with ImuTask() time 512-1024 us
+IMU_HIST_5 = 66             # Loops with ImuTask() time 1024-2048 us
+IMU_HIST_6 = 67             # Loops with ImuTask() time 2048-4096 us
+IMU_HIST_7 = 68             # Loops with ImuTask() time >= 4096 us
+COMM_HIST_0 = 69            # Loops with communication time < 64 us
+COMM_HIST_1 = 70            # Loops with communication time 64-128 us
+COMM_HIST_2 = 71            # Loops with communication time 128-256 us
+COMM_HIST_3 = 72            # Loops with communication time 256-512 us
+COMM_HIST_4 = 73            # Loops with communication time 512-1024 us
+COMM_HIST_5 = 74            # Loops with communication time 1024-2048 us
+COMM_HIST_6 = 75            # Loops with communication time 2048-4096 us
+COMM_HIST_7 = 76            # Loops with communication time >= 4096 us
+MOTOR_HIST_0 = 77           # Loops with motor output time < 64 us
+MOTOR_HIST_1 = 78           # Loops with motor output time 64-128 us
+MOTOR_HIST_2 = 79           # Loops with motor output time 128-256 us
+MOTOR_HIST_3 = 80           # Loops with motor output time 256-512 us
+MOTOR_HIST_4 = 81           # Loops with motor output time 512-1024 us
+MOTOR_HIST_5 = 82           # Loops with motor output time 1024-2048 us
+MOTOR_HIST_6 = 83           # Loops with motor output time 2048-4096 us
+MOTOR_HIST_7 = 84           # Loops with motor output time >= 4096 us
+N_REGISTERS = 85
+
+# Blocks of registers.
+FIRST_COMMAND_REG = JS_THROTTLE
+N_COMMAND_REGS = 5
+FIRST_CONFIG_REG = TRIM_THROTTLE
+N_CONFIG_REGS = 20
+FIRST_STATUS_REG = CALIBRATE
+N_STATUS_REGS = 28
+FIRST_TIMING_REG = TIMING_RESET
+N_TIMING_REGS = 32
+
+# Attributes of each register by address. A register holds a value in UNITS
+# multiplied by SCALES.
+NAMES = (
+    'JS_THROTTLE',
+    'JS_YAW',
+    'JS_PITCH',
+    'JS_ROLL',
+    'JS_BUTTONS',
+    'TRIM_THROTTLE',
+    'TRIM_YAW',
+    'TRIM_PITCH',
+    'TRIM_ROLL',
+    'GAIN_YAW_P',
+    'GAIN_YAW_D',
+    'GAIN_PITCH_P',
+    'GAIN_PITCH_D',
+    'GAIN_ROLL_P',
+    'GAIN_ROLL_D',
+    'GAIN_ALT_P',
+    'GAIN_ALT_D',
+    'LIMITTER',
+    'TRIP_ANGLE_PR',
+    'TRIP_ANGLE_YAW',
+    'ENABLE',
+    'TEST_MODE',
+    'HOVERING_VOLTAGE',
+    'DESCEND_TIME',
+    'LOW_BATTERY_THRESHOLD',
+    'CALIBRATE',
+    'ELAPSED_L',
+    'ELAPSED_H',
+    'CTRL_INTERVAL',
+    'BATT_AD',
+    'BATT_VOLTAGE',
+    'BATT_VOLTAGE_FILTERED',
+    'BATT_STATUS',
+    'TARGET_YAW',
+    'TARGET_PITCH',
+    'TARGET_ROLL',
+    'YAW_ANGLE',
+    'PITCH_ANGLE',
+    'ROLL_ANGLE',
+    'ROTATION_X',
+    'ROTATION_Y',
+    'ROTATION_Z',
+    'ACCEL_X',
+    'ACCEL_Y',
+    'ACCEL_Z',
+    'OUT_PITCH',
+    'OUT_ROLL',
+    'OUT_YAW',
+    'OUT_THROTTLE',
+    'OUT_M0',
+    'OUT_M1',
+    'OUT_M2',
+    'OUT_M3',
+    'TIMING_RESET',
+    'LOOP_COUNT',
+    'LOOP_OVERRUNS',
+    'LOOP_TIME_MIN',
+    'LOOP_TIME_MAX',
+    'LOOP_TIME_MEAN',
+    'LOOP_PERIOD_MIN',
+    'LOOP_PERIOD_MAX',
+    'IMU_HIST_0',
+    'IMU_HIST_1',
+    'IMU_HIST_2',
+    'IMU_HIST_3',
+    'IMU_HIST_4',
+    'IMU_HIST_5',
+    'IMU_HIST_6',
+    'IMU_HIST_7',
+    'COMM_HIST_0',
+    'COMM_HIST_1',
+    'COMM_HIST_2',
+    'COMM_HIST_3',
+    'COMM_HIST_4',
+    'COMM_HIST_5',
+    'COMM_HIST_6',
+    'COMM_HIST_7',
+    'MOTOR_HIST_0',
+    'MOTOR_HIST_1',
+    'MOTOR_HIST_2',
+    'MOTOR_HIST_3',
+    'MOTOR_HIST_4',
+    'MOTOR_HIST_5',
+    'MOTOR_HIST_6',
+    'MOTOR_HIST_7',
+)
+BLOCKS = (
+    'command',
+    'command',
+    'command',
+    'command',
+    'command',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'config',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'status',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+    'timing',
+)
+TYPES = (
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'uint16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'uint16',
+    'uint16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'int16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+    'uint16',
+)
+UNITS = (
+    '',
+    '',
+    'rad',
+    'rad',
+    '',
+    '',
+    'rad',
+    'rad',
+    'rad',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    'duty',
+    'rad',
+    'rad',
+    '',
+    '',
+    '',
+    's',
+    'V',
+    '',
+    's',
+    's',
+    's',
+    '',
+    'V',
+    'V',
+    '',
+    'rad',
+    'rad',
+    'rad',
+    'rad',
+    'rad',
+    'rad',
+    'deg/s',
+    'deg/s',
+    'deg/s',
+    'g',
+    'g',
+    'g',
+    '',
+    '',
+    '',
+    '',
+    'duty',
+    'duty',
+    'duty',
+    'duty',
+    '',
+    '',
+    '',
+    's',
+    's',
+    's',
+    's',
+    's',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+    '',
+)
+SCALES = (
+    1.0,
+    1.0,
+    572.9577951308232,
+    572.9577951308232,
+    1.0,
+    1.0,
+    572.9577951308232,
+    572.9577951308232,
+    572.9577951308232,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1000.0,
+    572.9577951308232,
+    572.9577951308232,
+    1.0,
+    1.0,
+    1.0,
+    1000.0,
+    1000.0,
+    1.0,
+    1000.0,
+    0.0152587890625,
+    1000000.0,
+    1.0,
+    1000.0,
+    1000.0,
+    1.0,
+    572.9577951308232,
+    572.9577951308232,
+    572.9577951308232,
+    572.9577951308232,
+    572.9577951308232,
+    572.9577951308232,
+    100.0,
+    100.0,
+    100.0,
+    1000.0,
+    1000.0,
+    1000.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1000.0,
+    1000.0,
+    1000.0,
+    1000.0,
+    1.0,
+    1.0,
+    1.0,
+    1000000.0,
+    1000000.0,
+    1000000.0,
+    1000000.0,
+    1000000.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+    1.0,
+)
+
+
+def to_unit(addr, value):
+    """Converts a register value into UNITS[addr]."""
+    return value / SCALES[addr]
+
+
+def from_unit(addr, x):
+    """Converts x in UNITS[addr] into a register value."""
+    return int(round(x * SCALES[addr]))
+
+
+# Layout of the status block in frames, for np.frombuffer(). Fields are the
+# lowercase register names.
+_STATUS_FIELDS = (
+    ('calibrate', '<i2', 0),
+    ('elapsed_l', '<u2', 2),
+    ('elapsed_h', '<u2', 4),
+    ('ctrl_interval', '<i2', 6),
+    ('batt_ad', '<i2', 8),
+    ('batt_voltage', '<i2', 10),
+    ('batt_voltage_filtered', '<i2', 12),
+    ('batt_status', '<i2', 14),
+    ('target_yaw', '<i2', 16),
+    ('target_pitch', '<i2', 18),
+    ('target_roll', '<i2', 20),
+    ('yaw_angle', '<i2', 22),
+    ('pitch_angle', '<i2', 24),
+    ('roll_angle', '<i2', 26),
+    ('rotation_x', '<i2', 28),
+    ('rotation_y', '<i2', 30),
+    ('rotation_z', '<i2', 32),
+    ('accel_x', '<i2', 34),
+    ('accel_y', '<i2', 36),
+    ('accel_z', '<i2', 38),
+    ('out_pitch', '<i2', 40),
+    ('out_roll', '<i2', 42),
+    ('out_yaw', '<i2', 44),
+    ('out_throttle', '<i2', 46),
+    ('out_m0', '<i2', 48),
+    ('out_m1', '<i2', 50),
+    ('out_m2', '<i2', 52),
+    ('out_m3', '<i2', 54),
+    ('elapsed', '<u4', 2),
+)
+if np is not None:
+    STATUS_DTYPE = np.dtype({
+        'names': [x[0] for x in _STATUS_FIELDS],
+        'formats': [x[1] for x in _STATUS_FIELDS],
+        'offsets': [x[2] for x in _STATUS_FIELDS],
+        'itemsize': N_STATUS_REGS * 2,
+    })
+else:
+    STATUS_DTYPE = None
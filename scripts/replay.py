@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+# Replays a flight record (see recorder.py) on the console display.
+#
+# Keys: [space] pause/resume, [right]/[left] step one frame forward/backward,
+# [+]/[-] double/halve the speed, [ESC] exit.
+#
+# With --render, frames are drawn off-screen and saved as image files as fast
+# as possible, instead of waiting for the recorded duration.
+
+import argparse
+import os
+import sys
+import time
+
+import pygame
+
+import console
+import flight
+import recorder
+import registers as regs
+
+WINDOW_SIZE = (512, 512)
+
+
+class Replay:
+    """Feeds recorded snapshots to a Console one by one."""
+
+    def __init__(self, records, con):
+        self.records = records
+        self.con = con
+        # Index of the next record to feed.
+        self.index = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def done(self):
+        return self.index >= len(self.records)
+
+    def elapsed(self, i):
+        return int(self.records['elapsed'][i])
+
+    def step(self):
+        r = self.records['regs'][self.index].tolist()
+        ctrl = flight.Control()
+        # joystick.py records the sent throttle in JS_THROTTLE.
+        ctrl.throttle = r[regs.JS_THROTTLE]
+        self.con.update(self.elapsed(self.index), ctrl, r, None)
+        self.index += 1
+
+    def seek(self, i):
+        """Shows record i, rebuilding the graphs from the preceding ones."""
+        i = max(0, min(len(self.records) - 1, i))
+        begin = i
+        while (begin > 0 and
+               self.elapsed(begin - 1) >= self.elapsed(i) - self.con.DURATION):
+            begin -= 1
+        self.con.reset()
+        self.index = begin
+        while self.index <= i:
+            self.step()
+
+
+def render(replay, out_dir, every):
+    os.makedirs(out_dir, exist_ok=True)
+    while not replay.done():
+        i = replay.index
+        replay.step()
+        if i % every == 0:
+            pygame.image.save(replay.con.screen,
+                              os.path.join(out_dir, 'frame_%06d.png' % i))
+
+
+def play(replay, speed, paused):
+    # Device time [ms] of the playback position.
+    play_t = replay.elapsed(0)
+    last_wall = time.monotonic()
+    active = True
+    while active:
+        for e in pygame.event.get():
+            if e.type == pygame.locals.QUIT:
+                active = False
+            elif e.type == pygame.locals.KEYDOWN:
+                c = e.key
+                if c == pygame.locals.K_ESCAPE:
+                    active = False
+                elif c == pygame.locals.K_SPACE:
+                    paused = not paused
+                elif c == pygame.locals.K_RIGHT:
+                    paused = True
+                    if not replay.done():
+                        replay.step()
+                elif c == pygame.locals.K_LEFT:
+                    paused = True
+                    replay.seek(replay.index - 2)
+                elif c in (pygame.locals.K_PLUS, pygame.locals.K_EQUALS):
+                    speed *= 2
+                elif c == pygame.locals.K_MINUS:
+                    speed /= 2
+                if replay.index > 0:
+                    play_t = replay.elapsed(replay.index - 1)
+        now = time.monotonic()
+        if not paused:
+            play_t += (now - last_wall) * 1000 * speed
+        last_wall = now
+        fed = False
+        while (not paused and not replay.done() and
+               replay.elapsed(replay.index) <= play_t):
+            replay.step()
+            fed = True
+        if not fed:
+            time.sleep(0.001)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Replays a flight record.')
+    parser.add_argument('record', help='file written by recorder.Recorder')
+    parser.add_argument('--speed',
+                        type=float,
+                        default=1.0,
+                        help='playback speed relative to real time')
+    parser.add_argument('--step',
+                        action='store_true',
+                        help='start paused, for frame stepping')
+    parser.add_argument('--render',
+                        metavar='DIR',
+                        help='save frames to DIR without showing a window')
+    parser.add_argument('--every',
+                        type=int,
+                        default=1,
+                        help='save every N-th frame with --render')
+    args = parser.parse_args(argv[1:])
+
+    records = recorder.load(args.record)
+    if len(records) == 0:
+        print('no records in %s' % args.record)
+        return
+    if args.render:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.init()
+    if args.render:
+        con = console.Console(pygame.Surface(WINDOW_SIZE))
+        render(Replay(records, con), args.render, args.every)
+    else:
+        con = console.Console()
+        play(Replay(records, con), args.speed, args.step)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
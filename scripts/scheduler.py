@@ -0,0 +1,115 @@
+# Fixed-rate scheduler of the ground station loops.
+#
+# Each task runs on deadlines of a monotonic clock, like ControlTask()
+# (firmware/common/control.cpp) on next_micros: the next deadline is one
+# period after the previous one, and a task which misses it counts an overrun
+# and starts its next period at once, instead of bursting to catch up.
+
+import time
+
+
+class Task:
+    """A function run every period [s] (0: on every Scheduler.run_due())."""
+
+    def __init__(self, name, period, func, now):
+        self.name = name
+        self.period = period
+        self.func = func
+        self.next_time = now
+        self.reset_stats(now)
+
+    def reset_stats(self, now=None):
+        self.since = time.monotonic() if now is None else now
+        self.runs = 0
+        # Runs which ended after the next deadline.
+        self.overruns = 0
+        # Maximum delay [s] of a start from its deadline.
+        self.max_lateness = 0.0
+
+    def rate(self, now=None):
+        """Runs per second since reset_stats()."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.since
+        return self.runs / elapsed if elapsed > 0 else 0.0
+
+
+class Scheduler:
+    """Runs tasks at their own rates on a thread.
+
+    Tasks due at the same time run in the order added. func(now) of a task
+    gets the time it is started.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tasks = []
+
+    def add(self, name, rate_hz, func, delay=0.0):
+        """Adds a task run rate_hz times per second, or as often as possible if
+        rate_hz is 0, first after delay seconds. Returns the Task, e.g. for its
+        statistics."""
+        period = 1.0 / rate_hz if rate_hz > 0 else 0.0
+        task = Task(name, period, func, self.clock())
+        task.next_time += delay
+        self.tasks.append(task)
+        return task
+
+    def remove(self, task):
+        self.tasks.remove(task)
+
+    def _run(self, task, now):
+        task.max_lateness = max(task.max_lateness, now - task.next_time)
+        task.func(now)
+        task.runs += 1
+        task.next_time += task.period
+        end = self.clock()
+        if end > task.next_time:
+            if task.period > 0:
+                task.overruns += 1
+            task.next_time = end
+
+    def run_due(self):
+        """Runs the tasks whose deadlines have come.
+
+        Returns the time [s] until the next deadline, or None without tasks.
+        """
+        for task in self.tasks:
+            now = self.clock()
+            if now >= task.next_time:
+                self._run(task, now)
+        if not self.tasks:
+            return None
+        return max(0.0, min(t.next_time for t in self.tasks) - self.clock())
+
+    def run(self, stop=None, duration=None):
+        """Runs the tasks until threading.Event stop is set, or for duration
+        seconds if given."""
+        end = None if duration is None else self.clock() + duration
+        while stop is None or not stop.is_set():
+            timeout = self.run_due()
+            if end is not None:
+                remaining = end - self.clock()
+                if remaining <= 0:
+                    break
+                timeout = remaining if timeout is None else min(
+                    timeout, remaining)
+            if timeout is None:
+                break
+            if stop is not None:
+                stop.wait(timeout)
+            elif timeout > 0:
+                time.sleep(timeout)
+
+    def format_stats(self, now=None, reset=True):
+        """Returns a line of the rate and overruns of each task."""
+        if now is None:
+            now = self.clock()
+        items = []
+        for task in self.tasks:
+            items.append('%s %.1f Hz overrun %d late %.1f ms' %
+                         (task.name, task.rate(now), task.overruns,
+                          task.max_lateness * 1e3))
+            if reset:
+                task.reset_stats(now)
+        return '  '.join(items)
@@ -1,33 +1,257 @@
 #!/usr/bin/env python
 
-import os
+import bisect
 import socket
-import struct
 import sys
+import threading
+import time
+
+import codec
 import registers as regs
 
-if sys.version_info.major == 3:
-    # Python 3
-    _pack_byte = lambda b: b.to_bytes(1, 'little')
-    _pack_short = lambda i: i.to_bytes(2, 'little')
-else:
-    # Python 2.7
-    _pack_byte = lambda b: struct.pack('<B', b)
-    _pack_short = lambda i: struct.pack('<H', i)
+# The drone ends a subscription when it receives nothing for 300 ms
+# (kTimeoutMillis of communication.cpp). telemetry() subscribes again every
+# this interval [s] to keep it.
+SUBSCRIPTION_KEEPALIVE = 0.2
+
+
+def contiguous_ranges(values):
+    """Groups {addr: value} into [(first addr, [values...]), ...] by runs of
+    consecutive addresses."""
+    ranges = []
+    for addr in sorted(values):
+        if ranges and ranges[-1][0] + len(ranges[-1][1]) == addr:
+            ranges[-1][1].append(values[addr])
+        else:
+            ranges.append((addr, [values[addr]]))
+    return ranges
+
+
+# Upper bounds [s] of the bins of the RTT histogram: 10 per decade from 10 us
+# to 1 s. The last bin counts anything slower.
+RTT_BINS = tuple(1e-5 * 10**(i / 10) for i in range(51))
+
+
+class LinkStats:
+    """Link quality counters and a streaming RTT histogram of a UDPCommand.
+
+    Counters are updated through the methods below, which hold `lock`, since
+    a UDPCommand may send and receive on different threads (joystick.py).
+    Hold it to read several counters consistently.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
+        self.since = time.monotonic()
+        # Frames sent, and those of them waiting for a reply.
+        self.sent = 0
+        self.requests = 0
+        # Replies matched to the requests.
+        self.received = 0
+        self.timeouts = 0
+        # Frames other than the awaited reply, e.g. a reply arriving after its
+        # request timed out.
+        self.mismatched = 0
+        self.telemetry = 0
+        self.rtt_hist = [0] * (len(RTT_BINS) + 1)
+        self.rtt_min = None
+        self.rtt_max = None
+        self.rtt_sum = 0.0
+        # Smoothed variation of consecutive RTTs (RFC 3550 interarrival
+        # jitter).
+        self.jitter = 0.0
+        self._last_rtt = None
+        # Host time when the latest status was received.
+        self.last_status_time = None
+
+    def add_sent(self, request=False):
+        with self.lock:
+            self.sent += 1
+            if request:
+                self.requests += 1
+
+    def add_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def add_mismatched(self):
+        with self.lock:
+            self.mismatched += 1
+
+    def add_telemetry(self):
+        with self.lock:
+            self.telemetry += 1
+
+    def set_status_time(self, now):
+        with self.lock:
+            self.last_status_time = now
+
+    def add_rtt(self, rtt):
+        with self.lock:
+            self.received += 1
+            self.rtt_hist[bisect.bisect_left(RTT_BINS, rtt)] += 1
+            self.rtt_sum += rtt
+            if self.rtt_min is None or rtt < self.rtt_min:
+                self.rtt_min = rtt
+            if self.rtt_max is None or rtt > self.rtt_max:
+                self.rtt_max = rtt
+            if self._last_rtt is not None:
+                self.jitter += (abs(rtt - self._last_rtt) - self.jitter) / 16
+            self._last_rtt = rtt
+
+    def mean_rtt(self):
+        return self.rtt_sum / self.received if self.received else None
 
+    def rtt_percentile(self, p):
+        """Returns the upper bound of the histogram bin holding the p-th
+        percentile of RTT, but not above the maximum RTT."""
+        with self.lock:
+            if not self.received:
+                return None
+            rank = self.received * p / 100.0
+            count = 0
+            for i, n in enumerate(self.rtt_hist):
+                count += n
+                if count >= rank and n:
+                    if i < len(RTT_BINS):
+                        return min(RTT_BINS[i], self.rtt_max)
+                    break
+            return self.rtt_max
 
-def _encode_int16(value):
-    # todo: check range
-    if value < 0:
-        value += 65536
-    return _pack_short(value)
+    def loss(self):
+        """Ratio of the requests which timed out."""
+        with self.lock:
+            done = self.received + self.timeouts
+            return self.timeouts / done if done else 0.0
 
+    def status_age(self, now=None):
+        """Seconds since the latest status was received."""
+        if self.last_status_time is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return now - self.last_status_time
+
+    def summary(self):
+        with self.lock:
+            return {
+                'duration': time.monotonic() - self.since,
+                'sent': self.sent,
+                'requests': self.requests,
+                'received': self.received,
+                'timeouts': self.timeouts,
+                'mismatched': self.mismatched,
+                'telemetry': self.telemetry,
+                'loss': self.loss(),
+                'rtt_min': self.rtt_min,
+                'rtt_mean': self.mean_rtt(),
+                'rtt_p50': self.rtt_percentile(50),
+                'rtt_p99': self.rtt_percentile(99),
+                'rtt_max': self.rtt_max,
+                'jitter': self.jitter,
+                'status_age': self.status_age(),
+            }
+
+    def format(self):
+        """Formats the statistics into a line (times in ms)."""
+
+        def ms(t):
+            return '-' if t is None else '%.3f' % (t * 1e3)
+
+        with self.lock:
+            return ('sent %d recv %d timeout %d (%.1f%%) mismatch %d tlm %d  '
+                    'rtt min %s p50 %s p99 %s max %s jitter %s  age %s' %
+                    (self.sent, self.received, self.timeouts,
+                     self.loss() * 100, self.mismatched, self.telemetry,
+                     ms(self.rtt_min), ms(self.rtt_percentile(50)),
+                     ms(self.rtt_percentile(99)), ms(self.rtt_max),
+                     ms(self.jitter), ms(self.status_age())))
+
+
+# A write not confirmed by a read is assumed to hold for this duration [s], and
+# repeated afterwards.
+DEFAULT_MAX_AGE = 1.0
+# A read within this duration [s] after a write may have been sent by the
+# drone before the write arrived.
+READBACK_GRACE = 0.05
+
+
+class RegisterCache:
+    """Shadow copy of the register file of the drone.
 
-def _decode_int16(d):
-    v = (int(d[0]) | (int(d[1]) << 8))
-    if v > 32767:
-        v -= 65536
-    return v
+    Keeps the value and host time of the last write and the last read of each
+    register. Values given to set() are desired: a write which the drone is
+    known to hold already is suppressed, and the others are kept dirty until
+    taken by take_dirty(). A desired value which a later read contradicts,
+    e.g. after a lost datagram or a reboot, becomes dirty again.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE, grace=READBACK_GRACE):
+        self.max_age = max_age
+        self.grace = grace
+        self.written = [None] * regs.N_REGISTERS
+        self.written_time = [0.0] * regs.N_REGISTERS
+        self.read = [None] * regs.N_REGISTERS
+        self.read_time = [0.0] * regs.N_REGISTERS
+        self.desired = {}
+        self.dirty = {}
+        # Writes suppressed by set().
+        self.suppressed = 0
+        # set() and take_dirty() may be called from different threads.
+        self._lock = threading.Lock()
+
+    def holds(self, addr, value, now):
+        """True if the drone is known to hold value at addr."""
+        if self.read_time[addr] > self.written_time[addr] + self.grace:
+            return self.read[addr] == value
+        return (self.written[addr] == value and
+                now < self.written_time[addr] + self.max_age)
+
+    def set(self, addr, value, now):
+        value = int(value)
+        with self._lock:
+            self.desired[addr] = value
+            if self.holds(addr, value, now):
+                self.dirty.pop(addr, None)
+                self.suppressed += 1
+            else:
+                self.dirty[addr] = value
+
+    def set_once(self, addr, value):
+        """Makes value dirty without keeping it desired, for a request which
+        the drone clears itself, e.g. CALIBRATE."""
+        with self._lock:
+            self.desired.pop(addr, None)
+            self.dirty[addr] = int(value)
+
+    def take_dirty(self):
+        """Returns {addr: value} to write, and clears them."""
+        with self._lock:
+            dirty = self.dirty
+            self.dirty = {}
+        return dirty
+
+    def on_written(self, addr, values, now):
+        n = len(values)
+        self.written[addr:addr + n] = values
+        self.written_time[addr:addr + n] = [now] * n
+
+    def on_read(self, addr, values, now):
+        n = len(values)
+        self.read[addr:addr + n] = values
+        self.read_time[addr:addr + n] = [now] * n
+        with self._lock:
+            for a, v in self.desired.items():
+                if (addr <= a < addr + n and values[a - addr] != v and
+                        now > self.written_time[a] + self.grace):
+                    self.dirty[a] = v
 
 
 class UDPCommand:
@@ -35,64 +259,326 @@ class UDPCommand:
     def __init__(self, addr, port):
         self.host = addr
         self.port = port
+        self.timeout = 0.01
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.settimeout(0.01)
+        self.socket.settimeout(self.timeout)
+        # The latest (elapsed, regs) pushed by the subscription.
+        self.last_telemetry = (None, None)
+        self.stats = LinkStats()
+        self.cache = RegisterCache()
+        # Frames are received into and sent from these buffers, which are
+        # reused, instead of allocating bytes for each frame.
+        self._rx = bytearray(codec.MAX_FRAME_SIZE)
+        self._rx_view = memoryview(self._rx)
+        self._tx = bytearray(codec.MAX_FRAME_SIZE)
+        # Sequence number of the last multi-range read.
+        self._seq = 0
+        # Status requests use the delta-encoded status if True. It saves
+        # airtime when several drones share a channel.
+        self.delta_status = False
+        # The last snapshot (id, values) of the delta-encoded status.
+        self._snapshot = None
+        # The snapshot id acknowledged by the last delta status request. Its
+        # reply is a delta against it, or a full frame (base 0).
+        self._status_ack = 0
+        # Host time of the status request waiting for receive_all_status().
+        self._status_request_time = None
+        self._dump_interval = None
+        self._dump_file = None
+        self._next_dump = None
 
-    def read_reg(self, addr):
-        cmd = b'\x00' + _pack_byte(addr)
-        self.socket.sendto(cmd, (self.host, self.port))
+    def dump_stats(self, interval, file=sys.stderr):
+        """Prints the link statistics to file every interval seconds, and
+        resets them. Disabled if interval is None."""
+        self._dump_interval = interval
+        self._dump_file = file
+        self._next_dump = None
+        if interval is not None:
+            self._next_dump = time.monotonic() + interval
+
+    def _maybe_dump_stats(self, now):
+        if self._next_dump is None or now < self._next_dump:
+            return
+        with self.stats.lock:
+            print(self.stats.format(), file=self._dump_file)
+            self.stats.reset()
+        self._next_dump = max(self._next_dump + self._dump_interval, now)
+
+    def _send(self, frame, request=False):
+        self.socket.sendto(frame, (self.host, self.port))
+        self.stats.add_sent(request)
+
+    def _recv(self):
+        """Receives a frame into the receive buffer and returns a view of it.
+
+        The view is valid until the next receive.
+        """
+        n = self.socket.recv_into(self._rx)
+        return self._rx_view[:n]
+
+    def _on_status(self, d, now):
+        """Decodes a status frame into (elapsed, regs), and caches them."""
+        st = codec.decode_status_frame(d)
+        self.stats.set_status_time(now)
+        self.cache.on_read(codec.FIRST_STATUS_REG,
+                           st[1][codec.FIRST_STATUS_REG:], now)
+        return st
+
+    def _status_request(self):
+        if not self.delta_status:
+            return codec.STATUS_REQUEST
+        self._status_ack = 0 if self._snapshot is None else self._snapshot[0]
+        return codec.encode_delta_status(self._status_ack)
+
+    def _is_delta_reply(self, d):
+        """True if d is a delta-encoded status reply to the last request,
+        judged by the base id it carries."""
+        return (len(d) >= 3 and d[0] == codec.OP_DELTA_STATUS and
+                d[2] in (0, self._status_ack))
+
+    def _on_delta_status(self, d, now):
+        """Decodes a delta-encoded status reply into (elapsed, regs), or
+        (None, None) if it cannot be decoded against the last snapshot, which
+        is then kept."""
+        snapshot = codec.decode_delta_status(d, self._snapshot)
+        if snapshot is None:
+            return None, None
+        self._snapshot = snapshot
+        self.stats.set_status_time(now)
+        self.cache.on_read(codec.FIRST_STATUS_REG, snapshot[1], now)
+        return codec.decode_status(list(snapshot[1]))
+
+    def _on_telemetry(self, d):
+        self.stats.add_telemetry()
+        if not codec.is_status_frame(d):
+            return None
+        self.last_telemetry = self._on_status(d, time.monotonic())
+        return self.last_telemetry
+
+    def _request(self, frame, opcode, header=None, match=None):
+        """Sends a request and receives its reply, skipping telemetry frames.
+
+        A reply must start with opcode and then header bytes, if given, and be
+        accepted by match(frame), if given. Returns None on timeout.
+        """
+        self._send(frame, request=True)
+        sent_time = time.monotonic()
+        deadline = sent_time + self.timeout
         try:
-            d = self.socket.recv(64)
-        except socket.timeout:
+            while True:
+                try:
+                    d = self._recv()
+                except socket.timeout:
+                    break
+                now = time.monotonic()
+                if d and d[0] == codec.OP_SUBSCRIBE:
+                    self._on_telemetry(d)
+                elif (d and d[0] == opcode and
+                      (header is None or d[1:1 + len(header)] == header) and
+                      (match is None or match(d))):
+                    self.stats.add_rtt(now - sent_time)
+                    self._maybe_dump_stats(now)
+                    return d
+                else:
+                    self.stats.add_mismatched()
+                remaining = deadline - now
+                if remaining <= 0:
+                    break
+                self.socket.settimeout(remaining)
+        finally:
+            self.socket.settimeout(self.timeout)
+        self.stats.add_timeout()
+        self._maybe_dump_stats(time.monotonic())
+        return None
+
+    def read_reg(self, addr):
+        d = self._request(codec.encode_read(addr), codec.OP_READ)
+        if d is None:
             return None
-        return _decode_int16(d[1:])
+        value = codec.decode_read(d)
+        self.cache.on_read(addr, [value], time.monotonic())
+        return value
 
     def write_reg(self, addr, value):
-        if value < 0:
-            value += 65536
-        cmd = b'\x01' + _pack_byte(addr) + _pack_short(value)
-        self.socket.sendto(cmd, (self.host, self.port))
+        """Writes a register, even if the drone already holds the value."""
+        self._send(codec.encode_write(addr, value))
+        self.cache.on_written(addr, [value], time.monotonic())
 
     def bulk_read(self, addr, n):
-        cmd = b'\x02' + _pack_byte(addr)
-        cmd += _pack_byte(n)
-        self.socket.sendto(cmd, (self.host, self.port))
-        result = []
-        try:
-            d = self.socket.recv(64)
-        except socket.timeout:
+        d = self._request(codec.encode_bulk_read(addr, n), codec.OP_BULK_READ,
+                          bytes((addr, n)))
+        if d is None:
+            return None
+        values = codec.decode_bulk_read(d, addr, n)
+        self.cache.on_read(addr, values, time.monotonic())
+        return values
+
+    def multi_read(self, ranges):
+        """Reads several ranges [(addr, n), ...] with one request.
+
+        Returns a list of the values of each range, or None on timeout. The
+        request carries a sequence number, so that a late reply to an earlier
+        request is never taken as the answer.
+        """
+        self._seq = (self._seq + 1) & 0xff
+        seq = self._seq
+        d = self._request(codec.encode_multi_read(seq, ranges),
+                          codec.OP_MULTI_READ, bytes((seq, len(ranges))))
+        if d is None:
             return None
-        if d[0] != 0x02:
+        values = codec.decode_multi_read(d, seq, ranges)
+        if values is None:
             return None
-        assert int(d[1]) == addr
-        assert int(d[2]) == n
-        assert len(d) == 3 + n * 2
-        for i in range(0, n):
-            j = i * 2 + 3
-            result.append(_decode_int16(d[j:j + 2]))
-        return result
+        now = time.monotonic()
+        for (addr, _), v in zip(ranges, values):
+            self.cache.on_read(addr, v, now)
+        return values
 
     def bulk_write(self, addr, values):
-        cmd = b'\x03' + _pack_byte(addr)
-        cmd += _pack_byte(len(values))
-        for v in values:
-            cmd += _encode_int16(v)
-        self.socket.sendto(cmd, (self.host, self.port))
+        self._send(codec.encode_bulk_write(addr, values, self._tx))
+        self.cache.on_written(addr, values, time.monotonic())
+
+    def write_regs(self, values):
+        """Writes {addr: value} with one bulk write per contiguous range."""
+        for addr, v in contiguous_ranges(values):
+            self.bulk_write(addr, v)
+
+    def set_reg(self, addr, value):
+        """Sets a register to be written by the next flush(), unless the drone
+        already holds the value (see RegisterCache)."""
+        self.cache.set(addr, value, time.monotonic())
+
+    def set_regs(self, values):
+        """set_reg() for each of {addr: value}."""
+        now = time.monotonic()
+        for addr, v in values.items():
+            self.cache.set(addr, v, now)
+
+    def request_reg(self, addr, value):
+        """Sets a request register, e.g. CALIBRATE, to be written once by the
+        next flush(). Unlike set_reg(), the value is not written again when
+        the drone changes it."""
+        self.cache.set_once(addr, value)
+
+    def flush(self):
+        """Writes the registers set since the last flush, with one bulk write
+        per contiguous range. Returns the number of registers written."""
+        dirty = self.cache.take_dirty()
+        if dirty:
+            self.write_regs(dirty)
+        return len(dirty)
 
     def read_all_status(self):
-        FIRST_STATUS_REG = regs.CALIBRATE
-        rd = self.bulk_read(FIRST_STATUS_REG,
-                            regs.N_REGISTERS - FIRST_STATUS_REG)
-        if rd is None:
+        if self.delta_status:
+            d = self._request(self._status_request(), codec.OP_DELTA_STATUS,
+                              match=self._is_delta_reply)
+            if d is None:
+                return None, None
+            st = self._on_delta_status(d, time.monotonic())
+            if st[0] is None:
+                self.stats.add_mismatched()
+            return st
+        d = self._request(codec.STATUS_REQUEST, codec.OP_BULK_READ,
+                          codec.STATUS_REQUEST[1:])
+        if d is None or not codec.is_status_frame(d):
             return None, None
-        d = [None] * FIRST_STATUS_REG + rd
-        elapsed = 0
-        for i in range(2):
-            v = d[regs.ELAPSED_L + i]
-            if v < 0:
-                v += 65536
-            elapsed |= (v << (i * 16))
-        return elapsed, d
+        return self._on_status(d, time.monotonic())
+
+    def request_all_status(self):
+        """Sends a status request without waiting for the reply.
+
+        For event loops, which call receive_all_status() when the socket
+        becomes readable. The previous request is counted as timed out if it
+        has not been answered yet.
+        """
+        now = time.monotonic()
+        if self._status_request_time is not None:
+            self.stats.add_timeout()
+        self._send(self._status_request(), request=True)
+        self._status_request_time = now
+        self._maybe_dump_stats(now)
+
+    def receive_all_status(self):
+        """Receives a status reply or a telemetry frame.
+
+        Returns (elapsed, regs) like read_all_status(), or (None, None) for
+        any other frame.
+        """
+        try:
+            d = self._recv()
+        except (socket.timeout, BlockingIOError, ConnectionRefusedError):
+            return None, None
+        if d and d[0] == codec.OP_SUBSCRIBE:
+            st = self._on_telemetry(d)
+            return (None, None) if st is None else st
+        if self._status_request_time is not None and self.delta_status:
+            # Frames other than the reply, e.g. the late reply of a request
+            # counted as timed out, leave the snapshot and the request as
+            # they are.
+            now = time.monotonic()
+            st = (None, None)
+            if self._is_delta_reply(d):
+                st = self._on_delta_status(d, now)
+            if st[0] is None:
+                self.stats.add_mismatched()
+                return st
+            self.stats.add_rtt(now - self._status_request_time)
+            self._status_request_time = None
+            return st
+        if not codec.is_status_frame(d) or self._status_request_time is None:
+            # Not a status reply, or the reply of a request already counted
+            # as timed out.
+            self.stats.add_mismatched()
+            return None, None
+        now = time.monotonic()
+        self.stats.add_rtt(now - self._status_request_time)
+        self._status_request_time = None
+        return self._on_status(d, now)
+
+    def subscribe(self, interval_ms):
+        """Requests the drone to push the status registers every interval_ms.
+
+        The subscription ends when interval_ms is 0, or the drone does not
+        receive any command for a while.
+        """
+        self._send(
+            codec.encode_subscribe(codec.FIRST_STATUS_REG,
+                                   codec.N_STATUS_REGS, interval_ms))
+
+    def telemetry(self, interval_ms=10, resubscribe_timeout=0.1, stop=None):
+        """Yields (elapsed, regs) pushed by the drone, like read_all_status().
+
+        Subscribes again every SUBSCRIPTION_KEEPALIVE seconds, or when nothing
+        arrives for resubscribe_timeout seconds, and unsubscribes when the
+        generator is closed or returns. It returns when stop
+        (threading.Event), if given, is set, which is checked on every
+        frame and receive timeout.
+        """
+        self.subscribe(interval_ms)
+        last_subscribed = last_received = time.monotonic()
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    d = self._recv()
+                except socket.timeout:
+                    d = None
+                now = time.monotonic()
+                self._maybe_dump_stats(now)
+                st = None
+                if d and d[0] == codec.OP_SUBSCRIBE:
+                    st = self._on_telemetry(d)
+                elif d:
+                    self.stats.add_mismatched()
+                if st is not None:
+                    last_received = now
+                if (now > last_received + resubscribe_timeout or
+                        now > last_subscribed + SUBSCRIPTION_KEEPALIVE):
+                    self.subscribe(interval_ms)
+                    last_subscribed = last_received = now
+                if st is not None:
+                    yield st
+        finally:
+            self.subscribe(0)
 
     def close(self):
         self.socket.close()
@@ -111,6 +597,7 @@ def main(argv):
             udp.write_reg(regs.GAIN_PITCH_P, int(msg))
             udp.write_reg(regs.JS_THROTTLE, 100)
         print(udp.read_all_status())
+        print(udp.stats.format())
 
     udp.close()
 
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top-level modules.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+import emulator  # noqa: E402
+import udp_command  # noqa: E402
+
+
+@pytest.fixture
+def emu():
+    """An Emulator handling requests in-process, without a socket."""
+    return emulator.Emulator()
+
+
+@pytest.fixture
+def server():
+    """An EmulatorServer on a free local port."""
+    s = emulator.EmulatorServer(port=0)
+    s.start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture
+def udp(server):
+    """A UDPCommand talking to server."""
+    u = udp_command.UDPCommand(*server.address)
+    u.timeout = 0.1
+    yield u
+    u.close()
@@ -0,0 +1,161 @@
+# Frames of the UDP register protocol, checked against the emulator.
+
+import socket
+import time
+
+import codec
+import registers as regs
+
+
+def test_read_write_round_trip(emu):
+    for value in (0, 1, -1, 32767, -32768):
+        emu.on_udp_received(0, codec.encode_write(regs.TARGET_YAW, value))
+        d = emu.on_udp_received(0, codec.encode_read(regs.TARGET_YAW))
+        assert codec.decode_read(d) == value
+
+
+def test_bulk_round_trip(emu):
+    values = [100, -200, 32767, -32768, 0]
+    buf = bytearray(codec.MAX_FRAME_SIZE)
+    for frame in (codec.encode_bulk_write(regs.GAIN_YAW_P, values),
+                  codec.encode_bulk_write(regs.GAIN_YAW_P, values, buf)):
+        emu.init_regs()
+        emu.on_udp_received(0, frame)
+        d = emu.on_udp_received(
+            0, codec.encode_bulk_read(regs.GAIN_YAW_P, len(values)))
+        assert codec.decode_bulk_read(d, regs.GAIN_YAW_P,
+                                      len(values)) == values
+
+
+def test_status_frame(emu):
+    emu.reg[regs.ELAPSED_L] = -2  # 0xfffe
+    emu.reg[regs.ELAPSED_H] = 3
+    emu.reg[regs.YAW_ANGLE] = -1234
+    d = emu.on_udp_received(0, codec.STATUS_REQUEST)
+    assert codec.is_status_frame(d)
+    elapsed, values = codec.decode_status_frame(d)
+    assert elapsed == 0x3fffe
+    assert values[regs.YAW_ANGLE] == -1234
+    assert len(values) == regs.FIRST_STATUS_REG + regs.N_STATUS_REGS
+
+
+def test_multi_read(emu):
+    emu.reg[regs.TRIM_ROLL] = -5
+    emu.reg[regs.BATT_VOLTAGE] = 3900
+    ranges = [(regs.TRIM_PITCH, 2), (regs.BATT_VOLTAGE, 1)]
+    d = emu.on_udp_received(0, codec.encode_multi_read(7, ranges))
+    assert codec.decode_multi_read(d, 7, ranges) == [[0, -5], [3900]]
+    # The reply of another request.
+    assert codec.decode_multi_read(d, 8, ranges) is None
+    assert codec.decode_multi_read(d, 7, ranges[:1]) is None
+
+
+def test_multi_read_udp(server, udp):
+    server.emulator.reg[regs.GAIN_ROLL_D] = 321
+    ranges = [(regs.GAIN_ROLL_P, 2), (regs.LIMITTER, 1)]
+    assert udp.multi_read(ranges) == [[0, 321], [600]]
+    assert udp.multi_read(ranges) == [[0, 321], [600]]
+    assert udp.stats.timeouts == 0
+
+
+class DeltaClient:
+    """Requests the delta-encoded status of an Emulator like UDPCommand."""
+
+    def __init__(self, emu):
+        self.emu = emu
+        self.snapshot = None
+
+    def request(self):
+        ack = 0 if self.snapshot is None else self.snapshot[0]
+        return self.emu.on_udp_received(0, codec.encode_delta_status(ack))
+
+    def decode(self, d):
+        self.snapshot = codec.decode_delta_status(d, self.snapshot)
+        return self.snapshot
+
+    def expected(self):
+        return self.emu.reg[regs.FIRST_STATUS_REG:regs.FIRST_STATUS_REG +
+                            regs.N_STATUS_REGS]
+
+
+def test_delta_status(emu):
+    c = DeltaClient(emu)
+    d = c.request()
+    assert d[2] == 0
+    assert len(d) == 3 + regs.N_STATUS_REGS * 2
+    assert c.decode(d)[1] == c.expected()
+
+    # Unchanged, and then a change wrapping around int16.
+    d = c.request()
+    assert len(d) == 3 + codec.STATUS_BITMAP_SIZE
+    assert c.decode(d)[1] == c.expected()
+    emu.reg[regs.YAW_ANGLE] = 32767
+    c.decode(c.request())
+    emu.reg[regs.YAW_ANGLE] = -32768
+    emu.reg[regs.ACCEL_Z] = 1000
+    d = c.request()
+    assert d[2] != 0
+    assert c.decode(d)[1] == c.expected()
+
+
+def test_delta_status_lost_reply(emu):
+    c = DeltaClient(emu)
+    c.decode(c.request())
+    c.decode(c.request())
+    acked = c.snapshot[0]
+    emu.reg[regs.PITCH_ANGLE] = 42
+    # The reply is lost, so the next request acknowledges the same snapshot,
+    # and the delta is made against it again.
+    c.request()
+    emu.reg[regs.ROLL_ANGLE] = -42
+    d = c.request()
+    assert d[2] == acked
+    assert c.decode(d)[1] == c.expected()
+
+
+def test_delta_status_lost_request(emu):
+    c = DeltaClient(emu)
+    c.decode(c.request())
+    # An unknown snapshot falls back to a full frame.
+    c.snapshot = (c.snapshot[0] % 255 + 1, c.snapshot[1])
+    d = c.request()
+    assert d[2] == 0
+    assert c.decode(d)[1] == c.expected()
+
+
+def test_delta_status_base_mismatch(emu):
+    c = DeltaClient(emu)
+    c.decode(c.request())
+    d = c.request()
+    assert codec.decode_delta_status(d, None) is None
+    other = (d[2] % 255 + 1, c.expected())
+    assert codec.decode_delta_status(d, other) is None
+
+
+def test_delta_status_late_reply(server, udp):
+    udp.delta_status = True
+    t, d = udp.read_all_status()
+    assert t is not None
+    snapshot = udp._snapshot
+    udp.socket.setblocking(False)
+    udp.request_all_status()
+    # A reply of an earlier request against another base, arriving late.
+    late = bytes((codec.OP_DELTA_STATUS, snapshot[0] % 255 + 1,
+                  (snapshot[0] + 1) % 255 + 1)) + bytes(
+                      codec.STATUS_BITMAP_SIZE)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.sendto(late, udp.socket.getsockname())
+    statuses = []
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline and udp.stats.mismatched == 0:
+        st = udp.receive_all_status()
+        if st[0] is not None:
+            statuses.append(st)
+    assert udp.stats.mismatched == 1
+    while time.monotonic() < deadline and not statuses:
+        st = udp.receive_all_status()
+        if st[0] is not None:
+            statuses.append(st)
+    assert len(statuses) == 1
+    assert udp.stats.timeouts == 0
+    assert udp._snapshot[0] not in (0, snapshot[0])
@@ -0,0 +1,52 @@
+import registers as regs
+import udp_command
+
+ADDR = regs.TRIM_ROLL
+
+
+def test_suppresses_held_value():
+    cache = udp_command.RegisterCache(max_age=1.0, grace=0.05)
+    cache.set(ADDR, 10, 0.0)
+    assert cache.take_dirty() == {ADDR: 10}
+    cache.on_written(ADDR, [10], 0.0)
+    cache.set(ADDR, 10, 0.5)
+    assert cache.take_dirty() == {}
+    assert cache.suppressed == 1
+    # A new value is written at once.
+    cache.set(ADDR, 11, 0.6)
+    assert cache.take_dirty() == {ADDR: 11}
+
+
+def test_resends_after_max_age():
+    cache = udp_command.RegisterCache(max_age=1.0, grace=0.05)
+    cache.set(ADDR, 10, 0.0)
+    cache.on_written(ADDR, list(cache.take_dirty().values()), 0.0)
+    cache.set(ADDR, 10, 1.5)
+    assert cache.take_dirty() == {ADDR: 10}
+
+
+def test_read_confirms_and_contradicts():
+    cache = udp_command.RegisterCache(max_age=1.0, grace=0.05)
+    cache.set(ADDR, 10, 0.0)
+    cache.on_written(ADDR, [10], 0.0)
+    cache.take_dirty()
+    # Confirmed by a read, the value is held beyond max_age.
+    cache.on_read(ADDR, [10], 0.1)
+    cache.set(ADDR, 10, 5.0)
+    assert cache.take_dirty() == {}
+    # A read within the grace period may predate the write.
+    cache.on_written(ADDR, [10], 5.0)
+    cache.on_read(ADDR, [0], 5.01)
+    assert cache.take_dirty() == {}
+    # A later read shows the write was lost, e.g. after a reboot.
+    cache.on_read(ADDR, [0], 5.2)
+    assert cache.take_dirty() == {ADDR: 10}
+
+
+def test_set_once_is_not_desired():
+    cache = udp_command.RegisterCache()
+    cache.set_once(regs.CALIBRATE, 1)
+    assert cache.take_dirty() == {regs.CALIBRATE: 1}
+    cache.on_written(regs.CALIBRATE, [1], 0.0)
+    cache.on_read(regs.CALIBRATE, [0], 10.0)
+    assert cache.take_dirty() == {}
@@ -0,0 +1,64 @@
+import pytest
+
+import scheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_overrun_starts_next_period_at_once():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    durations = [0.01, 0.25, 0.01, 0.01]
+
+    def func(now):
+        clock.now += durations.pop(0)
+
+    task = sched.add('t', 10, func)
+    assert sched.run_due() == pytest.approx(0.09)
+    clock.now = 0.1
+    # Runs until 0.35, past the deadline of 0.2.
+    assert sched.run_due() == 0.0
+    assert task.overruns == 1
+    assert task.next_time == pytest.approx(0.35)
+    # Not bursting to catch up on the missed deadlines.
+    sched.run_due()
+    assert task.next_time == pytest.approx(0.45)
+    assert task.runs == 3
+    assert task.overruns == 1
+    assert task.max_lateness == pytest.approx(0.0)
+
+
+def test_lateness_and_rate():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+    task = sched.add('t', 100, lambda now: None)
+    for i in range(10):
+        clock.now = i * 0.01 + 0.003
+        sched.run_due()
+    assert task.runs == 10
+    assert task.overruns == 0
+    assert task.max_lateness == pytest.approx(0.003)
+    assert task.rate(0.1) == pytest.approx(100)
+    assert sched.format_stats(0.1) == 't 100.0 Hz overrun 0 late 3.0 ms'
+    assert task.runs == 0
+
+
+def test_zero_rate_never_overruns():
+    clock = FakeClock()
+    sched = scheduler.Scheduler(clock)
+
+    def func(now):
+        clock.now += 1.0
+
+    task = sched.add('t', 0, func)
+    for _ in range(3):
+        sched.run_due()
+    assert task.runs == 3
+    assert task.overruns == 0